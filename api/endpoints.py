@@ -1,12 +1,21 @@
 # local_memory_service/api/endpoints.py
 
-from fastapi import APIRouter, status
-from pydantic import BaseModel, Field
-import threading
-from typing import List, Optional, Dict, Any
+from fastapi import APIRouter, Request, Query, status
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field, ValidationError
+import asyncio
+import json
+from typing import List, Optional, Dict, Any, Awaitable
 
+from core.config import settings
+from core.metrics import registry, timed_stage, STAGE_FAILURES
 from services.state_manager import state_manager
 from services.rag_service import rag_task, summary_task
+from services.ingest_service import BulkIngestor, summarize_results
+from services.relevance_gate import relevance_gate
+from services.rolling_summary import rolling_summarizer
+from services.response_cache import response_cache
+from services.enhance_service import enhance_prompt_events
 from db.vector_db import vector_db_client  # 导入新的DB客户端
 
 router = APIRouter()
@@ -23,10 +32,61 @@ class ProcessTaskResponse(BaseModel):
     rag_context: Optional[str]
     summary: Optional[str]
 
+class MetadataFilter(BaseModel):
+    """元数据过滤条件，各字段之间是 AND 关系"""
+    source: Optional[List[str]] = None       # 来源是其中任意一个
+    tags: Optional[List[str]] = None         # 带有其中任意一个标签
+    tags_all: Optional[List[str]] = None     # 带有全部这些标签
+    created_after: Optional[float] = None    # unix 时间戳，包含
+    created_before: Optional[float] = None   # unix 时间戳，不包含
+
+class QueryRequest(BaseModel):
+    query: str
+    k: int = Field(default=5, gt=0, le=100)
+    nprobe: Optional[int] = Field(default=None, gt=0)
+    exact: bool = False
+    filters: Optional[MetadataFilter] = None
+
+class QueryBatchRequest(BaseModel):
+    queries: List[str]
+    k: int = Field(default=5, gt=0, le=100)
+    nprobe: Optional[int] = Field(default=None, gt=0)
+    exact: bool = False
+    filters: Optional[MetadataFilter] = None
+
+class EnhanceRequest(BaseModel):
+    prompt: str
+
 # 新增：用于添加文档的请求模型
 class AddDocumentRequest(BaseModel):
     document: str
     source: str = "user_provided"
+    tags: List[str] = []
+    doc_id: Optional[str] = None             # 已存在时替换该文档；不填则自动生成
+
+    def metadata(self) -> Dict[str, Any]:
+        metadata: Dict[str, Any] = {"source": self.source}
+        if self.tags:
+            metadata["tags"] = self.tags
+        if self.doc_id is not None:
+            metadata["doc_id"] = self.doc_id
+        return metadata
+
+class DeleteDocumentsRequest(BaseModel):
+    doc_ids: List[str]
+
+class BulkItemResult(BaseModel):
+    index: int
+    status: str                              # success / duplicate / error
+    doc_id: Optional[str] = None             # duplicate 时为已有文档的 doc_id
+    chunks: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkAddDocumentsResponse(BaseModel):
+    added: int
+    duplicates: int
+    failed: int
+    results: List[BulkItemResult]
 
 # --- API 端点 ---
 @router.post("/enable", status_code=status.HTTP_200_OK)
@@ -37,22 +97,204 @@ def toggle_service(request: EnableRequest):
 # 新增：添加文档的端点
 @router.post("/add_document", status_code=status.HTTP_201_CREATED)
 def add_document(request: AddDocumentRequest):
-    """接收并处理要添加到向量数据库的文档"""
-    metadata = {"source": request.source}
-    vector_db_client.add_document(request.document, metadata)
-    return {"status": "success", "message": "Document added."}
+    """
+    接收并处理要添加到向量数据库的文档；带 doc_id 时替换同 ID 的旧文档（不做去重）。
+    不带 doc_id 且与已有文档重复（或近似重复）时不写入，返回 200 和已有文档的 doc_id；
+    带 doc_id 且内容没有变化时同样返回 200
+    """
+    result = vector_db_client.add_document(request.document, request.metadata())
+    if result is None:
+        return JSONResponse(status_code=status.HTTP_502_BAD_GATEWAY,
+                            content={"status": "error", "message": "Failed to embed document."})
+    if result["duplicate_of"] is not None:
+        return JSONResponse(status_code=status.HTTP_200_OK,
+                            content={"status": "duplicate", "message": "Document already exists.",
+                                     "doc_id": result["duplicate_of"]})
+    return {"status": "success", "message": "Document added.", "doc_id": result["doc_id"], "chunks": result["chunks"]}
 
-@router.post("/process_task", response_model=ProcessTaskResponse)
-def process_task(request: ProcessTaskRequest):
-    results: Dict[str, Any] = {'rag_context': None, 'summary': None}
-    
-    rag_thread = threading.Thread(target=rag_task, args=(request.task_description, results))
-    summary_thread = threading.Thread(target=summary_task, args=(request.history, results))
+@router.put("/documents/{doc_id}")
+def upsert_document(doc_id: str, request: AddDocumentRequest):
+    """按 doc_id 写入文档：已存在时替换，旧版本立即对查询不可见；内容没有变化时不重写"""
+    metadata = request.metadata()
+    metadata["doc_id"] = doc_id
+    try:
+        result = vector_db_client.add_documents([request.document], [metadata], skip_duplicates=False)[0]
+    except Exception as e:
+        print(f"Error upserting document {doc_id}: {e}")
+        return JSONResponse(status_code=status.HTTP_502_BAD_GATEWAY,
+                            content={"status": "error", "message": "Failed to embed document."})
+    return {"status": "success", "doc_id": doc_id, "chunks": result["chunks"],
+            "unchanged": result["duplicate_of"] is not None}
+
+@router.delete("/documents/{doc_id}")
+def delete_document(doc_id: str):
+    """按 doc_id 删除文档"""
+    deleted = vector_db_client.delete_documents([doc_id])
+    if not deleted:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                            content={"status": "error", "message": f"Document '{doc_id}' not found."})
+    return {"status": "success", "deleted": deleted}
+
+@router.post("/delete_documents")
+def delete_documents(request: DeleteDocumentsRequest):
+    """批量删除：所有 doc_id 在一次提交中删除，返回删除的行数"""
+    return {"status": "success", "deleted": vector_db_client.delete_documents(request.doc_ids)}
+
+@router.post("/compact")
+def compact():
+    """立即压缩：重写段文件和元数据，清除已删除/被替换的行（通常由后台按阈值自动进行）"""
+    try:
+        return {"status": "success", **vector_db_client.compact()}
+    except RuntimeError as e:
+        return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={"status": "error", "message": str(e)})
+
+@router.post("/add_documents", response_model=BulkAddDocumentsResponse)
+async def add_documents(
+    documents: List[AddDocumentRequest],
+    batch_size: Optional[int] = Query(default=None, gt=0),
+):
+    """批量添加文档（JSON 数组），按批调用嵌入API并逐条返回结果"""
+    ingestor = BulkIngestor(batch_size=batch_size)
+    for index, item in enumerate(documents):
+        await ingestor.submit(index, item.document, item.metadata())
+    return summarize_results(await ingestor.finish())
+
+@router.post("/add_documents/ndjson", response_model=BulkAddDocumentsResponse)
+async def add_documents_ndjson(
+    request: Request,
+    batch_size: Optional[int] = Query(default=None, gt=0),
+):
+    """
+    流式批量添加（application/x-ndjson，每行一个 AddDocumentRequest）。
+    边接收边分批嵌入，无需先把整个上传读入内存。
+    """
+    ingestor = BulkIngestor(batch_size=batch_size)
+    index = 0
+    # 还没遇到换行的一行，按到达的数据块分段保存
+    partial: List[bytes] = []
+
+    async def handle_line(line: bytes):
+        nonlocal index
+        if not line.strip():
+            return
+        try:
+            item = AddDocumentRequest.model_validate(json.loads(line))
+        except (ValueError, ValidationError) as e:
+            ingestor.fail(index, f"Invalid NDJSON line: {e}")
+        else:
+            await ingestor.submit(index, item.document, item.metadata())
+        index += 1
+
+    async for chunk in request.stream():
+        # 只切分新到的数据块，不反复拼接、切分整个缓冲区（大上传时是平方级的）
+        *lines, tail = chunk.split(b"\n")
+        if lines:
+            await handle_line(b"".join(partial) + lines[0])
+            for line in lines[1:]:
+                await handle_line(line)
+            partial = []
+        partial.append(tail)
+    await handle_line(b"".join(partial))
 
-    rag_thread.start()
-    summary_thread.start()
+    return summarize_results(await ingestor.finish())
+
+def _filters(filters: Optional[MetadataFilter]) -> Optional[Dict[str, Any]]:
+    return filters.model_dump(exclude_none=True) if filters is not None else None
+
+@router.post("/query")
+def query(request: QueryRequest):
+    """单条检索，可按来源、标签、时间范围过滤"""
+    return {"results": vector_db_client.query(
+        request.query, k=request.k, nprobe=request.nprobe, exact=request.exact,
+        filters=_filters(request.filters))}
+
+@router.post("/query_batch")
+def query_batch(request: QueryBatchRequest):
+    """批量检索：分批嵌入，矩阵-矩阵打分，按输入顺序返回每条查询的 top-k"""
+    return {"results": vector_db_client.query_batch(
+        request.queries, k=request.k, nprobe=request.nprobe, exact=request.exact,
+        filters=_filters(request.filters))}
+
+@router.get("/embedding_cache/stats")
+def embedding_cache_stats():
+    """嵌入缓存命中/未命中计数"""
+    cache = vector_db_client.embedding_cache
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@router.get("/embedding_batcher/stats")
+def embedding_batcher_stats():
+    """嵌入请求合并：API 调用次数、平均每次合并的请求数、限流次数和当前并发上限"""
+    return vector_db_client.embedding_batcher_stats()
+
+@router.get("/storage/stats")
+def storage_stats(recall_sample: int = Query(default=0, ge=0, le=10000), k: int = Query(default=10, gt=0)):
+    """扫描数据的内存占用、已删除待压缩的行数；recall_sample > 0 时额外报告与 float32 相比的 recall@k"""
+    return vector_db_client.storage_stats(recall_sample=recall_sample, k=k)
+
+@router.get("/ready")
+def ready():
+    """向量数据库是否已在后台加载完成；加载中返回 503，可用作就绪探针"""
+    if not vector_db_client.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"ready": False})
+    return {"ready": True, "rows": len(vector_db_client), "load_seconds": vector_db_client.load_seconds}
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus 文本格式的指标：各阶段/外部调用耗时直方图、缓存与失败计数、进行中数量"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/relevance_gate/stats")
+def relevance_gate_stats():
+    """相关性门控的本地判定 / LLM 调用计数"""
+    return relevance_gate.stats()
+
+@router.get("/summary_cache/stats")
+def summary_cache_stats():
+    """滚动摘要缓存：直接命中 / 增量更新 / 完整摘要的次数，以及实际发送给LLM的轮次数"""
+    return rolling_summarizer.stats()
+
+@router.get("/response_cache/stats")
+def response_cache_stats():
+    """检索结果语义缓存的命中率、条目数以及因知识库更新而整体作废的次数"""
+    return response_cache.stats()
+
+@router.get("/ingest/stats")
+def ingest_stats():
+    """写入前的切块与去重：新增 / 重复 / 未变化的文档数、写入的块数以及指纹库大小"""
+    return vector_db_client.ingest_stats()
+
+async def _run_stage(name: str, stage: Awaitable[Optional[str]], timeout: float) -> Optional[str]:
+    """执行一个流水线阶段；超时或出错时记录日志并返回 None，不影响其他阶段。"""
+    try:
+        with timed_stage(name):
+            async with asyncio.timeout(timeout):
+                return await stage
+    except TimeoutError:
+        print(f"Stage '{name}' timed out after {timeout}s.")
+        STAGE_FAILURES.inc(stage=name, reason="timeout")
+    except Exception as e:
+        print(f"Stage '{name}' failed: {e}")
+        STAGE_FAILURES.inc(stage=name, reason="error")
+    return None
+
+@router.post("/process_task", response_model=ProcessTaskResponse)
+async def process_task(request: ProcessTaskRequest):
+    # 两个阶段在同一个事件循环中并发执行；客户端断开时 TaskGroup 会取消未完成的阶段
+    async with asyncio.TaskGroup() as tg:
+        rag = tg.create_task(_run_stage(
+            "rag", rag_task(request.task_description), settings.pipeline.rag_timeout))
+        summary = tg.create_task(_run_stage(
+            "summary", summary_task(request.history), settings.pipeline.summary_timeout))
 
-    rag_thread.join()
-    summary_thread.join()
+    return ProcessTaskResponse(rag_context=rag.result(), summary=summary.result())
 
-    return ProcessTaskResponse(**results)
\ No newline at end of file
+@router.post("/enhance")
+async def enhance(request: EnhanceRequest):
+    """检索 + 精炼一次完成，精炼结果通过 SSE 逐 token 推送"""
+    return StreamingResponse(
+        enhance_prompt_events(request.prompt),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
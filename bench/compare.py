@@ -0,0 +1,77 @@
+"""
+比较两次 bench/run_bench.py 的结果，逐项打印变化比例。
+
+用法:
+  python bench/compare.py baseline.json current.json [--threshold 0.10] [--fail-on-regression]
+
+吞吐类指标（*_per_s）越大越好，其余时间类指标（*_ms、*_s）越小越好；
+变差超过 threshold 的项标记为 REGRESSION。
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict
+
+
+def flatten(report: dict) -> Dict[str, float]:
+    """把结果展开成 {指标路径: 数值}，列表项用其规模/并发度/模式作为键。"""
+    metrics: Dict[str, float] = {}
+    for row in report.get("ingest", []):
+        metrics[f"ingest[{row['from_docs']}->{row['to_docs']}].docs_per_s"] = row["docs_per_s"]
+    for row in report.get("query", []):
+        for field in ("p50_ms", "p90_ms", "p99_ms"):
+            metrics[f"query[{row['docs']},{row['mode']},{row['embedding']}].{field}"] = row[field]
+    for row in report.get("process_task", []):
+        for field in ("requests_per_s", "p50_ms", "p99_ms"):
+            metrics[f"process_task[x{row['concurrency']}].{field}"] = row[field]
+    if "cold_start" in report:
+        metrics[f"cold_start[{report['cold_start']['docs']}].median_s"] = report["cold_start"]["median_s"]
+        if "ready_median_s" in report["cold_start"]:
+            metrics[f"cold_start[{report['cold_start']['docs']}].ready_median_s"] = \
+                report["cold_start"]["ready_median_s"]
+    if "empty_start_s" in report:
+        metrics["empty_start_s"] = report["empty_start_s"]
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10, help="视为退化的相对变差比例")
+    parser.add_argument("--fail-on-regression", action="store_true", help="存在退化时以非零状态退出")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    old, new = flatten(baseline), flatten(current)
+
+    print(f"baseline: {baseline['meta'].get('commit')}  current: {current['meta'].get('commit')}")
+    regressions = 0
+    for name in sorted(old.keys() & new.keys()):
+        before, after = old[name], new[name]
+        if before == 0:
+            continue
+        change = (after - before) / before
+        # 统一成 "正数表示变好"
+        better = change if name.endswith("_per_s") else -change
+        flag = ""
+        if better < -args.threshold:
+            flag = "REGRESSION"
+            regressions += 1
+        elif better > args.threshold:
+            flag = "improved"
+        print(f"{name:55s} {before:12.2f} -> {after:12.2f}  {change:+7.1%}  {flag}")
+
+    missing = sorted(old.keys() ^ new.keys())
+    if missing:
+        print(f"{len(missing)} metrics present in only one report (different --sizes or --concurrency?)")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+本地的 OpenAI 兼容替身服务，供基准测试使用（不依赖任何外部 API）。
+
+提供:
+  POST /v1/embeddings         确定性的嵌入向量（相同文本总是得到相同向量）；
+                              可用 --embedding-max-concurrency 模拟限流（429）
+  POST /v1/chat/completions   相关性判断 / 摘要 / 精炼，支持 stream=True
+  GET  /stats                 各端点的调用次数与输入条数
+
+嵌入向量按 "主题中心 + 噪声" 生成：文本以 "topic-<n>" 开头时落在第 n 个主题附近，
+否则按文本哈希选择主题，这样检索和 ANN 召回在基准中才有意义。
+
+用法:
+  python bench/fake_openai.py --port 9100 --dim 384 --embedding-latency-ms 20 --chat-latency-ms 200
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import time
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+
+def create_app(dim: int = 384, topics: int = 64, noise: float = 0.6,
+               embedding_latency_ms: float = 20.0, embedding_item_latency_ms: float = 0.05,
+               chat_latency_ms: float = 200.0, token_latency_ms: float = 10.0,
+               embedding_max_concurrency: int = 0) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI-compatible API")
+    centroids = np.random.default_rng(dim).normal(size=(topics, dim))
+    counts = {"embedding_requests": 0, "embedding_inputs": 0, "embedding_rate_limited": 0,
+              "chat_requests": 0, "chat_streams": 0}
+    in_flight = {"embeddings": 0}
+
+    def embed(text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        rng = np.random.default_rng(seed)
+        head = text.split(" ", 1)[0]
+        if head.startswith("topic-") and head[6:].isdigit():
+            topic = int(head[6:]) % topics
+        else:
+            topic = seed % topics
+        return (centroids[topic] + noise * rng.normal(size=dim)).astype(np.float32)
+
+    def reply_for(messages: list, max_tokens) -> str:
+        prompt = messages[-1].get("content", "") if messages else ""
+        if "Answer with only 'yes' or 'no'" in prompt:
+            # 相关性判断：按任务文本哈希给出稳定的答案，大约 3/4 为 yes
+            return "yes" if hashlib.md5(prompt.encode()).digest()[0] % 4 else "no"
+        words = ("Summary of the conversation so far, covering the main decisions and open questions "
+                 "raised by the user in order of importance").split()
+        return " ".join(words[:max_tokens or len(words)])
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        if embedding_max_concurrency and in_flight["embeddings"] >= embedding_max_concurrency:
+            # 模拟上游限流：超过并发上限的请求直接返回 429
+            counts["embedding_rate_limited"] += 1
+            error = {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error", "code": "rate_limit"}}
+            return Response(json.dumps(error), status_code=429, media_type="application/json")
+        counts["embedding_requests"] += 1
+        counts["embedding_inputs"] += len(inputs)
+        in_flight["embeddings"] += 1
+        try:
+            await asyncio.sleep((embedding_latency_ms + embedding_item_latency_ms * len(inputs)) / 1000.0)
+        finally:
+            in_flight["embeddings"] -= 1
+        # openai 客户端默认请求 base64 编码（小端 float32），解析开销远小于浮点数列表
+        if body.get("encoding_format") == "base64":
+            encode = lambda v: base64.b64encode(v.tobytes()).decode("ascii")
+        else:
+            encode = lambda v: v.tolist()
+        payload = {
+            "object": "list",
+            "model": body.get("model", "fake-embedding"),
+            "data": [{"object": "embedding", "index": i, "embedding": encode(embed(text))}
+                     for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        }
+        # 直接序列化，跳过 FastAPI 对大数组逐元素的编码，替身本身不应成为瓶颈
+        return Response(json.dumps(payload), media_type="application/json")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "fake-chat")
+        content = reply_for(body.get("messages", []), body.get("max_tokens"))
+        counts["chat_requests"] += 1
+        await asyncio.sleep(chat_latency_ms / 1000.0)
+
+        if body.get("stream"):
+            counts["chat_streams"] += 1
+
+            async def events():
+                for i, word in enumerate(content.split(" ")):
+                    delta = {"content": word if i == 0 else " " + word}
+                    chunk = {"id": "fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(token_latency_ms / 1000.0)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return {
+            "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 1, "completion_tokens": len(content.split()), "total_tokens": 1},
+        }
+
+    @app.get("/stats")
+    def stats():
+        return counts
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--dim", type=int, default=384, help="嵌入维度")
+    parser.add_argument("--topics", type=int, default=64, help="嵌入空间中的主题（簇）数量")
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0, help="每个嵌入请求的固定延迟")
+    parser.add_argument("--embedding-item-latency-ms", type=float, default=0.05, help="每条输入额外增加的延迟")
+    parser.add_argument("--embedding-max-concurrency", type=int, default=0,
+                        help="同时处理的嵌入请求上限，超出时返回 429；0 表示不限")
+    parser.add_argument("--chat-latency-ms", type=float, default=200.0, help="聊天请求到首个 token 的延迟")
+    parser.add_argument("--token-latency-ms", type=float, default=10.0, help="流式输出时每个 token 的间隔")
+    args = parser.parse_args()
+
+    app = create_app(
+        dim=args.dim, topics=args.topics,
+        embedding_latency_ms=args.embedding_latency_ms,
+        embedding_item_latency_ms=args.embedding_item_latency_ms,
+        chat_latency_ms=args.chat_latency_ms,
+        token_latency_ms=args.token_latency_ms,
+        embedding_max_concurrency=args.embedding_max_concurrency,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""
+端到端基准测试：启动本地替身 API（bench/fake_openai.py）和本服务（uvicorn main:app），
+全部通过 HTTP 测量，结果写成 JSON，便于跨提交比较（见 bench/compare.py）。
+
+测量项:
+  ingest        逐步把库扩充到 --sizes 中的各个规模，记录每一段的导入吞吐（文档/秒）
+  query         每个规模下 /api/query 的延迟分位数（ANN 与精确检索各一组）；
+                新查询文本包含一次嵌入调用，"cached" 用同样的文本再查一遍，只反映检索本身
+  process_task  最大规模下 /api/process_task 在不同并发度下的吞吐和延迟分位数
+  cold_start    最大规模下重启服务直到可以响应请求（median_s）以及数据库加载完成、
+                /api/ready 返回 200（ready_median_s）所需的时间
+
+用法:
+  python bench/run_bench.py --sizes 1000,10000,50000 --output bench-results.json
+  python bench/run_bench.py --quick          # 小规模冒烟测试
+
+额外的服务配置可以直接通过环境变量传入（例如 VECTOR_DB_PRECISION=int8）。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import httpx
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_SERVER = os.path.join(REPO_ROOT, "bench", "fake_openai.py")
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    samples = np.asarray(samples_ms)
+    return {
+        "count": int(samples.size),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p90_ms": float(np.percentile(samples, 90)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "max_ms": float(samples.max()),
+    }
+
+
+def document_text(i: int, topics: int) -> str:
+    return f"topic-{i % topics} document {i}: notes about module {i * 7 % 101} and function {i * 13 % 997}"
+
+
+def query_text(i: int, topics: int) -> str:
+    return f"topic-{(i * 5) % topics} question {i}: how does module {i % 101} call function {i % 997}?"
+
+
+class ManagedProcess:
+    """子进程 + 日志文件；退出时保证被终止。"""
+
+    def __init__(self, name: str, args: List[str], env: Dict[str, str], log_dir: str):
+        self.name = name
+        self.log_path = os.path.join(log_dir, f"{name}.log")
+        self._log = open(self.log_path, "ab")
+        self.proc = subprocess.Popen(args, cwd=REPO_ROOT, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self._log.close()
+
+
+def wait_until(ready, timeout: float, proc: ManagedProcess) -> float:
+    """轮询 ready() 直到成功，返回耗时（秒）。"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if proc.proc.poll() is not None:
+            raise RuntimeError(f"{proc.name} exited early, see {proc.log_path}")
+        try:
+            if ready():
+                return time.perf_counter() - start
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    raise TimeoutError(f"{proc.name} not ready after {timeout}s, see {proc.log_path}")
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.work_dir = tempfile.mkdtemp(prefix="lms-bench-")
+        self.data_dir = os.path.join(self.work_dir, "data")
+        self.fake_url = f"http://127.0.0.1:{args.fake_port}"
+        self.service_url = f"http://127.0.0.1:{args.port}"
+        self.fake = None
+        self.service = None
+        self.num_docs = 0
+        self._next_query = 0
+
+    # ---- 进程管理 ----
+    def start_fake(self):
+        a = self.args
+        self.fake = ManagedProcess("fake_openai", [
+            sys.executable, FAKE_SERVER, "--port", str(a.fake_port), "--dim", str(a.dim),
+            "--topics", str(a.topics), "--embedding-latency-ms", str(a.embedding_latency_ms),
+            "--chat-latency-ms", str(a.chat_latency_ms), "--token-latency-ms", str(a.token_latency_ms),
+        ], dict(os.environ), self.work_dir)
+        wait_until(lambda: httpx.get(f"{self.fake_url}/stats").status_code == 200, 30, self.fake)
+
+    def service_env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update({
+            "CHAT_BASE_URL": f"{self.fake_url}/v1", "CHAT_API_KEY": "bench", "CHAT_MODEL_NAME": "fake-chat",
+            "EMBEDDING_BASE_URL": f"{self.fake_url}/v1", "EMBEDDING_API_KEY": "bench",
+            "EMBEDDING_MODEL_NAME": "fake-embedding", "VECTOR_DB_DIR": self.data_dir,
+        })
+        return env
+
+    def start_service(self) -> Tuple[float, float]:
+        """
+        启动服务，返回 (从启动进程到 /api/enable 成功响应的秒数,
+        到 /api/ready 返回 200 的秒数)。没有 /api/ready 的旧版本（404）视为监听即就绪。
+        """
+        started = time.perf_counter()
+        self.service = ManagedProcess("service", [
+            sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.args.port), "--log-level", "warning",
+        ], self.service_env(), self.work_dir)
+        enable = lambda: httpx.post(f"{self.service_url}/api/enable", json={"enabled": True}).status_code == 200
+        listen_s = wait_until(enable, self.args.startup_timeout, self.service)
+        ready = lambda: httpx.get(f"{self.service_url}/api/ready").status_code in (200, 404)
+        wait_until(ready, self.args.startup_timeout, self.service)
+        return listen_s, time.perf_counter() - started
+
+    def stop_service(self):
+        if self.service is not None:
+            self.service.stop()
+            self.service = None
+
+    def close(self):
+        self.stop_service()
+        if self.fake is not None:
+            self.fake.stop()
+        if not self.args.keep:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    # ---- 场景 ----
+    async def ingest_to(self, target: int) -> Dict[str, Any]:
+        a = self.args
+        start_index, count = self.num_docs, target - self.num_docs
+        batches = [
+            [{"document": document_text(i, a.topics), "source": f"bench-{i % 4}"}
+             for i in range(begin, min(begin + a.ingest_batch, target))]
+            for begin in range(start_index, target, a.ingest_batch)
+        ]
+        failed = 0
+        semaphore = asyncio.Semaphore(a.ingest_clients)
+
+        async def post(client: httpx.AsyncClient, batch):
+            nonlocal failed
+            async with semaphore:
+                response = await client.post("/api/add_documents", json=batch)
+                response.raise_for_status()
+                failed += response.json()["failed"]
+
+        started = time.perf_counter()
+        async with httpx.AsyncClient(base_url=self.service_url, timeout=None) as client:
+            await asyncio.gather(*(post(client, batch) for batch in batches))
+        elapsed = time.perf_counter() - started
+        self.num_docs = target
+        return {"from_docs": start_index, "to_docs": target, "seconds": elapsed,
+                "docs_per_s": count / elapsed if elapsed else 0.0, "failed": failed}
+
+    def query_latency(self) -> List[Dict[str, Any]]:
+        a = self.args
+        results = []
+        with httpx.Client(base_url=self.service_url, timeout=None) as client:
+            # 预热连接和页缓存，不计入结果
+            client.post("/api/query", json={"query": "warm-up query", "k": a.k}).raise_for_status()
+            for mode, exact in (("ann", False), ("exact", True)):
+                # 每组使用没查过的文本，避免命中上一组留下的嵌入缓存
+                texts = [query_text(self._next_query + i, a.topics) for i in range(a.queries)]
+                self._next_query += a.queries
+                for embedding in ("fresh", "cached"):
+                    samples = []
+                    for text in texts:
+                        payload = {"query": text, "k": a.k, "exact": exact}
+                        started = time.perf_counter()
+                        client.post("/api/query", json=payload).raise_for_status()
+                        samples.append((time.perf_counter() - started) * 1000)
+                    results.append({"docs": self.num_docs, "mode": mode, "embedding": embedding,
+                                    **percentiles(samples)})
+        return results
+
+    async def process_task_scaling(self) -> List[Dict[str, Any]]:
+        a = self.args
+        results = []
+        limits = httpx.Limits(max_connections=max(a.concurrency), max_keepalive_connections=max(a.concurrency))
+        async with httpx.AsyncClient(base_url=self.service_url, timeout=None, limits=limits) as client:
+            for concurrency in a.concurrency:
+                total = max(a.process_task_requests, concurrency * 4)
+                samples: List[float] = []
+                counter = iter(range(self._next_query, self._next_query + total))
+                self._next_query += total
+
+                async def worker():
+                    for i in counter:
+                        payload = {
+                            "task_description": query_text(i, a.topics),
+                            "history": [f"user: step {j} of task {i}" for j in range(a.history_turns)],
+                        }
+                        started = time.perf_counter()
+                        response = await client.post("/api/process_task", json=payload)
+                        response.raise_for_status()
+                        samples.append((time.perf_counter() - started) * 1000)
+
+                started = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+                elapsed = time.perf_counter() - started
+                results.append({"concurrency": concurrency, "requests": total, "seconds": elapsed,
+                                "requests_per_s": total / elapsed, **percentiles(samples)})
+        return results
+
+    def cold_start(self) -> Dict[str, Any]:
+        runs, ready_runs = [], []
+        for _ in range(self.args.cold_start_runs):
+            self.stop_service()
+            listen_s, ready_s = self.start_service()
+            runs.append(listen_s)
+            ready_runs.append(ready_s)
+        return {"docs": self.num_docs, "runs_s": runs, "median_s": float(np.median(runs)),
+                "ready_runs_s": ready_runs, "ready_median_s": float(np.median(ready_runs))}
+
+    def run(self) -> Dict[str, Any]:
+        a = self.args
+        report: Dict[str, Any] = {"meta": run_metadata(a), "ingest": [], "query": []}
+        self.start_fake()
+        report["empty_start_s"], _ = self.start_service()
+        for size in a.sizes:
+            if size > self.num_docs:
+                report["ingest"].append(asyncio.run(self.ingest_to(size)))
+                print(f"ingest -> {size}: {report['ingest'][-1]['docs_per_s']:.0f} docs/s", file=sys.stderr)
+            rows = self.query_latency()
+            report["query"].extend(rows)
+            print(f"query @ {size}: " + ", ".join(
+                f"{r['mode']}/{r['embedding']} p50 {r['p50_ms']:.1f} ms" for r in rows), file=sys.stderr)
+        report["process_task"] = asyncio.run(self.process_task_scaling())
+        for row in report["process_task"]:
+            print(f"process_task x{row['concurrency']}: {row['requests_per_s']:.1f} req/s, "
+                  f"p99 {row['p99_ms']:.0f} ms", file=sys.stderr)
+        report["cold_start"] = self.cold_start()
+        print(f"cold start @ {self.num_docs}: {report['cold_start']['median_s']:.2f} s, "
+              f"ready {report['cold_start']['ready_median_s']:.2f} s", file=sys.stderr)
+        report["fake_api_calls"] = httpx.get(f"{self.fake_url}/stats").json()
+        return report
+
+
+def run_metadata(args) -> Dict[str, Any]:
+    def git(*cmd):
+        try:
+            return subprocess.check_output(["git", *cmd], cwd=REPO_ROOT, stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": {k: v for k, v in vars(args).items() if k != "output"},
+        # 影响结果的服务端配置（通过环境变量覆盖的部分）
+        "env": {k: v for k, v in os.environ.items()
+                if k.startswith(("VECTOR_DB_", "ANN_", "EMBEDDING_CACHE_", "RELEVANCE_", "HTTP_", "RAG_", "SUMMARY_"))},
+    }
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int_list, default=[1000, 10000, 50000], help="逐步达到的库规模")
+    parser.add_argument("--queries", type=int, default=200, help="每个规模、每种模式的查询次数")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int_list, default=[1, 4, 16, 64], help="process_task 并发度")
+    parser.add_argument("--process-task-requests", type=int, default=64, help="每个并发度至少发送的请求数")
+    parser.add_argument("--history-turns", type=int, default=6, help="process_task 请求携带的历史条数")
+    parser.add_argument("--cold-start-runs", type=int, default=3)
+    parser.add_argument("--ingest-batch", type=int, default=256, help="每个 /api/add_documents 请求的文档数")
+    parser.add_argument("--ingest-clients", type=int, default=4, help="并发导入请求数")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=64)
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    parser.add_argument("--chat-latency-ms", type=float, default=200.0)
+    parser.add_argument("--token-latency-ms", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fake-port", type=int, default=9100)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--keep", action="store_true", help="保留临时数据目录和日志")
+    parser.add_argument("--quick", action="store_true", help="小规模冒烟测试")
+    parser.add_argument("--output", "-o", help="结果 JSON 路径；默认输出到标准输出")
+    args = parser.parse_args()
+    if args.quick:
+        args.sizes, args.queries, args.concurrency = [500, 2000], 30, [1, 8]
+        args.process_task_requests, args.cold_start_runs = 16, 1
+    args.sizes = sorted(args.sizes)
+
+    bench = Bench(args)
+    try:
+        report = bench.run()
+    finally:
+        bench.close()
+        if args.keep:
+            print(f"Work directory kept at {bench.work_dir}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import threading
+
+from core.config import settings
+
+# 所有模型 API 客户端都在第一次使用时创建（openai 包本身的导入也推迟到那时），
+# 启动时不做任何网络客户端的初始化。同步客户端各自维护连接池，异步客户端共享一个。
+# openai / httpx 的导入和客户端的创建都在 _lock 内进行：后台加载线程、事件循环和
+# 嵌入线程池可能同时第一次用到它们，并发导入会拿到初始化到一半的模块。
+# 异步客户端创建时会再取共享连接池，所以用可重入锁。
+_lock = threading.RLock()
+_chat_client = None
+_embedding_client = None
+_http_client = None
+_async_chat_client = None
+_async_embedding_client = None
+
+
+def _import_openai():
+    with _lock:
+        import httpx  # noqa: F401
+        import openai
+    return openai
+
+
+def warm_up():
+    """预先导入 openai（约占冷启动时间的一半），由后台加载线程调用，不阻塞服务启动。"""
+    _import_openai()
+
+
+def get_chat_client():
+    global _chat_client
+    if _chat_client is None:
+        with _lock:
+            if _chat_client is None:
+                openai = _import_openai()
+                _chat_client = openai.OpenAI(
+                    base_url=settings.chat_llm.base_url,
+                    api_key=settings.chat_llm.api_key,
+                )
+    return _chat_client
+
+
+def get_embedding_client():
+    global _embedding_client
+    if _embedding_client is None:
+        with _lock:
+            if _embedding_client is None:
+                openai = _import_openai()
+                # 开启请求合并时由合并器负责限流重试（同时降低并发），客户端自己不再重试
+                retries = {"max_retries": 0} if settings.embedding.batching else {}
+                _embedding_client = openai.OpenAI(
+                    base_url=settings.embedding.base_url,
+                    api_key=settings.embedding.api_key,
+                    **retries,
+                )
+    return _embedding_client
+
+
+def _shared_http_client():
+    global _http_client
+    if _http_client is None:
+        with _lock:
+            if _http_client is None:
+                openai = _import_openai()
+                import httpx
+                _http_client = openai.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=settings.pipeline.http_max_connections,
+                        max_keepalive_connections=settings.pipeline.http_max_keepalive,
+                    ),
+                )
+    return _http_client
+
+
+def get_async_chat_client():
+    global _async_chat_client
+    if _async_chat_client is None:
+        with _lock:
+            if _async_chat_client is None:
+                openai = _import_openai()
+                _async_chat_client = openai.AsyncOpenAI(
+                    base_url=settings.chat_llm.base_url,
+                    api_key=settings.chat_llm.api_key,
+                    timeout=settings.pipeline.http_timeout,
+                    http_client=_shared_http_client(),
+                )
+    return _async_chat_client
+
+
+def get_async_embedding_client():
+    global _async_embedding_client
+    if _async_embedding_client is None:
+        with _lock:
+            if _async_embedding_client is None:
+                openai = _import_openai()
+                _async_embedding_client = openai.AsyncOpenAI(
+                    base_url=settings.embedding.base_url,
+                    api_key=settings.embedding.api_key,
+                    timeout=settings.pipeline.http_timeout,
+                    http_client=_shared_http_client(),
+                )
+    return _async_embedding_client
+
+
+async def close_async_clients():
+    """在应用关闭时释放连接池。"""
+    global _http_client, _async_chat_client, _async_embedding_client
+    with _lock:
+        http_client = _http_client
+        _http_client = _async_chat_client = _async_embedding_client = None
+    if http_client is not None:
+        await http_client.aclose()
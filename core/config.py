@@ -1,5 +1,6 @@
 import json
 from pathlib import Path
+from typing import Literal
 from pydantic import BaseModel, Field
 
 class ChatLLMConfig(BaseModel):
@@ -13,6 +14,97 @@ class EmbeddingConfig(BaseModel):
     base_url: str
     api_key: str
     model_name: str
+    # 合并并发调用方的嵌入请求：收到第一个请求后最多再等 batch_window_ms 凑批，
+    # 一次 API 调用最多 max_batch_size 条文本，同时最多 max_concurrency 个调用
+    # （被限流时自动降低，恢复后逐步升回）；被限流的批次最多重试 max_retries 次
+    batching: bool = True
+    batch_window_ms: float = Field(default=2.0, ge=0)
+    max_batch_size: int = Field(default=256, gt=0)
+    max_concurrency: int = Field(default=8, gt=0)
+    max_retries: int = Field(default=5, ge=0)
+
+class VectorDBConfig(BaseModel):
+    data_dir: str = "./vector_db_data"
+    # 尾段累计到这么多行后封存为不可变段文件
+    segment_size: int = Field(default=16384, gt=0)
+    # 批量导入：每次嵌入调用的文档数，以及同时进行的批次数
+    ingest_batch_size: int = Field(default=64, gt=0)
+    ingest_concurrency: int = Field(default=4, gt=0)
+    # 嵌入缓存：内存 LRU 上限（MB），磁盘层位于 data_dir 下，最多保留多少条（0 表示不限）
+    embedding_cache_enabled: bool = True
+    embedding_cache_memory_mb: int = Field(default=64, ge=0)
+    embedding_cache_disk_entries: int = Field(default=500000, ge=0)
+    # 写入路径：WAL 每组提交 fsync 一次；一组最多多少行、最多等待多久凑批
+    wal_fsync: bool = True
+    group_commit_max_rows: int = Field(default=4096, gt=0)
+    group_commit_window_ms: float = Field(default=2.0, ge=0)
+    # 已封存段的扫描精度："float32"、"float16" 或 "int8"（全精度数据始终保留在磁盘上）。
+    # int8 内存降为 1/4 且扫描最快；float16 主要节省内存，半精度转换较慢的 CPU 上扫描会变慢
+    storage_precision: Literal["float32", "float16", "int8"] = "float32"
+    # 低精度模式下先取 k * rescore_factor 个候选再用全精度重排；0 表示不重排
+    rescore_factor: int = Field(default=4, ge=0)
+    # ANN 索引："ivf" 或 "none"；行数少于 ann_min_rows 时始终精确检索
+    ann_index: Literal["ivf", "none"] = "ivf"
+    ann_min_rows: int = Field(default=50000, gt=0)
+    ann_nlist: int = Field(default=0, ge=0)  # 0 表示按训练时的行数自动选择
+    ann_nprobe: int = Field(default=16, gt=0)
+    # 元数据过滤：命中行占比低于该值时先过滤再只对命中行打分，否则先检索再过滤
+    filter_prefilter_selectivity: float = Field(default=0.05, gt=0, le=1)
+    # 多进程模式（uvicorn --workers N）：一个写进程负责写入，其余进程只读映射同一份数据，
+    # 每隔 refresh_interval_ms 拉取一次新数据；启用开关也在进程间共享
+    multi_worker: bool = False
+    refresh_interval_ms: float = Field(default=100.0, gt=0)
+    # 删除/替换留下的失效行占比达到 compaction_dead_fraction 且不少于 compaction_min_dead_rows 行时，
+    # 后台重写段文件和元数据、清除失效行；compaction_dead_fraction 为 0 时只能手动压缩
+    compaction_dead_fraction: float = Field(default=0.2, ge=0, le=1)
+    compaction_min_dead_rows: int = Field(default=1000, ge=0)
+
+class PipelineConfig(BaseModel):
+    # 异步客户端共享的 HTTP 连接池
+    http_max_connections: int = Field(default=100, gt=0)
+    http_max_keepalive: int = Field(default=20, ge=0)
+    http_timeout: float = Field(default=30.0, gt=0)
+    # /api/process_task 各阶段的超时（秒），超时的阶段返回空结果
+    rag_timeout: float = Field(default=10.0, gt=0)
+    summary_timeout: float = Field(default=15.0, gt=0)
+    # 为每个响应附加 Server-Timing 头（各阶段耗时明细）；关闭时客户端可用 X-Request-Timing: 1 单独开启
+    timing_header: bool = False
+
+class RelevanceGateConfig(BaseModel):
+    # "local": 先用本地信号判断，置信度不足才调用LLM；"llm": 每次都调用LLM
+    mode: Literal["local", "llm"] = "local"
+    # 检索到的最高相似度达到该值时直接判定为相关
+    corpus_similarity: float = Field(default=0.6, ge=-1.0, le=1.0)
+    # 历史判定中，与当前查询相似度不低于该值的才算近邻
+    neighbor_similarity: float = Field(default=0.9, ge=-1.0, le=1.0)
+    # 近邻加权投票的比例达到该值才在本地做出判定
+    min_confidence: float = Field(default=0.8, gt=0.5, le=1.0)
+    max_verdicts: int = Field(default=10000, gt=0)
+
+class SummaryConfig(BaseModel):
+    # 滚动摘要缓存：按对话历史前缀缓存摘要，新请求只把新增的轮次和上次的摘要交给LLM。
+    # cache_size 为 0 时关闭，每次都摘要完整历史
+    cache_size: int = Field(default=1024, ge=0)
+    # 条目写入后超过这么多秒即失效
+    cache_ttl_seconds: float = Field(default=3600.0, gt=0)
+
+class ResponseCacheConfig(BaseModel):
+    # 检索结果的语义缓存：查询向量与某个已缓存查询的余弦相似度不低于 min_similarity
+    # （即余弦距离不超过 1 - min_similarity）时直接返回缓存的 rag_context
+    enabled: bool = True
+    min_similarity: float = Field(default=0.97, ge=-1.0, le=1.0)
+    max_entries: int = Field(default=2048, gt=0)
+    ttl_seconds: float = Field(default=600.0, gt=0)
+
+class IngestConfig(BaseModel):
+    # 写入前按 token 数切块：每块最多 chunk_max_tokens 个 token，相邻块重叠 chunk_overlap_tokens 个。
+    # chunk_max_tokens 为 0 时不切块，整篇文档作为一行
+    chunk_max_tokens: int = Field(default=512, ge=0)
+    chunk_overlap_tokens: int = Field(default=64, ge=0)
+    # 嵌入之前去重：内容（规范化后）完全相同，或 MinHash 估计的 Jaccard 相似度
+    # 不低于 near_duplicate_threshold 的文档不再写入，直接返回已有文档的 doc_id
+    dedup: bool = True
+    near_duplicate_threshold: float = Field(default=0.9, gt=0.0, le=1.0)
 
 class Settings:
     def __init__(self):
@@ -24,6 +116,21 @@ class Settings:
         Environment variable names supported:
         - CHAT_API_TYPE, CHAT_BASE_URL, CHAT_API_KEY, CHAT_MODEL_NAME
         - EMBEDDING_PROVIDER, EMBEDDING_BASE_URL, EMBEDDING_API_KEY, EMBEDDING_MODEL_NAME
+        - EMBEDDING_BATCHING, EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_MAX_BATCH_SIZE,
+          EMBEDDING_MAX_CONCURRENCY, EMBEDDING_MAX_RETRIES
+        - VECTOR_DB_DIR, VECTOR_DB_SEGMENT_SIZE, VECTOR_DB_INGEST_BATCH_SIZE, VECTOR_DB_INGEST_CONCURRENCY
+        - EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_MEMORY_MB, EMBEDDING_CACHE_DISK_ENTRIES
+        - VECTOR_DB_PRECISION, VECTOR_DB_RESCORE_FACTOR
+        - ANN_INDEX, ANN_MIN_ROWS, ANN_NLIST, ANN_NPROBE, VECTOR_DB_FILTER_PREFILTER_SELECTIVITY
+        - VECTOR_DB_MULTI_WORKER, VECTOR_DB_REFRESH_INTERVAL_MS
+        - VECTOR_DB_COMPACTION_DEAD_FRACTION, VECTOR_DB_COMPACTION_MIN_DEAD_ROWS
+        - VECTOR_DB_WAL_FSYNC, VECTOR_DB_GROUP_COMMIT_MAX_ROWS, VECTOR_DB_GROUP_COMMIT_WINDOW_MS
+        - HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_TIMEOUT, RAG_TIMEOUT, SUMMARY_TIMEOUT, TIMING_HEADER
+        - RELEVANCE_GATE_MODE, RELEVANCE_CORPUS_SIMILARITY, RELEVANCE_NEIGHBOR_SIMILARITY,
+          RELEVANCE_MIN_CONFIDENCE, RELEVANCE_MAX_VERDICTS
+        - SUMMARY_CACHE_SIZE, SUMMARY_CACHE_TTL_SECONDS
+        - RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MIN_SIMILARITY, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS
+        - INGEST_CHUNK_MAX_TOKENS, INGEST_CHUNK_OVERLAP_TOKENS, INGEST_DEDUP, INGEST_NEAR_DUPLICATE_THRESHOLD
         """
         config_path = Path(__file__).parent.parent / "config" / "llm_config.json"
 
@@ -64,6 +171,77 @@ class Settings:
             'base_url': env_or_config('EMBEDDING_BASE_URL', 'embedding', 'base_url', default=''),
             'api_key': env_or_config('EMBEDDING_API_KEY', 'embedding', 'api_key', default=''),
             'model_name': env_or_config('EMBEDDING_MODEL_NAME', 'embedding', 'model_name', default=''),
+            'batching': env_or_config('EMBEDDING_BATCHING', 'embedding', 'batching', default=True),
+            'batch_window_ms': env_or_config('EMBEDDING_BATCH_WINDOW_MS', 'embedding', 'batch_window_ms', default=2.0),
+            'max_batch_size': env_or_config('EMBEDDING_MAX_BATCH_SIZE', 'embedding', 'max_batch_size', default=256),
+            'max_concurrency': env_or_config('EMBEDDING_MAX_CONCURRENCY', 'embedding', 'max_concurrency', default=8),
+            'max_retries': env_or_config('EMBEDDING_MAX_RETRIES', 'embedding', 'max_retries', default=5),
+        }
+
+        # Vector DB
+        vector_db = {
+            'data_dir': env_or_config('VECTOR_DB_DIR', 'vector_db', 'data_dir', default='./vector_db_data'),
+            'segment_size': env_or_config('VECTOR_DB_SEGMENT_SIZE', 'vector_db', 'segment_size', default=16384),
+            'ingest_batch_size': env_or_config('VECTOR_DB_INGEST_BATCH_SIZE', 'vector_db', 'ingest_batch_size', default=64),
+            'ingest_concurrency': env_or_config('VECTOR_DB_INGEST_CONCURRENCY', 'vector_db', 'ingest_concurrency', default=4),
+            'embedding_cache_enabled': env_or_config('EMBEDDING_CACHE_ENABLED', 'vector_db', 'embedding_cache_enabled', default=True),
+            'embedding_cache_memory_mb': env_or_config('EMBEDDING_CACHE_MEMORY_MB', 'vector_db', 'embedding_cache_memory_mb', default=64),
+            'embedding_cache_disk_entries': env_or_config('EMBEDDING_CACHE_DISK_ENTRIES', 'vector_db', 'embedding_cache_disk_entries', default=500000),
+            'wal_fsync': env_or_config('VECTOR_DB_WAL_FSYNC', 'vector_db', 'wal_fsync', default=True),
+            'group_commit_max_rows': env_or_config('VECTOR_DB_GROUP_COMMIT_MAX_ROWS', 'vector_db', 'group_commit_max_rows', default=4096),
+            'group_commit_window_ms': env_or_config('VECTOR_DB_GROUP_COMMIT_WINDOW_MS', 'vector_db', 'group_commit_window_ms', default=2.0),
+            'storage_precision': env_or_config('VECTOR_DB_PRECISION', 'vector_db', 'storage_precision', default='float32'),
+            'rescore_factor': env_or_config('VECTOR_DB_RESCORE_FACTOR', 'vector_db', 'rescore_factor', default=4),
+            'ann_index': env_or_config('ANN_INDEX', 'vector_db', 'ann_index', default='ivf'),
+            'ann_min_rows': env_or_config('ANN_MIN_ROWS', 'vector_db', 'ann_min_rows', default=50000),
+            'ann_nlist': env_or_config('ANN_NLIST', 'vector_db', 'ann_nlist', default=0),
+            'ann_nprobe': env_or_config('ANN_NPROBE', 'vector_db', 'ann_nprobe', default=16),
+            'filter_prefilter_selectivity': env_or_config('VECTOR_DB_FILTER_PREFILTER_SELECTIVITY', 'vector_db', 'filter_prefilter_selectivity', default=0.05),
+            'multi_worker': env_or_config('VECTOR_DB_MULTI_WORKER', 'vector_db', 'multi_worker', default=False),
+            'refresh_interval_ms': env_or_config('VECTOR_DB_REFRESH_INTERVAL_MS', 'vector_db', 'refresh_interval_ms', default=100.0),
+            'compaction_dead_fraction': env_or_config('VECTOR_DB_COMPACTION_DEAD_FRACTION', 'vector_db', 'compaction_dead_fraction', default=0.2),
+            'compaction_min_dead_rows': env_or_config('VECTOR_DB_COMPACTION_MIN_DEAD_ROWS', 'vector_db', 'compaction_min_dead_rows', default=1000),
+        }
+
+        # Async pipeline
+        pipeline = {
+            'http_max_connections': env_or_config('HTTP_MAX_CONNECTIONS', 'pipeline', 'http_max_connections', default=100),
+            'http_max_keepalive': env_or_config('HTTP_MAX_KEEPALIVE', 'pipeline', 'http_max_keepalive', default=20),
+            'http_timeout': env_or_config('HTTP_TIMEOUT', 'pipeline', 'http_timeout', default=30.0),
+            'rag_timeout': env_or_config('RAG_TIMEOUT', 'pipeline', 'rag_timeout', default=10.0),
+            'summary_timeout': env_or_config('SUMMARY_TIMEOUT', 'pipeline', 'summary_timeout', default=15.0),
+            'timing_header': env_or_config('TIMING_HEADER', 'pipeline', 'timing_header', default=False),
+        }
+
+        # Relevance gate
+        relevance_gate = {
+            'mode': env_or_config('RELEVANCE_GATE_MODE', 'relevance_gate', 'mode', default='local'),
+            'corpus_similarity': env_or_config('RELEVANCE_CORPUS_SIMILARITY', 'relevance_gate', 'corpus_similarity', default=0.6),
+            'neighbor_similarity': env_or_config('RELEVANCE_NEIGHBOR_SIMILARITY', 'relevance_gate', 'neighbor_similarity', default=0.9),
+            'min_confidence': env_or_config('RELEVANCE_MIN_CONFIDENCE', 'relevance_gate', 'min_confidence', default=0.8),
+            'max_verdicts': env_or_config('RELEVANCE_MAX_VERDICTS', 'relevance_gate', 'max_verdicts', default=10000),
+        }
+
+        # Rolling summaries
+        summary = {
+            'cache_size': env_or_config('SUMMARY_CACHE_SIZE', 'summary', 'cache_size', default=1024),
+            'cache_ttl_seconds': env_or_config('SUMMARY_CACHE_TTL_SECONDS', 'summary', 'cache_ttl_seconds', default=3600.0),
+        }
+
+        # Semantic response cache
+        response_cache = {
+            'enabled': env_or_config('RESPONSE_CACHE_ENABLED', 'response_cache', 'enabled', default=True),
+            'min_similarity': env_or_config('RESPONSE_CACHE_MIN_SIMILARITY', 'response_cache', 'min_similarity', default=0.97),
+            'max_entries': env_or_config('RESPONSE_CACHE_MAX_ENTRIES', 'response_cache', 'max_entries', default=2048),
+            'ttl_seconds': env_or_config('RESPONSE_CACHE_TTL_SECONDS', 'response_cache', 'ttl_seconds', default=600.0),
+        }
+
+        # Ingest-time chunking and deduplication
+        ingest = {
+            'chunk_max_tokens': env_or_config('INGEST_CHUNK_MAX_TOKENS', 'ingest', 'chunk_max_tokens', default=512),
+            'chunk_overlap_tokens': env_or_config('INGEST_CHUNK_OVERLAP_TOKENS', 'ingest', 'chunk_overlap_tokens', default=64),
+            'dedup': env_or_config('INGEST_DEDUP', 'ingest', 'dedup', default=True),
+            'near_duplicate_threshold': env_or_config('INGEST_NEAR_DUPLICATE_THRESHOLD', 'ingest', 'near_duplicate_threshold', default=0.9),
         }
 
         # Validate minimal required fields
@@ -72,6 +250,12 @@ class Settings:
 
         self.chat_llm = ChatLLMConfig(**chat)
         self.embedding = EmbeddingConfig(**embedding)
+        self.vector_db = VectorDBConfig(**vector_db)
+        self.pipeline = PipelineConfig(**pipeline)
+        self.relevance_gate = RelevanceGateConfig(**relevance_gate)
+        self.summary = SummaryConfig(**summary)
+        self.response_cache = ResponseCacheConfig(**response_cache)
+        self.ingest = IngestConfig(**ingest)
 
 import os
 
@@ -0,0 +1,277 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# 秒级延迟的默认分桶：覆盖本地扫描（毫秒级）到远程 LLM 调用（数十秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 批大小分桶
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """带标签的指标基类；标签以关键字参数传入，例如 counter.inc(stage="rag")。"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # 每组标签：(各桶计数（非累计）, 总和, 总数)
+        self._values: Dict[LabelKey, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            counts[bucket] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(c), s, n)) for k, (c, s, n) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _CallbackMetric(_Metric):
+    """抓取时才读取数值的指标，用于导出已有的计数（例如缓存命中数），避免重复计数。"""
+
+    def __init__(self, name: str, documentation: str, type_name: str,
+                 callback: Callable[[], Dict[LabelKey, float]], labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.type_name = type_name
+        self._callback = callback
+
+    def samples(self) -> List[str]:
+        try:
+            items = sorted(self._callback().items())
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_callback(self, name: str, documentation: str, type_name: str,
+                          callback: Callable[[], Dict[LabelKey, float]], labelnames: Tuple[str, ...] = ()):
+        """callback 返回 {标签值元组: 数值}；同名指标重复注册时以最后一次为准。"""
+        with self._lock:
+            self._metrics[name] = _CallbackMetric(name, documentation, type_name, callback, labelnames)
+
+    def render(self) -> str:
+        """Prometheus 文本格式（version 0.0.4）。"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# ---- 热路径上的公共指标 ----
+STAGE_SECONDS = registry.histogram(
+    "lms_stage_duration_seconds", "Duration of pipeline stages.", ("stage",))
+STAGE_FAILURES = registry.counter(
+    "lms_stage_failures_total", "Pipeline stages that timed out or raised.", ("stage", "reason"))
+API_CALL_SECONDS = registry.histogram(
+    "lms_api_call_duration_seconds", "Duration of outbound model API calls.", ("api", "operation"))
+API_CALL_ERRORS = registry.counter(
+    "lms_api_call_errors_total", "Outbound model API calls that raised.", ("api", "operation"))
+API_CALLS_IN_FLIGHT = registry.gauge(
+    "lms_api_calls_in_flight", "Outbound model API calls currently in progress.", ("api",))
+EMBEDDING_BATCH_SIZE = registry.histogram(
+    "lms_embedding_batch_size", "Number of texts per embedding API call.", buckets=SIZE_BUCKETS)
+
+
+# ---- 单个请求的耗时明细（用于 Server-Timing 响应头） ----
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_request_timing():
+    """为当前请求开启耗时明细收集，返回用于 reset 的 token。"""
+    return _request_timings.set({})
+
+
+def stop_request_timing(token) -> Dict[str, float]:
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+
+def record_timing(name: str, seconds: float):
+    """累加到当前请求的耗时明细中；没有开启收集时什么也不做。"""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name.replace('.', '-')};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """记录一个流水线阶段的耗时：写入直方图，并计入当前请求的耗时明细。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        record_timing(stage, elapsed)
+
+
+@contextmanager
+def api_call(api: str, operation: str):
+    """包裹一次对外部模型 API 的调用：耗时、进行中数量、错误数。"""
+    start = time.perf_counter()
+    API_CALLS_IN_FLIGHT.inc(api=api)
+    try:
+        yield
+    except Exception:
+        API_CALL_ERRORS.inc(api=api, operation=operation)
+        raise
+    finally:
+        API_CALLS_IN_FLIGHT.dec(api=api)
+        elapsed = time.perf_counter() - start
+        API_CALL_SECONDS.observe(elapsed, api=api, operation=operation)
+        record_timing(f"{api}_api", elapsed)
@@ -0,0 +1,301 @@
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+CENTROIDS_FILE = "ivf_centroids.npy"
+ASSIGNMENTS_FILE = "ivf_assign.i32"
+
+_ASSIGN_CHUNK = 8192
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """返回分数最高的 k 个下标（降序），用 argpartition 避免对整个数组排序。"""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(scores[candidates])[::-1]]
+
+
+def merge_top_k(best_rows: np.ndarray, best_scores: np.ndarray,
+                new_rows: np.ndarray, new_scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    批量版本的 top-k 合并：每个查询一行，把已有的最好结果与新一块的分数合并，
+    只保留 k 个（未排序）。new_rows 可以是所有查询共用的一维行号。
+    """
+    if new_rows.ndim == 1:
+        new_rows = np.broadcast_to(new_rows, new_scores.shape)
+    rows = np.concatenate([best_rows, new_rows], axis=1)
+    scores = np.concatenate([best_scores, new_scores], axis=1)
+    if scores.shape[1] > k:
+        keep = np.argpartition(scores, -k, axis=1)[:, -k:]
+        rows = np.take_along_axis(rows, keep, axis=1)
+        scores = np.take_along_axis(scores, keep, axis=1)
+    return rows, scores
+
+
+def empty_top_k(num_queries: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """批量 top-k 的初始状态：行号 -1、分数 -inf。"""
+    return np.full((num_queries, k), -1, dtype=np.int64), np.full((num_queries, k), -np.inf, dtype=np.float32)
+
+
+class IVFIndex:
+    """
+    倒排文件 (IVF) 近似最近邻索引。
+
+    - 行数达到 min_rows 时用球面 k-means 训练 nlist 个粗量化中心（train 在快照上计算，install 装入）
+    - 之后每次追加只把新向量分配给最近的中心，增量维护倒排表
+    - 查询时只扫描与查询最接近的 nprobe 个倒排表；nprobe 越大召回越高、越慢
+    - 中心存为 ivf_centroids.npy，逐行分配结果顺序追加到 ivf_assign.i32
+    """
+
+    def __init__(self, root: str, nlist: int = 0, nprobe: int = 16, min_rows: int = 50000):
+        self.root = root
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_rows = min_rows
+
+        self.centroids: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        self._list_len = np.zeros(0, dtype=np.int64)
+        self.num_rows = 0
+
+        self._load()
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _load(self):
+        centroids_path = self._path(CENTROIDS_FILE)
+        if not os.path.exists(centroids_path):
+            return
+        centroids = np.load(centroids_path)
+        # 先建好倒排表再设置中心，读者看到 trained=True 时结构已完整
+        self._build_lists(self._read_assignments(0), centroids.shape[0])
+        self.centroids = centroids
+
+    def _read_assignments(self, start_row: int) -> np.ndarray:
+        """读取从 start_row 开始的分配结果；忽略写入者正在追加、尚不完整的最后一条。"""
+        path = self._path(ASSIGNMENTS_FILE)
+        if not os.path.exists(path):
+            return np.empty(0, dtype=np.int32)
+        with open(path, "rb") as f:
+            f.seek(start_row * 4)
+            data = f.read()
+        return np.frombuffer(data[:len(data) - len(data) % 4], dtype=np.int32)
+
+    def _build_lists(self, assignments: np.ndarray, nlist: int):
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        self._lists = [order[bounds[i]:bounds[i + 1]].astype(np.int64) for i in range(nlist)]
+        self._list_len = counts.astype(np.int64)
+        self.num_rows = int(assignments.size)
+
+    # ---- 维护 ----
+    def sync(self, store):
+        """
+        让已训练的索引跟上存储：补齐缺失的分配；未训练时不做任何事（训练见 train/install）。
+        存储被截断（例如尾段损坏）时丢弃多出的分配。
+        """
+        total = len(store)
+        if not self.trained:
+            return
+        if self.num_rows > total:
+            assignments = np.fromfile(self._path(ASSIGNMENTS_FILE), dtype=np.int32)[:total]
+            with open(self._path(ASSIGNMENTS_FILE), "wb") as f:
+                f.write(assignments.tobytes())
+            self._build_lists(assignments, self.centroids.shape[0])
+        for start in range(self.num_rows, total, _ASSIGN_CHUNK):
+            rows = np.arange(start, min(start + _ASSIGN_CHUNK, total))
+            self.add(store.take(rows))
+
+    def needs_training(self, total: int) -> bool:
+        return not self.trained and total >= self.min_rows
+
+    def add(self, vectors: np.ndarray):
+        """把紧接在已有行之后的新向量加入倒排表。"""
+        if not self.trained or vectors.shape[0] == 0:
+            return
+        assignments = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        with open(self._path(ASSIGNMENTS_FILE), "ab") as f:
+            f.write(assignments.tobytes())
+        self._add_assignments(assignments)
+
+    def refresh(self):
+        """
+        只读副本（多进程模式下的读进程）使用：从文件读入写进程新训练的中心
+        和新追加的分配结果，自己从不写文件。
+        """
+        if not self.trained:
+            if os.path.exists(self._path(CENTROIDS_FILE)):
+                self._load()
+            return
+        path = self._path(ASSIGNMENTS_FILE)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < self.num_rows * 4:
+            # 写进程重启时截断过分配文件，整体重新读取
+            self._load()
+            return
+        self._add_assignments(self._read_assignments(self.num_rows))
+
+    def _add_assignments(self, assignments: np.ndarray):
+        if assignments.size == 0:
+            return
+        rows = np.arange(self.num_rows, self.num_rows + assignments.size, dtype=np.int64)
+        for list_id in np.unique(assignments):
+            new_rows = rows[assignments == list_id]
+            self._append_to_list(int(list_id), new_rows)
+        self.num_rows += assignments.size
+
+    def _append_to_list(self, list_id: int, rows: np.ndarray):
+        current = self._lists[list_id]
+        length = self._list_len[list_id]
+        needed = length + rows.size
+        if needed > current.shape[0]:
+            grown = np.empty(max(needed, current.shape[0] * 2, 16), dtype=np.int64)
+            grown[:length] = current[:length]
+            current = self._lists[list_id] = grown
+        current[length:needed] = rows
+        self._list_len[list_id] = needed
+
+    def save_compacted(self, root: str, keep: np.ndarray):
+        """
+        压缩使用：把中心和保留行（keep，升序的旧行号）的分配结果写到新一代目录，
+        行号随之重新编号，压缩后的库无需重新训练。尚未分配的行由新索引的 sync 补上。
+        """
+        if not self.trained:
+            return
+        assignments = self._read_assignments(0)
+        kept = assignments[keep[keep < assignments.size]]
+        with open(os.path.join(root, ASSIGNMENTS_FILE), "wb") as f:
+            f.write(kept.tobytes())
+        with open(os.path.join(root, CENTROIDS_FILE), "wb") as f:
+            np.save(f, self.centroids)
+
+    def train(self, snapshot, iterations: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        在存储快照上用球面 k-means 训练中心，并把快照中的全部行分配到最近的中心，
+        返回 (中心, 分配结果)。只读快照、不改动索引，写进程在后台线程中不持锁调用，
+        结果由 install 装入。
+        """
+        total = len(snapshot)
+        nlist = min(self.nlist or int(np.clip(4 * np.sqrt(total), 16, 65536)), total)
+        print(f"Training IVF index with {nlist} lists over {total} vectors...")
+        rng = np.random.default_rng(0)
+        sample_size = min(total, nlist * 32)
+        sample = snapshot.take(np.sort(rng.choice(total, size=sample_size, replace=False)))
+
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # 空簇保留原中心
+            nonempty = norms[:, 0] > 0
+            centroids[nonempty] = sums[nonempty] / norms[nonempty]
+
+        centroids = centroids.astype(np.float32)
+        assignments = [
+            np.argmax(snapshot.take(np.arange(start, min(start + _ASSIGN_CHUNK, total))) @ centroids.T,
+                      axis=1).astype(np.int32)
+            for start in range(0, total, _ASSIGN_CHUNK)
+        ]
+        return centroids, np.concatenate(assignments)
+
+    def install(self, centroids: np.ndarray, assignments: np.ndarray, store):
+        """
+        装入 train 的结果，再补上训练期间追加到存储的行；调用方持有提交锁。
+        """
+        # 先写临时文件再改名，其他进程不会读到写了一半的文件；
+        # 分配结果先于中心就位，读者看到中心时分配文件已经完整
+        tmp_path = self._path(ASSIGNMENTS_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(assignments.tobytes())
+        os.replace(tmp_path, self._path(ASSIGNMENTS_FILE))
+        tmp_path = self._path(CENTROIDS_FILE + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, centroids)
+        os.replace(tmp_path, self._path(CENTROIDS_FILE))
+        # 先建好倒排表再设置中心，读者看到 trained=True 时结构已完整
+        self._build_lists(assignments, centroids.shape[0])
+        self.centroids = centroids
+        self.sync(store)
+
+    # ---- 查询 ----
+    def search(self, snapshot, query_vector: np.ndarray, k: int,
+               nprobe: Optional[int] = None, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        在存储快照上检索，返回 (行号, 相似度)，按相似度降序。
+        倒排表只会追加，读者无需加锁：超出快照范围的行被过滤，
+        快照中尚未分配到倒排表的新行一并精确打分。
+        mask 是元数据过滤的行号位图，只对其中为 True 的候选打分。
+        """
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        probes = top_k_indices(self.centroids @ query_vector, nprobe)
+        total = len(snapshot)
+        indexed = min(self.num_rows, total)
+        candidates = np.concatenate(
+            [self._lists[i][:self._list_len[i]] for i in probes]
+            + [np.arange(indexed, total, dtype=np.int64)]
+        )
+        # 写入者可能刚把行加入倒排表、还没更新 num_rows，用 unique 去重
+        candidates = np.unique(candidates[candidates < total])
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        if candidates.size == 0:
+            return candidates, np.empty(0, dtype=np.float32)
+        scores = snapshot.score_rows(candidates, query_vector)
+        best = top_k_indices(scores, k)
+        return candidates[best], scores[best]
+
+    def search_batch(self, snapshot, queries: np.ndarray, k: int,
+                     nprobe: Optional[int] = None, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        批量检索：按倒排表分组，每个被探查的表与所有探查它的查询做一次
+        矩阵-矩阵乘法。返回 (行号, 分数)，形状均为 (查询数, k)，未排序，
+        结果不足 k 个时用行号 -1 填充。mask 的含义同 search。
+        """
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        num_queries = queries.shape[0]
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(centroid_scores, -nprobe, axis=1)[:, -nprobe:]
+
+        total = len(snapshot)
+        indexed = min(self.num_rows, total)
+        best_rows, best_scores = empty_top_k(num_queries, k)
+
+        # 反查：每个倒排表被哪些查询探查
+        flat = probes.ravel()
+        query_ids = np.repeat(np.arange(num_queries), nprobe)
+        order = np.argsort(flat, kind="stable")
+        list_ids, starts = np.unique(flat[order], return_index=True)
+        bounds = np.append(starts, flat.size)
+        for i, list_id in enumerate(list_ids):
+            rows = self._lists[list_id][:self._list_len[list_id]]
+            rows = rows[rows < indexed]
+            if mask is not None:
+                rows = rows[mask[rows]]
+            if rows.size == 0:
+                continue
+            qids = query_ids[order[bounds[i]:bounds[i + 1]]]
+            scores = snapshot.score_rows_batch(rows, queries[qids])
+            best_rows[qids], best_scores[qids] = merge_top_k(
+                best_rows[qids], best_scores[qids], rows, scores, k)
+
+        rows = np.arange(indexed, total, dtype=np.int64)
+        if mask is not None:
+            rows = rows[mask[rows]]
+        if rows.size:
+            best_rows, best_scores = merge_top_k(
+                best_rows, best_scores, rows, snapshot.score_rows_batch(rows, queries), k)
+        return best_rows, best_scores
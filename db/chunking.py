@@ -0,0 +1,75 @@
+import re
+from typing import List, Optional, Tuple
+
+# 词元切分：连续的字母数字为一个词，中日韩字符和标点各自为一个词。
+# 未安装 tiktoken 时用它近似估计 token 数；MinHash 的分词也用它（与是否安装 tiktoken 无关，
+# 保证持久化的签名在不同环境下一致）
+_CJK = "\\u3040-\\u30ff\\u3400-\\u4dbf\\u4e00-\\u9fff\\uac00-\\ud7af"
+_WORD_RE = re.compile(rf"[{_CJK}]|[^\W_{_CJK}]+|[^\w\s]")
+# 块的结尾优先落在这些字符之后
+_SENTENCE_END = ("。", "！", "？", ".", "!", "?", "\n", "；", ";")
+
+# 一篇文档切成多块时，每块的元数据记录它是第几块、共几块（只有一块时不记录）
+CHUNK_FIELD = "chunk"
+CHUNK_COUNT_FIELD = "chunks"
+
+_encoding = None
+_encoding_loaded = False
+
+
+def words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def _tiktoken_encoding():
+    """安装了 tiktoken 时返回 cl100k_base 编码，否则返回 None；第一次用到时才导入。"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def token_spans(text: str) -> List[Tuple[int, int]]:
+    """每个 token 在原文中的 (起始, 结束) 字符位置。"""
+    encoding = _tiktoken_encoding()
+    if encoding is None:
+        return [m.span() for m in _WORD_RE.finditer(text)]
+    decoded, starts = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+    if decoded != text:
+        # 编码后无法逐字还原（例如非法代理字符），退回近似切分
+        return [m.span() for m in _WORD_RE.finditer(text)]
+    ends = starts[1:] + [len(text)]
+    return list(zip(starts, ends))
+
+
+def chunk_text(text: str, max_tokens: int, overlap_tokens: int,
+               spans: Optional[List[Tuple[int, int]]] = None) -> List[str]:
+    """
+    按 token 数把文本切成若干块，每块不超过 max_tokens 个 token，相邻块重叠 overlap_tokens 个。
+    块尽量在句末结束（只在窗口的最后四分之一内寻找句末），块文本是原文的连续片段。
+    max_tokens 为 0 或文本不超过 max_tokens 时整篇作为一块。
+    """
+    spans = spans if spans is not None else token_spans(text)
+    if max_tokens <= 0 or len(spans) <= max_tokens:
+        return [text]
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    chunks = []
+    start = 0
+    while start < len(spans):
+        end = min(start + max_tokens, len(spans))
+        if end < len(spans):
+            for candidate in range(end, start + max_tokens * 3 // 4, -1):
+                if text[spans[candidate - 1][0]:spans[candidate - 1][1]].endswith(_SENTENCE_END):
+                    end = candidate
+                    break
+        chunks.append(text[spans[start][0]:spans[end - 1][1]])
+        if end == len(spans):
+            break
+        start = max(end - overlap_tokens, start + 1)
+    return chunks
@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+
+from db.segment_store import SegmentStore, StoreSnapshot, MANIFEST_FILE, METADATA_DB_FILE
+
+# 压缩按 "代" 重写整个存储：第 0 代就是数据目录本身（兼容已有的库），
+# 第 g 代位于 gen_{g:06d}/ 子目录。CURRENT 文件记录当前代号，写进程建好新一代后
+# 原子地改写它，读进程（包括其他 worker）发现代号变化后整体切换到新一代。
+# 写进程锁、spool、嵌入缓存等与数据行号无关的文件始终留在数据目录根下。
+CURRENT_FILE = "CURRENT"
+_GENERATION_PREFIX = "gen_"
+# 第 0 代在根目录下的存储文件（按文件名前缀匹配）
+_ROOT_STORE_FILES = ("seg_", "wal_", "ivf_", MANIFEST_FILE, METADATA_DB_FILE)
+
+
+def current_generation(root: str) -> int:
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r") as f:
+            return int(json.load(f)["generation"])
+    except FileNotFoundError:
+        return 0
+
+
+def generation_root(root: str, generation: int) -> str:
+    return root if generation == 0 else os.path.join(root, f"{_GENERATION_PREFIX}{generation:06d}")
+
+
+def publish_generation(root: str, generation: int):
+    """新一代的数据全部落盘之后调用；此后打开数据目录的进程都使用新一代。"""
+    path = os.path.join(root, CURRENT_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"generation": generation}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def remove_stale_generations(root: str):
+    """删除当前代以外的所有代：已被取代的旧代，以及压缩中途退出留下的未发布的新一代。"""
+    current = current_generation(root)
+    for name in os.listdir(root):
+        if not name.startswith(_GENERATION_PREFIX):
+            continue
+        try:
+            generation = int(name[len(_GENERATION_PREFIX):])
+        except ValueError:
+            continue
+        if generation != current:
+            shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    if current != 0:
+        for name in os.listdir(root):
+            if name.startswith(_ROOT_STORE_FILES):
+                os.remove(os.path.join(root, name))
+
+
+def copy_rows(snapshot: StoreSnapshot, dst: SegmentStore, rows: np.ndarray):
+    """把快照中的若干行（升序）连同元数据依次追加到 dst，每批正好封存成一个段。"""
+    for start in range(0, rows.size, dst.segment_size):
+        chunk = rows[start:start + dst.segment_size]
+        metas = snapshot.get_metadata(chunk)
+        if any(meta is None for meta in metas):
+            raise RuntimeError("Metadata is missing for some rows being compacted")
+        dst.append(snapshot.take(chunk), metas)
+
+
+class Compactor:
+    """
+    后台压缩线程（只在写进程中运行）。
+
+    每次提交删除后调用 request()；should_compact() 判断失效行是否已超过阈值，
+    超过时在后台线程中调用 compact_fn 重写存储。查询和写入在重写期间照常进行，
+    只有最后切换到新一代时短暂地与写入互斥。
+    """
+
+    def __init__(self, should_compact: Callable[[], bool], compact_fn: Callable[[], Dict[str, Any]]):
+        self._should_compact = should_compact
+        self._compact_fn = compact_fn
+        self._event = threading.Event()
+        self.runs = 0
+        self.failures = 0
+        self.last_result: Optional[Dict[str, Any]] = None
+        self._thread = threading.Thread(target=self._run, name="vector-db-compactor", daemon=True)
+        self._thread.start()
+
+    def request(self):
+        self._event.set()
+
+    def _run(self):
+        while True:
+            self._event.wait()
+            self._event.clear()
+            if not self._should_compact():
+                continue
+            try:
+                self.compact()
+            except Exception as e:
+                print(f"Error compacting vector database: {e}")
+                self.failures += 1
+
+    def compact(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result = self._compact_fn()
+        result["seconds"] = time.perf_counter() - started
+        self.runs += 1
+        self.last_result = result
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {"runs": self.runs, "failures": self.failures, "last": self.last_result}
@@ -0,0 +1,227 @@
+import hashlib
+import itertools
+import sqlite3
+import threading
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+from db.chunking import words
+from db.embedding_cache import normalize_text
+
+# MinHash 签名长度，以及 LSH 的分带方式（BANDS * ROWS_PER_BAND == NUM_PERM）。
+# 两篇文档至少有一个带完全相同才会成为候选，Jaccard 相似度为 s 的两篇文档成为候选的概率是
+# 1 - (1 - s^8)^16：s = 0.9 时约 0.9999，s = 0.5 时约 0.06
+NUM_PERM = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+# 每个 shingle 包含的词数
+SHINGLE_WORDS = 3
+# 切成多块的文档在每块的元数据里记下整篇文档的内容哈希，重建指纹时据此还原
+CONTENT_HASH_FIELD = "content_hash"
+
+# 哈希族 h(x) = (a * x + b) mod p，p 是大于 2^32 的素数；a、b 取固定种子生成，
+# 持久化的签名因此在不同进程、不同版本之间保持可比
+_PRIME = np.uint64(4294967311)
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, 2 ** 31, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, 2 ** 31, size=NUM_PERM).astype(np.uint64)
+# 一次参与计算的 shingle 数，限制临时矩阵的大小
+_SHINGLE_BLOCK = 4096
+
+
+def content_hash(text: str) -> str:
+    """规范化文本（与嵌入缓存相同的规则）的哈希，用于判定完全重复。"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """按 SHINGLE_WORDS 个词一组的 shingle 集合计算 MinHash 签名（NUM_PERM 个 uint64）。"""
+    tokens = words(text)
+    if len(tokens) <= SHINGLE_WORDS:
+        shingles = {" ".join(tokens)}
+    else:
+        shingles = {" ".join(tokens[i:i + SHINGLE_WORDS]) for i in range(len(tokens) - SHINGLE_WORDS + 1)}
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles),
+        dtype=np.uint64, count=len(shingles))
+
+    signature = np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    for start in range(0, hashes.size, _SHINGLE_BLOCK):
+        block = hashes[start:start + _SHINGLE_BLOCK]
+        permuted = (_A[:, None] * block[None, :] + _B[:, None]) % _PRIME
+        np.minimum(signature, permuted.min(axis=1), out=signature)
+    return signature
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """两个签名估计的 Jaccard 相似度。"""
+    return float(np.mean(a == b))
+
+
+def _band_buckets(signature: np.ndarray) -> List[int]:
+    """每个带的桶号：该带内签名值的哈希（SQLite 整数范围内的有符号 64 位整数）。"""
+    raw = signature.tobytes()
+    step = len(raw) // BANDS
+    return [int.from_bytes(hashlib.blake2b(raw[i:i + step], digest_size=8).digest(), "little", signed=True)
+            for i in range(0, len(raw), step)]
+
+
+class DedupIndex:
+    """
+    文档指纹：内容哈希（完全重复）和 MinHash 签名 + LSH 分桶（近似重复）。
+
+    已写入的文档存放在 SQLite 中，进程重启和多个 worker 之间共享；已通过去重检查、
+    尚未写完的文档先在内存中登记（reserve），让并发的批次和同批中靠后的文档也能发现它们，
+    写入完成后 add_many 落盘、release 撤销登记。
+
+    指纹按 doc_id 记录，与文档一起替换、删除；这里只负责找候选，
+    候选文档是否仍然有效由调用方对照存储确认。
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, content_hash TEXT NOT NULL, "
+            "signature BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS docs_content_hash ON docs (content_hash)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lsh_buckets (band INTEGER NOT NULL, bucket INTEGER NOT NULL, "
+            "doc_id TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lsh_buckets_bucket ON lsh_buckets (bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS lsh_buckets_doc ON lsh_buckets (doc_id)")
+        self._conn.commit()
+
+        # 登记令牌 -> (doc_id, 内容哈希, 签名)，以及按内容哈希、LSH 桶的反查
+        self._pending: Dict[int, Tuple[str, str, np.ndarray]] = {}
+        self._pending_hashes: Dict[str, Set[int]] = {}
+        self._pending_buckets: Dict[Tuple[int, int], Set[int]] = {}
+        self._tokens = itertools.count()
+
+    def find_many(self, fingerprints: List[Tuple[str, np.ndarray]],
+                  threshold: float) -> List[Tuple[List[str], List[Tuple[str, float]]]]:
+        """
+        在已写入的文档中查找，fingerprints 为 [(内容哈希, 签名)]。每项返回
+        (内容完全相同的文档, [(doc_id, 相似度)])，后者是其余估计相似度不低于 threshold 的文档。
+        """
+        buckets = [_band_buckets(signature) for _, signature in fingerprints]
+        with self._lock:
+            by_hash: Dict[str, List[str]] = {}
+            for digest, doc_id in self._select_in(
+                    "SELECT content_hash, doc_id FROM docs WHERE content_hash IN ({})",
+                    list({digest for digest, _ in fingerprints})):
+                by_hash.setdefault(digest, []).append(doc_id)
+            by_bucket: Dict[Tuple[int, int], List[str]] = {}
+            for band, bucket, doc_id in self._select_in(
+                    "SELECT band, bucket, doc_id FROM lsh_buckets WHERE bucket IN ({})",
+                    list({bucket for keys in buckets for bucket in keys})):
+                by_bucket.setdefault((band, bucket), []).append(doc_id)
+            candidates = {doc_id for doc_ids in by_bucket.values() for doc_id in doc_ids}
+            signatures = {doc_id: np.frombuffer(blob, dtype=np.uint64) for doc_id, blob in self._select_in(
+                "SELECT doc_id, signature FROM docs WHERE doc_id IN ({})", list(candidates))}
+
+        results = []
+        for (digest, signature), keys in zip(fingerprints, buckets):
+            exact = by_hash.get(digest, [])
+            near = {doc_id for band, bucket in enumerate(keys) for doc_id in by_bucket.get((band, bucket), ())}
+            near = [(doc_id, similarity(signature, signatures[doc_id]))
+                    for doc_id in near.difference(exact) if doc_id in signatures]
+            results.append((list(exact), [item for item in near if item[1] >= threshold]))
+        return results
+
+    def _select_in(self, sql: str, values: List) -> List[tuple]:
+        rows = []
+        # SQLite 单条语句的参数个数有上限，分块查询
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            rows.extend(self._conn.execute(sql.format(",".join("?" * len(chunk))), chunk).fetchall())
+        return rows
+
+    # ---- 内存中的登记 ----
+    def find_pending(self, digest: str, signature: np.ndarray,
+                     threshold: float) -> Tuple[List[str], List[Tuple[str, float]]]:
+        """与 find_many 相同，但只在已登记、尚未写完的文档中查找。"""
+        with self._lock:
+            exact_tokens = self._pending_hashes.get(digest, set())
+            near_tokens = set()
+            for band, bucket in enumerate(_band_buckets(signature)):
+                near_tokens.update(self._pending_buckets.get((band, bucket), ()))
+            exact = [self._pending[token][0] for token in exact_tokens]
+            near = [(self._pending[token][0], similarity(signature, self._pending[token][2]))
+                    for token in near_tokens - exact_tokens]
+        return exact, [item for item in near if item[1] >= threshold]
+
+    def pending_doc_ids(self) -> Set[str]:
+        with self._lock:
+            return {doc_id for doc_id, _, _ in self._pending.values()}
+
+    def reserve(self, doc_id: str, digest: str, signature: np.ndarray) -> int:
+        """登记一篇即将写入的文档，返回用于 release 的令牌。"""
+        with self._lock:
+            token = next(self._tokens)
+            self._pending[token] = (doc_id, digest, signature)
+            self._pending_hashes.setdefault(digest, set()).add(token)
+            for key in enumerate(_band_buckets(signature)):
+                self._pending_buckets.setdefault(key, set()).add(token)
+            return token
+
+    def release(self, tokens: List[int]):
+        with self._lock:
+            for token in tokens:
+                _, digest, signature = self._pending.pop(token)
+                self._discard(self._pending_hashes, digest, token)
+                for key in enumerate(_band_buckets(signature)):
+                    self._discard(self._pending_buckets, key, token)
+
+    @staticmethod
+    def _discard(mapping: Dict, key, token: int):
+        tokens = mapping[key]
+        tokens.discard(token)
+        if not tokens:
+            del mapping[key]
+
+    # ---- 持久化的指纹 ----
+    def add_many(self, entries: List[Tuple[str, str, np.ndarray]]):
+        """entries 为 [(doc_id, 内容哈希, 签名)]；同一 doc_id 的旧指纹被替换。"""
+        if not entries:
+            return
+        with self._lock:
+            doc_ids = [(doc_id,) for doc_id, _, _ in entries]
+            self._conn.executemany("DELETE FROM lsh_buckets WHERE doc_id = ?", doc_ids)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO docs (doc_id, content_hash, signature) VALUES (?, ?, ?)",
+                [(doc_id, digest, signature.tobytes()) for doc_id, digest, signature in entries],
+            )
+            self._conn.executemany(
+                "INSERT INTO lsh_buckets (band, bucket, doc_id) VALUES (?, ?, ?)",
+                [(band, bucket, doc_id) for doc_id, _, signature in entries
+                 for band, bucket in enumerate(_band_buckets(signature))],
+            )
+            self._conn.commit()
+
+    def remove(self, doc_ids: List[str]):
+        if not doc_ids:
+            return
+        with self._lock:
+            params = [(doc_id,) for doc_id in doc_ids]
+            self._conn.executemany("DELETE FROM lsh_buckets WHERE doc_id = ?", params)
+            self._conn.executemany("DELETE FROM docs WHERE doc_id = ?", params)
+            self._conn.commit()
+
+    def doc_ids(self) -> Set[str]:
+        with self._lock:
+            return {doc_id for (doc_id,) in self._conn.execute("SELECT doc_id FROM docs")}
+
+    def indexed(self, doc_ids: List[str]) -> Set[str]:
+        """doc_ids 中已有指纹的那些。"""
+        with self._lock:
+            return {doc_id for (doc_id,) in self._select_in("SELECT doc_id FROM docs WHERE doc_id IN ({})", doc_ids)}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
@@ -0,0 +1,193 @@
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.metrics import registry, SIZE_BUCKETS
+
+REQUESTS_PER_CALL = registry.histogram(
+    "lms_embedding_requests_per_call", "Caller requests merged into one embedding API call.", buckets=SIZE_BUCKETS)
+RATE_LIMITED = registry.counter(
+    "lms_embedding_rate_limited_total", "Embedding API calls rejected with HTTP 429.")
+
+# 被限流后的退避时间范围（秒）；上游给出 Retry-After 时以它为准
+MIN_BACKOFF = 0.5
+MAX_BACKOFF = 30.0
+
+# 一个调用方的请求：(文本列表, 完成通知)
+_PendingRequest = Tuple[List[str], Future]
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class EmbeddingBatcher:
+    """
+    合并并发调用方的嵌入请求。
+
+    任意线程通过 submit 提交一组文本并拿到 Future（异步调用方用
+    asyncio.wrap_future 等待）。调度线程收到第一个请求后最多再等 window 秒、
+    凑够 max_batch_size 条文本为止，把排队中的请求合并（相同文本只发一次）
+    成一次 API 调用，结果按原顺序分发回各个调用方。
+
+    一组合并后（或单个调用方一次提交）的文本超过 max_batch_size 条时按 max_batch_size
+    分片依次调用，不超过服务商对单个请求的输入条数和 token 上限。
+
+    同时进行的调用数受 limit 限制：没有空闲槽位时调度线程等待，期间到达的
+    请求并入下一批，所以负载越高、每次调用合并的请求越多。被上游限流（429）时
+    limit 减半、全体暂停一段退避时间后重试该批；调用成功后 limit 逐个恢复、退避时间减半。
+    """
+
+    def __init__(self, call_fn: Callable[[List[str]], np.ndarray], window: float = 0.002,
+                 max_batch_size: int = 256, max_concurrency: int = 8, max_retries: int = 5):
+        self._call_fn = call_fn
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+
+        self.limit = max_concurrency
+        self._inflight = 0
+        self._backoff = 0.0
+        self._resume_at = 0.0
+        self._cond = threading.Condition()
+        self.counts: Dict[str, int] = {"requests": 0, "api_calls": 0, "rate_limited": 0, "failures": 0}
+
+        self._queue: "queue.Queue[_PendingRequest]" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embedding-call")
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        """结果是与 texts 一一对应、已归一化的向量矩阵；失败时 Future 带异常。"""
+        future: Future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    # ---- 调度线程 ----
+    def _run(self):
+        while True:
+            group = [self._queue.get()]
+            size = len(group[0][0])
+            deadline = time.monotonic() + self.window
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                group.append(item)
+                size += len(item[0])
+
+            self._acquire_slot()
+            # 等待槽位或退避期间排进来的请求一并带上
+            while size < self.max_batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                group.append(item)
+                size += len(item[0])
+            self._pool.submit(self._send, group)
+
+    def _acquire_slot(self):
+        with self._cond:
+            while self._inflight >= self.limit:
+                self._cond.wait()
+            self._inflight += 1
+            pause = self._resume_at - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def _release_slot(self):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    # ---- 调用线程 ----
+    def _send(self, group: List[_PendingRequest]):
+        try:
+            self._send_group(group)
+        finally:
+            self._release_slot()
+
+    def _send_group(self, group: List[_PendingRequest]):
+        unique = list(dict.fromkeys(text for texts, _ in group for text in texts))
+        try:
+            vectors = np.concatenate([
+                self._call_with_retries(unique[start:start + self.max_batch_size])
+                for start in range(0, len(unique), self.max_batch_size)
+            ])
+        except Exception as e:
+            if len(group) > 1 and not _is_rate_limited(e):
+                # 逐个重试，避免一条坏输入拖累同批的其他调用方
+                for item in group:
+                    self._send_group([item])
+                return
+            self.counts["failures"] += 1
+            for _, future in group:
+                future.set_exception(e)
+            return
+
+        REQUESTS_PER_CALL.observe(len(group))
+        self.counts["requests"] += len(group)
+        position = {text: i for i, text in enumerate(unique)}
+        for texts, future in group:
+            future.set_result(vectors[[position[text] for text in texts]])
+
+    def _call_with_retries(self, texts: List[str]) -> np.ndarray:
+        attempt = 0
+        while True:
+            self.counts["api_calls"] += 1
+            try:
+                vectors = self._call_fn(texts)
+            except Exception as e:
+                if not _is_rate_limited(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                time.sleep(self._on_rate_limited(e))
+                continue
+            self._on_success()
+            return vectors
+
+    def _on_rate_limited(self, error: Exception) -> float:
+        """收缩并发上限、加倍退避时间，返回本次应等待的秒数。"""
+        RATE_LIMITED.inc()
+        with self._cond:
+            self.counts["rate_limited"] += 1
+            self.limit = max(1, self.limit // 2)
+            self._backoff = min(MAX_BACKOFF, max(MIN_BACKOFF, self._backoff * 2))
+            delay = _retry_after(error) or self._backoff * random.uniform(0.5, 1.0)
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+        print(f"Embedding API rate limited, backing off {delay:.2f}s (concurrency limit {self.limit}).")
+        return delay
+
+    def _on_success(self):
+        with self._cond:
+            if self.limit < self.max_concurrency:
+                self.limit += 1
+                self._cond.notify_all()
+            self._backoff = self._backoff / 2 if self._backoff > MIN_BACKOFF else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        calls = self.counts["api_calls"]
+        return {
+            **self.counts,
+            "requests_per_call": self.counts["requests"] / calls if calls else 0.0,
+            "concurrency_limit": self.limit,
+            "in_flight": self._inflight,
+            "queued": self._queue.qsize(),
+        }
@@ -0,0 +1,148 @@
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """NFC 规范化并合并空白，避免仅因空格差异而重复嵌入。"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model_name: str, text: str) -> str:
+    """缓存键 = (嵌入模型名, 规范化文本的哈希)。"""
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model_name}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    内容寻址的嵌入缓存，两级结构：
+      - 内存 LRU：按向量占用的字节数淘汰
+      - 磁盘 SQLite：进程重启后仍然有效，命中后回填内存；条目超过 max_disk_entries 时
+        按写入先后淘汰最早的（0 表示不限）
+
+    两级各有一把锁：get_memory 只碰内存，不会因为另一个线程正在读写 SQLite 而等待，
+    事件循环中可以直接调用；get_disk / put_many 会阻塞，异步调用方应放到线程池中执行。
+    """
+
+    def __init__(self, path: str, max_memory_bytes: int, max_disk_entries: int = 0):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.disk_evictions = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+        # 磁盘条目数的上界：每次写入按新增计，超过上限时才真正 COUNT 一次
+        self._disk_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        results = self.get_memory(keys)
+        self.get_disk(keys, results)
+        return results
+
+    def get_memory(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """只查内存层，未命中的位置为 None（交给 get_disk 补查）。"""
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    results[i] = vector
+        return results
+
+    def get_disk(self, keys: List[str], results: List[Optional[np.ndarray]]):
+        """在磁盘层补查 results 中仍为 None 的位置，命中的就地填入并回填内存。"""
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if not missing:
+            return
+        wanted = list({keys[i] for i in missing})
+        found: Dict[str, np.ndarray] = {}
+        with self._db_lock:
+            # SQLite 单条语句的参数个数有上限，分块查询
+            for start in range(0, len(wanted), 500):
+                chunk = wanted[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        with self._lock:
+            for i in missing:
+                vector = found.get(keys[i])
+                if vector is None:
+                    self.misses += 1
+                    continue
+                self.disk_hits += 1
+                results[i] = vector
+                self._remember(keys[i], vector)
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._db_lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in zip(keys, vectors)],
+            )
+            self._disk_entries += len(keys)
+            if self.max_disk_entries and self._disk_entries > self.max_disk_entries:
+                self._evict_disk()
+            self._conn.commit()
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector.copy())
+
+    def _evict_disk(self):
+        """删除最早写入的条目（rowid 最小），降到上限的 90%，之后写入一段时间内不必再淘汰。"""
+        self._disk_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._disk_entries - int(self.max_disk_entries * 0.9)
+        if self._disk_entries <= self.max_disk_entries or excess <= 0:
+            return
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?)", (excess,)
+        )
+        self._disk_entries -= excess
+        self.disk_evictions += excess
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = vector
+        self._memory_bytes += vector.nbytes
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_evictions": self.disk_evictions,
+            }
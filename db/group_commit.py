@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from core.metrics import registry, SIZE_BUCKETS
+
+GROUP_ROWS = registry.histogram(
+    "lms_group_commit_rows", "Rows written per group commit.", buckets=SIZE_BUCKETS)
+GROUP_WRITES = registry.histogram(
+    "lms_group_commit_writes", "Queued writes merged into one group commit.", buckets=SIZE_BUCKETS)
+GROUP_SECONDS = registry.histogram(
+    "lms_group_commit_duration_seconds", "Duration of one group commit (WAL append, fsync, publish).")
+WRITE_FAILURES = registry.counter(
+    "lms_write_failures_total", "Submitted writes that failed to commit.")
+QUEUE_DEPTH = registry.gauge(
+    "lms_write_queue_depth", "Writes waiting for the writer thread.")
+
+# 一条待提交的写入：(向量, 元数据列表, 要删除的文档 ID, 完成通知)
+_PendingWrite = Tuple[np.ndarray, List[Dict[str, Any]], List[str], Future]
+# 一组提交中的删除：(位于该组第几行之前, 文档 ID 列表)，提交函数据此按提交顺序处理删除与替换
+Deletes = List[Tuple[int, List[str]]]
+
+
+class GroupCommitWriter:
+    """
+    向量库的单一写入线程。
+
+    任意线程通过 submit 提交一批行并拿到 Future；写入线程把排队中的请求
+    合并成一组（最多 max_rows 行，最多再等待 window 秒凑批），调用一次
+    commit_fn 完成 WAL 追加 + fsync + 发布快照，然后逐个唤醒调用方。
+    并发写入越多，每次 fsync 分摊的行数越多。删除请求（只有 delete_ids、没有行）
+    也在同一组里提交。
+    """
+
+    def __init__(self, commit_fn: Callable[[np.ndarray, List[Dict[str, Any]], Deletes], None],
+                 max_rows: int = 4096, window: float = 0.002):
+        self._commit_fn = commit_fn
+        self.max_rows = max_rows
+        self.window = window
+        self._queue: "queue.Queue[_PendingWrite]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="vector-db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, vectors: np.ndarray, metadatas: List[Dict[str, Any]],
+               delete_ids: Sequence[str] = ()) -> Future:
+        future: Future = Future()
+        self._queue.put((vectors, metadatas, list(delete_ids), future))
+        QUEUE_DEPTH.inc()
+        return future
+
+    def _run(self):
+        while True:
+            group = [self._queue.get()]
+            rows = group[0][0].shape[0]
+            deadline = time.monotonic() + self.window
+            while rows < self.max_rows:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                group.append(item)
+                rows += item[0].shape[0]
+            QUEUE_DEPTH.dec(len(group))
+            self._commit(group)
+
+    def _commit(self, group: List[_PendingWrite]):
+        try:
+            parts = [item[0] for item in group if item[0].shape[0]]
+            vectors = np.vstack(parts) if parts else np.empty((0, 0), dtype=np.float32)
+            metadatas = [meta for item in group for meta in item[1]]
+            deletes, offset = [], 0
+            for _, metas, delete_ids, _ in group:
+                if delete_ids:
+                    deletes.append((offset, delete_ids))
+                offset += len(metas)
+            with GROUP_SECONDS.time():
+                self._commit_fn(vectors, metadatas, deletes)
+            GROUP_ROWS.observe(vectors.shape[0])
+            GROUP_WRITES.observe(len(group))
+        except Exception as e:
+            if len(group) > 1:
+                # 逐个重试，避免一条坏数据（例如维度不符）拖累同组的其他写入
+                for item in group:
+                    self._commit([item])
+                return
+            print(f"Error committing pending write: {e}")
+            WRITE_FAILURES.inc()
+            group[0][3].set_exception(e)
+            return
+        for _, _, _, future in group:
+            future.set_result(None)
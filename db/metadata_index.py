@@ -0,0 +1,184 @@
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# 建立倒排表的关键字字段；字段值可以是单个值或列表（例如 tags）
+INDEXED_FIELDS = ("source", "tags")
+# 时间范围过滤使用的字段（unix 时间戳，秒）
+TIME_FIELD = "created_at"
+# 文档 ID：删除和替换（upsert）按它定位文档，写入时未提供则自动生成
+DOC_ID_FIELD = "doc_id"
+
+# 过滤表达式支持的键：
+#   source / tags      命中其中任意一个值
+#   tags_all           同时带有所有这些标签
+#   created_after      created_at >= 该时间
+#   created_before     created_at <  该时间
+# 不同的键之间是 AND 关系
+FILTER_KEYS = ("source", "tags", "tags_all", "created_after", "created_before")
+
+
+class _GrowableArray:
+    """只追加的一维数组。扩容时换新缓冲区，读者拿到的旧视图保持有效。"""
+
+    def __init__(self, dtype, fill=None):
+        self._dtype = dtype
+        self._fill = fill
+        self._data = np.empty(0, dtype=dtype)
+        self._len = 0
+
+    def view(self) -> np.ndarray:
+        # 先读长度再读缓冲区：缓冲区在任何时刻都至少有 length 个有效元素
+        length = self._len
+        return self._data[:length]
+
+    def extend(self, values: Iterable, at: Optional[int] = None):
+        values = np.asarray(list(values), dtype=self._dtype)
+        start = self._len if at is None else at
+        end = start + values.size
+        if end > self._data.size:
+            grown = np.empty(max(end, self._data.size * 2, 64), dtype=self._dtype)
+            grown[:self._len] = self._data[:self._len]
+            self._data = grown
+        if self._fill is not None and start > self._len:
+            self._data[self._len:start] = self._fill
+        self._data[start:end] = values
+        self._len = max(self._len, end)
+
+
+def field_values(metadata: Dict[str, Any], field: str) -> List[str]:
+    """元数据中某个关键字字段的全部取值（统一转成字符串）。"""
+    value = metadata.get(field)
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [str(v) for v in value]
+    return [str(value)]
+
+
+def timestamp_of(metadata: Dict[str, Any]) -> Optional[float]:
+    value = metadata.get(TIME_FIELD)
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+class MetadataIndex:
+    """
+    元数据的内存倒排索引：(字段, 值) -> 行号数组，另有一个按行号存放的时间戳数组。
+
+    只保存行号和时间戳，不保存文档正文；内容由 MetadataStore 持久化，
+    启动时从 SQLite 的 postings 表加载。查询时把过滤表达式求值成行号位图。
+    """
+
+    def __init__(self):
+        self._postings: Dict[Tuple[str, str], _GrowableArray] = {}
+        self._timestamps = _GrowableArray(np.float64, fill=np.nan)
+        self.num_rows = 0
+        self._lock = threading.Lock()
+
+    def add(self, field: str, value: str, row_ids: Iterable[int]):
+        postings = self._postings.get((field, value))
+        if postings is None:
+            # 只有新增键时才需要加锁，防止 values() 遍历字典时字典被修改
+            with self._lock:
+                postings = self._postings[(field, value)] = _GrowableArray(np.int64)
+        postings.extend(row_ids)
+
+    def load(self, postings: Iterable[Tuple[str, str, int]], timestamps: Iterable[Tuple[int, float]],
+             num_rows: int):
+        """启动时从持久化的 postings（按字段、值、行号排序）和时间戳重建索引。"""
+        current, rows = None, []
+        for field, value, row_id in postings:
+            if (field, value) != current:
+                if rows:
+                    self.add(*current, rows)
+                current, rows = (field, value), []
+            rows.append(row_id)
+        if rows:
+            self.add(*current, rows)
+
+        column = np.full(num_rows, np.nan)
+        for row_id, timestamp in timestamps:
+            if row_id < num_rows:
+                column[row_id] = timestamp
+        self._timestamps.extend(column, at=0)
+        self.num_rows = num_rows
+
+    def add_rows(self, start_row: int, metadatas: List[Dict[str, Any]]):
+        """索引从 start_row 开始的连续若干行；已经索引过的行（WAL 重放）会被跳过。"""
+        skip = max(0, self.num_rows - start_row)
+        metadatas = metadatas[skip:]
+        if not metadatas:
+            return
+        start_row += skip
+        grouped: Dict[Tuple[str, str], List[int]] = {}
+        for row_id, metadata in enumerate(metadatas, start=start_row):
+            for field in INDEXED_FIELDS:
+                for value in field_values(metadata, field):
+                    grouped.setdefault((field, value), []).append(row_id)
+        for (field, value), rows in grouped.items():
+            self.add(field, value, rows)
+        timestamps = [timestamp_of(metadata) for metadata in metadatas]
+        self._timestamps.extend([np.nan if t is None else t for t in timestamps], at=start_row)
+        self.num_rows = start_row + len(metadatas)
+
+    def values(self, field: str) -> Dict[str, int]:
+        """某字段的所有取值及其行数，用于统计/调试。"""
+        with self._lock:
+            items = list(self._postings.items())
+        return {value: postings.view().size for (f, value), postings in items if f == field}
+
+    def _rows_for(self, field: str, value: str) -> np.ndarray:
+        postings = self._postings.get((field, value))
+        return postings.view() if postings is not None else np.empty(0, dtype=np.int64)
+
+    def match(self, filters: Dict[str, Any], num_rows: int) -> np.ndarray:
+        """
+        把过滤表达式求值为行号位图（长度 num_rows 的 bool 数组）。
+        num_rows 取自查询使用的快照，快照之后写入的行不会出现在结果中。
+        """
+        unknown = set(filters) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown filter keys: {sorted(unknown)}; supported: {list(FILTER_KEYS)}")
+
+        mask = np.ones(num_rows, dtype=bool)
+        for field in ("source", "tags"):
+            values = filters.get(field)
+            if values is None:
+                continue
+            any_of = np.zeros(num_rows, dtype=bool)
+            for value in _as_list(values):
+                rows = self._rows_for(field, value)
+                any_of[rows[rows < num_rows]] = True
+            mask &= any_of
+
+        for value in _as_list(filters.get("tags_all")):
+            rows = self._rows_for("tags", value)
+            has_tag = np.zeros(num_rows, dtype=bool)
+            has_tag[rows[rows < num_rows]] = True
+            mask &= has_tag
+
+        after, before = filters.get("created_after"), filters.get("created_before")
+        if after is not None or before is not None:
+            timestamps = np.full(num_rows, np.nan)
+            known = self._timestamps.view()[:num_rows]
+            timestamps[:known.size] = known
+            # 没有时间戳的行与 NaN 比较结果为 False，会被排除
+            with np.errstate(invalid="ignore"):
+                if after is not None:
+                    mask &= timestamps >= float(after)
+                if before is not None:
+                    mask &= timestamps < float(before)
+        return mask
+
+
+def _as_list(values) -> List[str]:
+    if values is None:
+        return []
+    if isinstance(values, (list, tuple, set)):
+        return [str(v) for v in values]
+    return [str(values)]
+
+
+def is_empty_filter(filters: Optional[Dict[str, Any]]) -> bool:
+    return not filters or all(v is None for v in filters.values())
@@ -0,0 +1,215 @@
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from db.metadata_index import MetadataIndex, INDEXED_FIELDS, DOC_ID_FIELD, field_values, timestamp_of
+
+
+class MetadataStore:
+    """
+    按行号索引的文档正文与元数据存储（SQLite）。
+
+    向量在段文件里，正文和元数据只在这里；查询只按 top-k 的行号取回需要的几行，
+    启动时不再把全部正文读进内存，常驻内存只与向量规模有关。
+
+    写入由 SegmentStore 的单一写入者完成，且总是先写 WAL 再写这里，
+    所以这里用 synchronous=NORMAL 即可：崩溃后丢失的最近几条会在重放 WAL 时补回。
+
+    同一事务里还维护过滤用的 postings 表（字段, 值, 行号）和 created_at 列，
+    启动时只加载这两者重建内存倒排索引（见 db/metadata_index.py），不读正文。
+
+    删除只在 tombstones 表里记下行号（墓碑），文档行保持不动，行号不变；
+    doc_id 列带索引，用于按文档 ID 找到要删除或替换的行。失效行由压缩统一清除。
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # 已读取到的最后一个墓碑序号，见 read_tombstones
+        self._tombstone_seq = 0
+        # 只读副本（多进程模式下的读进程）不做建表和升级，这些由写进程完成
+        if not read_only:
+            self._init_schema()
+
+        self.index = MetadataIndex()
+        num_rows = self._conn.execute("SELECT COALESCE(MAX(row_id) + 1, 0) FROM documents").fetchone()[0]
+        self.index.load(
+            self._conn.execute("SELECT field, value, row_id FROM postings ORDER BY field, value, row_id"),
+            self._conn.execute("SELECT row_id, created_at FROM documents WHERE created_at IS NOT NULL"),
+            num_rows,
+        )
+
+    def _init_schema(self):
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents (row_id INTEGER PRIMARY KEY, metadata TEXT NOT NULL)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(documents)")]
+        if "created_at" not in columns:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN created_at REAL")
+        if "doc_id" not in columns:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN doc_id TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_doc_id ON documents (doc_id)")
+        self._assign_legacy_doc_ids()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tombstones (seq INTEGER PRIMARY KEY, row_id INTEGER NOT NULL UNIQUE)"
+        )
+        has_postings = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'postings'"
+        ).fetchone() is not None
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings (field TEXT NOT NULL, value TEXT NOT NULL, "
+            "row_id INTEGER NOT NULL, PRIMARY KEY (field, value, row_id)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        if not has_postings:
+            self._backfill_postings()
+
+    def _backfill_postings(self):
+        """旧库升级：一次性扫描已有文档，补建 postings 和 created_at。"""
+        updates, postings = [], []
+        for row_id, text in self._conn.execute("SELECT row_id, metadata FROM documents"):
+            meta = json.loads(text)
+            updates.append((timestamp_of(meta), row_id))
+            postings.extend(self._postings_of(row_id, meta))
+        if not updates:
+            return
+        print(f"Building metadata filter index for {len(updates)} existing documents...")
+        self._conn.executemany("UPDATE documents SET created_at = ? WHERE row_id = ?", updates)
+        self._conn.executemany("INSERT OR IGNORE INTO postings (field, value, row_id) VALUES (?, ?, ?)", postings)
+        self._conn.commit()
+
+    def _assign_legacy_doc_ids(self):
+        """
+        早期版本写入的行没有 doc_id：按行号补上 row-<行号>（同时写进元数据），
+        使这些文档也能按 ID 删除、替换，并参与写入前去重。
+        """
+        updated = self._conn.execute(
+            "UPDATE documents SET doc_id = 'row-' || row_id, "
+            "metadata = json_set(metadata, '$.doc_id', 'row-' || row_id) WHERE doc_id IS NULL"
+        ).rowcount
+        self._conn.commit()
+        if updated:
+            print(f"Assigned doc_id to {updated} existing documents.")
+
+    @staticmethod
+    def _postings_of(row_id: int, metadata: Dict[str, Any]):
+        return [(field, value, row_id) for field in INDEXED_FIELDS for value in field_values(metadata, field)]
+
+    def put_many(self, start_row: int, metadatas: Sequence[Dict[str, Any]], deleted_rows: Sequence[int] = ()):
+        """
+        写入从 start_row 开始的连续若干行，并在同一事务中为 deleted_rows 记下墓碑；
+        重复写入同一行会覆盖、重复的墓碑被忽略（WAL 重放是幂等的）。
+        没有 doc_id 的行（重放早期版本的 WAL）与 _assign_legacy_doc_ids 一样按行号补上。
+        """
+        metadatas = [
+            meta if meta.get(DOC_ID_FIELD) is not None else dict(meta, **{DOC_ID_FIELD: f"row-{start_row + i}"})
+            for i, meta in enumerate(metadatas)
+        ]
+        rows = [
+            (start_row + i, json.dumps(meta, ensure_ascii=False, default=str), timestamp_of(meta), _doc_id_of(meta))
+            for i, meta in enumerate(metadatas)
+        ]
+        postings = [p for i, meta in enumerate(metadatas) for p in self._postings_of(start_row + i, meta)]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (row_id, metadata, created_at, doc_id) VALUES (?, ?, ?, ?)", rows)
+            self._conn.executemany("INSERT OR IGNORE INTO postings (field, value, row_id) VALUES (?, ?, ?)", postings)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO tombstones (row_id) VALUES (?)", [(int(r),) for r in deleted_rows])
+            self._conn.commit()
+        self.index.add_rows(start_row, list(metadatas))
+
+    def get_many(self, row_ids: Sequence[int]) -> List[Optional[Dict[str, Any]]]:
+        """按给定顺序取回若干行的元数据；不存在的行返回 None。"""
+        wanted = list({int(r) for r in row_ids})
+        found: Dict[int, Dict[str, Any]] = {}
+        with self._lock:
+            # SQLite 单条语句的参数个数有上限，分块查询
+            for start in range(0, len(wanted), 500):
+                chunk = wanted[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for row_id, text in self._conn.execute(
+                    f"SELECT row_id, metadata FROM documents WHERE row_id IN ({placeholders})", chunk
+                ):
+                    found[row_id] = json.loads(text)
+        return [found.get(int(r)) for r in row_ids]
+
+    def live_rows(self, doc_ids: Sequence[str]) -> List[int]:
+        """这些文档 ID 当前有效（没有墓碑）的全部行号。"""
+        wanted = list({str(d) for d in doc_ids})
+        found: List[int] = []
+        with self._lock:
+            for start in range(0, len(wanted), 500):
+                chunk = wanted[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                found.extend(row_id for (row_id,) in self._conn.execute(
+                    f"SELECT row_id FROM documents WHERE doc_id IN ({placeholders}) "
+                    "AND NOT EXISTS (SELECT 1 FROM tombstones WHERE tombstones.row_id = documents.row_id)",
+                    chunk,
+                ))
+        return sorted(found)
+
+    def live_doc_ids(self) -> List[str]:
+        """所有有效（没有墓碑）的行所属的文档 ID，去重。"""
+        with self._lock:
+            return [doc_id for (doc_id,) in self._conn.execute(
+                "SELECT DISTINCT doc_id FROM documents WHERE doc_id IS NOT NULL "
+                "AND NOT EXISTS (SELECT 1 FROM tombstones WHERE tombstones.row_id = documents.row_id)"
+            )]
+
+    @property
+    def tombstone_seq(self) -> int:
+        """read_tombstones 已读取到的最后一个墓碑序号。"""
+        return self._tombstone_seq
+
+    def last_tombstone_seq(self) -> int:
+        """已提交的最后一个墓碑序号（不影响 read_tombstones 的进度）。"""
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM tombstones").fetchone()[0]
+
+    def read_tombstones(self) -> np.ndarray:
+        """上次调用之后新增的墓碑行号；第一次调用返回全部。只读副本据此增量跟上其他进程的删除。"""
+        with self._lock:
+            new = self._conn.execute(
+                "SELECT seq, row_id FROM tombstones WHERE seq > ? ORDER BY seq", (self._tombstone_seq,)
+            ).fetchall()
+        if not new:
+            return np.empty(0, dtype=np.int64)
+        self._tombstone_seq = new[-1][0]
+        return np.array([row_id for _, row_id in new], dtype=np.int64)
+
+    def catch_up(self, num_rows: int) -> int:
+        """
+        只读副本使用：把其他进程已提交的 [index.num_rows, num_rows) 行补进内存倒排索引。
+        按主键范围读取，开销只与新增行数有关；返回当前已提交、可以对读者可见的行数。
+        """
+        start = self.index.num_rows
+        if num_rows <= start:
+            return start
+        metadatas = []
+        with self._lock:
+            for row_id, text in self._conn.execute(
+                "SELECT row_id, metadata FROM documents WHERE row_id >= ? AND row_id < ? ORDER BY row_id",
+                (start, num_rows),
+            ):
+                # 只接受连续的行；写进程尚未提交的行留到下一次
+                if row_id != start + len(metadatas):
+                    break
+                metadatas.append(json.loads(text))
+        self.index.add_rows(start, metadatas)
+        return self.index.num_rows
+
+    def checkpoint(self):
+        """把 SQLite 自己的 WAL 合并进主文件并落盘；删除向量 WAL 之前调用。"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(FULL)")
+
+
+def _doc_id_of(metadata: Dict[str, Any]) -> Optional[str]:
+    value = metadata.get(DOC_ID_FIELD)
+    return str(value) if value is not None else None
@@ -0,0 +1,113 @@
+import os
+from typing import Optional
+
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "int8")
+
+# 分块把低精度编码转换成 float32 再做矩阵乘法：块足够小以留在 CPU 缓存中，
+# 临时内存也与段大小无关
+_SCORE_CHUNK_ROWS = 2048
+
+
+class QuantizedMatrix:
+    """
+    已封存段的低精度副本，只用于扫描打分。
+
+    - float16：直接存半精度，内存减半
+    - int8：按维度做标量量化 x ≈ offset + scale * code（code 为 uint8），
+      内存降为 1/4。打分时利用 x·q = offset·q + code·(scale∘q)，
+      不需要把整段反量化回 float32。
+
+    全精度向量仍保存在原段文件中（mmap），供少量候选的精确重排使用。
+    """
+
+    def __init__(self, precision: str, codes: np.ndarray,
+                 scale: Optional[np.ndarray] = None, offset: Optional[np.ndarray] = None):
+        self.precision = precision
+        self.codes = codes
+        self.scale = scale
+        self.offset = offset
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self) -> int:
+        extra = 0 if self.scale is None else self.scale.nbytes + self.offset.nbytes
+        return self.codes.nbytes + extra
+
+    @classmethod
+    def from_float32(cls, matrix: np.ndarray, precision: str) -> "QuantizedMatrix":
+        if precision == "float16":
+            return cls(precision, matrix.astype(np.float16))
+        if precision == "int8":
+            low = matrix.min(axis=0)
+            high = matrix.max(axis=0)
+            scale = (high - low) / 255.0
+            scale[scale == 0] = 1.0
+            codes = np.clip(np.rint((matrix - low) / scale), 0, 255).astype(np.uint8)
+            return cls(precision, codes, scale.astype(np.float32), low.astype(np.float32))
+        raise ValueError(f"Unsupported storage precision: {precision}")
+
+    # ---- 持久化 ----
+    @staticmethod
+    def _codes_path(prefix: str, precision: str) -> str:
+        return f"{prefix}.{'f16' if precision == 'float16' else 'q8'}.npy"
+
+    def save(self, prefix: str, atomic_write):
+        atomic_write(self._codes_path(prefix, self.precision), lambda f: np.save(f, self.codes))
+        if self.precision == "int8":
+            atomic_write(f"{prefix}.q8params.npz",
+                         lambda f: np.savez(f, scale=self.scale, offset=self.offset))
+
+    @classmethod
+    def load(cls, prefix: str, precision: str) -> Optional["QuantizedMatrix"]:
+        codes_path = cls._codes_path(prefix, precision)
+        if not os.path.exists(codes_path):
+            return None
+        codes = np.load(codes_path, mmap_mode="r")
+        if precision == "int8":
+            params_path = f"{prefix}.q8params.npz"
+            if not os.path.exists(params_path):
+                return None
+            with np.load(params_path) as params:
+                return cls(precision, codes, params["scale"], params["offset"])
+        return cls(precision, codes)
+
+    # ---- 打分 ----
+    def _prepare(self, query_vector: np.ndarray):
+        if self.precision == "int8":
+            return self.scale * query_vector, float(np.dot(self.offset, query_vector))
+        return query_vector, 0.0
+
+    def scores(self, query_vector: np.ndarray) -> np.ndarray:
+        weights, bias = self._prepare(query_vector)
+        out = np.empty(self.codes.shape[0], dtype=np.float32)
+        for start in range(0, self.codes.shape[0], _SCORE_CHUNK_ROWS):
+            chunk = self.codes[start:start + _SCORE_CHUNK_ROWS].astype(np.float32)
+            out[start:start + chunk.shape[0]] = chunk @ weights
+        return out + bias
+
+    def score_rows(self, rows: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+        weights, bias = self._prepare(query_vector)
+        return self.codes[rows].astype(np.float32) @ weights + bias
+
+    def scores_block(self, start: int, stop: int, queries: np.ndarray) -> np.ndarray:
+        """对 [start, stop) 行与一批查询打分，返回 (len(queries), stop - start)。"""
+        if self.precision == "int8":
+            weights, bias = queries * self.scale, queries @ self.offset
+        else:
+            weights, bias = queries, 0.0
+        out = np.empty((queries.shape[0], stop - start), dtype=np.float32)
+        for chunk_start in range(start, stop, _SCORE_CHUNK_ROWS):
+            chunk = self.codes[chunk_start:min(chunk_start + _SCORE_CHUNK_ROWS, stop)].astype(np.float32)
+            out[:, chunk_start - start:chunk_start - start + chunk.shape[0]] = weights @ chunk.T
+        return out + (bias[:, None] if self.precision == "int8" else 0.0)
+
+    def score_rows_batch(self, rows: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """指定行与一批查询打分，返回 (len(queries), len(rows))。"""
+        if self.precision == "int8":
+            return queries * self.scale @ self.codes[rows].astype(np.float32).T + (queries @ self.offset)[:, None]
+        return queries @ self.codes[rows].astype(np.float32).T
@@ -0,0 +1,473 @@
+import json
+import os
+import pickle
+import struct
+import zlib
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from db.quantization import QuantizedMatrix, PRECISIONS
+from db.metadata_store import MetadataStore
+
+MANIFEST_FILE = "manifest.json"
+METADATA_DB_FILE = "metadata.sqlite3"
+# 旧版单文件格式，首次启动时原地迁移为 0 号段
+LEGACY_VECTORS_FILE = "vectors.npy"
+LEGACY_METADATA_FILE = "metadata.pkl"
+
+_MIN_TAIL_CAPACITY = 64
+# WAL 记录头：payload 长度 + CRC32
+_WAL_HEADER = struct.Struct("<II")
+
+
+class StoreSnapshot:
+    """
+    某一时刻已提交数据的只读视图。
+
+    持有段数组和尾段缓冲区切片的引用；写入者之后的追加、封存或扩容
+    都不会改变已经发布的快照，所以读者无需加锁。
+
+    matrices 是全精度（float32）数据；scan 与之一一对应，是扫描打分用的
+    数据，已封存段在低精度存储模式下为 QuantizedMatrix，否则就是 matrices 本身。
+
+    已删除的行（墓碑）仍在段文件中，打分时其分数被置为 -inf，不会进入 top-k；
+    只读取墓碑行号，开销与删除数量有关，没有删除时为零。docs 是这些行号对应的
+    元数据存储，压缩换代后旧快照仍从旧的元数据取回结果。
+    """
+
+    def __init__(self, matrices: Tuple[np.ndarray, ...], dim: Optional[int],
+                 scan: Optional[Tuple[Any, ...]] = None, docs: Optional[MetadataStore] = None,
+                 deleted: Optional[np.ndarray] = None, deleted_rows: Optional[np.ndarray] = None):
+        self.matrices = matrices
+        self.scan = scan if scan is not None else matrices
+        self.dim = dim
+        self.docs = docs
+        self.starts = np.cumsum([0] + [m.shape[0] for m in matrices[:-1]]) if matrices else np.zeros(0)
+        self.num_rows = sum(m.shape[0] for m in matrices)
+        self.quantized = any(isinstance(m, QuantizedMatrix) for m in self.scan)
+        # deleted 是按行号的墓碑位图（可能比 num_rows 短或长），deleted_rows 是排好序的墓碑行号
+        self._deleted = deleted if deleted is not None else np.zeros(0, dtype=bool)
+        rows = deleted_rows if deleted_rows is not None else np.empty(0, dtype=np.int64)
+        self.deleted_rows = rows[:np.searchsorted(rows, self.num_rows)]
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    @property
+    def live_rows(self) -> int:
+        return self.num_rows - self.deleted_rows.size
+
+    def is_deleted(self, rows: np.ndarray) -> np.ndarray:
+        dead = np.zeros(rows.size, dtype=bool)
+        if self.deleted_rows.size:
+            inside = rows < self._deleted.size
+            dead[inside] = self._deleted[rows[inside]]
+        return dead
+
+    def deleted_mask(self) -> np.ndarray:
+        mask = np.zeros(self.num_rows, dtype=bool)
+        mask[self.deleted_rows] = True
+        return mask
+
+    def get_metadata(self, rows) -> List[Optional[Dict[str, Any]]]:
+        """按需取回若干行的元数据（含文档正文）。"""
+        return self.docs.get_many([int(r) for r in rows])
+
+    def match_rows(self, filters: Dict[str, Any]) -> np.ndarray:
+        """过滤表达式在该快照范围内的行号位图，已删除的行不算命中。"""
+        mask = self.docs.index.match(filters, self.num_rows)
+        mask[self.deleted_rows] = False
+        return mask
+
+    def _group_rows(self, rows: np.ndarray):
+        which = np.searchsorted(self.starts, rows, side="right") - 1
+        for seg_index in np.unique(which):
+            mask = which == seg_index
+            yield seg_index, mask, rows[mask] - self.starts[seg_index]
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """按全局行号随机读取若干行的全精度向量（用于精排）。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((rows.size, self.dim or 0), dtype=np.float32)
+        if rows.size == 0:
+            return out
+        for seg_index, mask, local_rows in self._group_rows(rows):
+            out[mask] = self.matrices[seg_index][local_rows]
+        return out
+
+    def scores(self, query_vector: np.ndarray) -> np.ndarray:
+        """对全部行打分（低精度段给出近似分数）。"""
+        out = np.concatenate([
+            m.scores(query_vector) if isinstance(m, QuantizedMatrix) else np.dot(m, query_vector)
+            for m in self.scan
+        ])
+        out[self.deleted_rows] = -np.inf
+        return out
+
+    def score_rows(self, rows: np.ndarray, query_vector: np.ndarray) -> np.ndarray:
+        """只对指定行打分（低精度段给出近似分数）。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty(rows.size, dtype=np.float32)
+        for seg_index, mask, local_rows in self._group_rows(rows):
+            m = self.scan[seg_index]
+            if isinstance(m, QuantizedMatrix):
+                out[mask] = m.score_rows(local_rows, query_vector)
+            else:
+                out[mask] = m[local_rows] @ query_vector
+        if self.deleted_rows.size:
+            out[self.is_deleted(rows)] = -np.inf
+        return out
+
+    def iter_score_blocks(self, queries: np.ndarray, block_rows: int):
+        """
+        按行分块对一批查询打分，逐块产出 (起始行号, 分数矩阵 (查询数, 块行数))。
+        每块是一次矩阵-矩阵乘法，临时内存只与块大小有关。
+        """
+        for seg_index, m in enumerate(self.scan):
+            base = int(self.starts[seg_index])
+            for start in range(0, m.shape[0], block_rows):
+                stop = min(start + block_rows, m.shape[0])
+                if isinstance(m, QuantizedMatrix):
+                    block = m.scores_block(start, stop, queries)
+                else:
+                    block = queries @ np.asarray(m[start:stop]).T
+                lo, hi = np.searchsorted(self.deleted_rows, [base + start, base + stop])
+                block[:, self.deleted_rows[lo:hi] - (base + start)] = -np.inf
+                yield base + start, block
+
+    def score_rows_batch(self, rows: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """指定行与一批查询打分，返回 (查询数, 行数)。"""
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((queries.shape[0], rows.size), dtype=np.float32)
+        for seg_index, mask, local_rows in self._group_rows(rows):
+            m = self.scan[seg_index]
+            if isinstance(m, QuantizedMatrix):
+                out[:, mask] = m.score_rows_batch(local_rows, queries)
+            else:
+                out[:, mask] = queries @ m[local_rows].T
+        if self.deleted_rows.size:
+            out[:, self.is_deleted(rows)] = -np.inf
+        return out
+
+    def scan_nbytes(self) -> int:
+        return sum(m.nbytes for m in self.scan)
+
+
+class SegmentStore:
+    """
+    追加写入、分段存储的向量文件格式。
+
+    目录结构:
+      manifest.json       已封存段列表、向量维度、下一个段号
+      seg_000000.npy      不可变段，启动时以 mmap 方式打开
+      metadata.sqlite3    按行号索引的文档正文与元数据（见 db/metadata_store.py）
+      seg_000000.f16.npy  / seg_000000.q8.npy + .q8params.npz
+                          低精度存储模式下该段的扫描副本（见 db/quantization.py）
+      wal_000001.log      尾段的预写日志，每条记录 = 长度 + CRC32 + pickle(向量, 元数据)
+
+    新向量只追加到内存中可增长的尾段并写入 WAL；尾段行数达到 segment_size
+    后封存为新的段文件，随后删除对应的 WAL。每次写入的开销与库的总规模无关。
+
+    删除也是一次追加：墓碑行号与新行写在同一条 WAL 记录里，并持久化到元数据存储，
+    段文件不变。失效行在压缩时随整个存储一起重写（见 db/compaction.py）。
+
+    并发约定：append 只能由单一写入者调用（见 db/group_commit.py）；
+    读者通过 snapshot() 获取不可变视图，永远不会被写入阻塞。
+    """
+
+    def __init__(self, root: str, segment_size: int = 16384, fsync: bool = True,
+                 precision: str = "float32"):
+        self.root = root
+        self.segment_size = segment_size
+        self.fsync = fsync
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported storage precision: {precision}")
+        self.precision = precision
+        os.makedirs(root, exist_ok=True)
+
+        self.dim: Optional[int] = None
+        # 行号 -> 元数据；某行写入这里之后才会出现在发布的快照中
+        self.docs = self._open_docs()
+        self._sealed_rows = 0
+        self._segments: List[np.ndarray] = []
+        # 与 _segments 一一对应的低精度副本（precision 为 float32 时为 None）
+        self._quantized: List[Optional[QuantizedMatrix]] = []
+        self._segment_info: List[Dict[str, int]] = []
+        self._next_id = 0
+        self._tail = np.empty((0, 0), dtype=np.float32)
+        self._tail_len = 0
+        # 墓碑：按行号的位图与排好序的行号，删除时整体替换（已发布的快照不受影响）
+        self._deleted = np.zeros(0, dtype=bool)
+        self._deleted_rows = np.empty(0, dtype=np.int64)
+        self._snapshot = StoreSnapshot((), None)
+
+        self._load()
+        self._publish()
+
+    def __len__(self) -> int:
+        return len(self._snapshot)
+
+    def _open_docs(self) -> MetadataStore:
+        return MetadataStore(self._path(METADATA_DB_FILE))
+
+    # ---- 路径 ----
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _segment_path(self, seg_id: int, ext: str) -> str:
+        return self._path(f"seg_{seg_id:06d}.{ext}")
+
+    def _wal_path(self) -> str:
+        return self._path(f"wal_{self._next_id:06d}.log")
+
+    # ---- 读取 ----
+    def snapshot(self) -> StoreSnapshot:
+        return self._snapshot
+
+    def matrices(self) -> Tuple[np.ndarray, ...]:
+        """按行号顺序返回所有段（最后一个是尾段的视图）。"""
+        return self._snapshot.matrices
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        return self._snapshot.take(rows)
+
+    def _visible_tail_rows(self) -> int:
+        return self._tail_len
+
+    def _publish(self):
+        mats = list(self._segments)
+        scan = [q if q is not None else m for m, q in zip(self._segments, self._quantized)]
+        tail_rows = self._visible_tail_rows()
+        if tail_rows:
+            # 尾段很小且一直在变，始终以 float32 扫描
+            mats.append(self._tail[:tail_rows])
+            scan.append(mats[-1])
+        # 单次引用赋值，对读者是原子的
+        self._snapshot = StoreSnapshot(tuple(mats), self.dim, tuple(scan), self.docs,
+                                       self._deleted, self._deleted_rows)
+
+    def _mark_deleted(self, rows):
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[~np.isin(rows, self._deleted_rows)] if self._deleted_rows.size else rows
+        if rows.size == 0:
+            return
+        # 写时复制：新位图替换旧位图，旧快照仍引用旧位图
+        deleted = np.zeros(max(self._deleted.size, int(rows.max()) + 1), dtype=bool)
+        deleted[:self._deleted.size] = self._deleted
+        deleted[rows] = True
+        self._deleted = deleted
+        self._deleted_rows = np.flatnonzero(deleted)
+
+    def _load_quantized(self, seg_id: int, segment: np.ndarray) -> Optional[QuantizedMatrix]:
+        """加载段的低精度副本；不存在时（例如刚切换存储精度）从全精度数据生成。"""
+        if self.precision == "float32":
+            return None
+        prefix = self._path(f"seg_{seg_id:06d}")
+        quantized = QuantizedMatrix.load(prefix, self.precision)
+        if quantized is None:
+            quantized = QuantizedMatrix.from_float32(np.asarray(segment), self.precision)
+            quantized.save(prefix, _atomic_write)
+            quantized = QuantizedMatrix.load(prefix, self.precision)
+        return quantized
+
+    # ---- 加载 ----
+    def _load(self):
+        self._migrate_legacy()
+
+        manifest_path = self._path(MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+            self.dim = manifest.get("dim")
+            self._next_id = manifest.get("next_id", 0)
+            self._segment_info = manifest.get("segments", [])
+
+        for info in self._segment_info:
+            seg_id = info["id"]
+            self._segments.append(np.load(self._segment_path(seg_id, "npy"), mmap_mode="r"))
+            self._quantized.append(self._load_quantized(seg_id, self._segments[-1]))
+            self._migrate_segment_metadata(seg_id)
+            self._sealed_rows += info["rows"]
+
+        self._mark_deleted(self.docs.read_tombstones())
+        self._remove_stale_logs()
+        self._replay_wal()
+
+    def _migrate_legacy(self):
+        """把旧版 vectors.npy / metadata.pkl 直接改名为 0 号段，无需拷贝数据。"""
+        legacy_vectors = self._path(LEGACY_VECTORS_FILE)
+        legacy_metadata = self._path(LEGACY_METADATA_FILE)
+        if os.path.exists(self._path(MANIFEST_FILE)):
+            return
+        if not (os.path.exists(legacy_vectors) and os.path.exists(legacy_metadata)):
+            return
+
+        vectors = np.load(legacy_vectors, mmap_mode="r")
+        if vectors.ndim != 2 or vectors.shape[0] == 0:
+            return
+        print(f"Migrating legacy vector database ({vectors.shape[0]} rows) to segmented format...")
+        dim, rows = int(vectors.shape[1]), int(vectors.shape[0])
+        del vectors
+        os.replace(legacy_vectors, self._segment_path(0, "npy"))
+        os.replace(legacy_metadata, self._segment_path(0, "pkl"))
+        self._write_manifest(dim=dim, next_id=1, segments=[{"id": 0, "rows": rows}])
+
+    def _migrate_segment_metadata(self, seg_id: int):
+        """旧版每段一个 pickle 元数据文件：导入 SQLite 并落盘后删除。重复执行是安全的。"""
+        pkl_path = self._segment_path(seg_id, "pkl")
+        if not os.path.exists(pkl_path):
+            return
+        with open(pkl_path, "rb") as f:
+            metas = pickle.load(f)
+        print(f"Migrating metadata of segment {seg_id} ({len(metas)} rows) to {METADATA_DB_FILE}...")
+        self.docs.put_many(self._sealed_rows, metas)
+        self.docs.checkpoint()
+        os.remove(pkl_path)
+
+    def _remove_stale_logs(self):
+        """封存完成但尚未删除的旧 WAL（段号小于 next_id）直接丢弃。"""
+        for name in os.listdir(self.root):
+            if not name.startswith("wal_"):
+                continue
+            try:
+                seg_id = int(name[4:10])
+            except ValueError:
+                continue
+            if seg_id < self._next_id:
+                os.remove(self._path(name))
+
+    def _replay_wal(self):
+        """重放当前尾段的 WAL；遇到写了一半或校验失败的记录时截断到最后一条完整记录。"""
+        wal_path = self._wal_path()
+        if not os.path.exists(wal_path):
+            return
+        with open(wal_path, "rb") as f:
+            data = f.read()
+
+        batches, offset = parse_wal(data)
+        if offset != len(data):
+            print(f"WAL {wal_path} has a torn record, truncating to {offset} bytes.")
+            with open(wal_path, "r+b") as f:
+                f.truncate(offset)
+
+        for vectors, metas, deleted in batches:
+            self._apply(vectors, metas, deleted)
+
+    # ---- 写入（单一写入者） ----
+    def append(self, vectors: np.ndarray, metas: List[Dict[str, Any]], deleted_rows=()):
+        """
+        追加一批已归一化的向量及其元数据，并删除已有的 deleted_rows 行：
+        一次 WAL 写入 + 一次 fsync，然后发布新快照。只删除时 vectors 可以是空数组。
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        deleted_rows = sorted({int(r) for r in deleted_rows})
+        if vectors.ndim != 2 or vectors.shape[0] != len(metas):
+            raise ValueError("vectors and metadata must have the same number of rows")
+        if deleted_rows and deleted_rows[-1] >= self._sealed_rows + self._tail_len:
+            raise ValueError(f"Cannot delete row {deleted_rows[-1]}: it does not exist")
+        if vectors.shape[0] == 0 and not deleted_rows:
+            return
+
+        if vectors.shape[0]:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._write_manifest()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension mismatch: expected {self.dim}, got {vectors.shape[1]}")
+            # 先预留好内存，保证 WAL 写入之后的内存更新不会失败
+            self._reserve(self._tail_len + vectors.shape[0])
+        payload = pickle.dumps((vectors, metas, deleted_rows), protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self._wal_path(), "ab") as f:
+            f.write(_WAL_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        self._apply(vectors, metas, deleted_rows)
+        if self._tail_len >= self.segment_size:
+            self._seal()
+        self._publish()
+
+    def _apply(self, vectors: np.ndarray, metas: List[Dict[str, Any]], deleted_rows=()):
+        n = vectors.shape[0]
+        if n:
+            self._reserve(self._tail_len + n)
+        self.docs.put_many(self._sealed_rows + self._tail_len, metas, deleted_rows)
+        if n:
+            # 只写入当前快照范围之外的行，已发布的快照不受影响
+            self._tail[self._tail_len:self._tail_len + n] = vectors
+            self._tail_len += n
+        self._mark_deleted(deleted_rows)
+
+    def _reserve(self, rows: int):
+        if rows <= self._tail.shape[0]:
+            return
+        capacity = max(rows, self._tail.shape[0] * 2, _MIN_TAIL_CAPACITY)
+        # 扩容时分配新缓冲区；旧快照继续引用旧缓冲区
+        grown = np.empty((capacity, self.dim), dtype=np.float32)
+        if self._tail_len:
+            grown[:self._tail_len] = self._tail[:self._tail_len]
+        self._tail = grown
+
+    def _seal(self):
+        """把尾段写成不可变段文件（以及低精度副本），并开启新的尾段。"""
+        seg_id = self._next_id
+        rows = self._tail_len
+        _atomic_write(self._segment_path(seg_id, "npy"), lambda f: np.save(f, self._tail[:rows]))
+        # 删除 WAL 之后这些行的元数据只存在于 SQLite 中，先确保落盘
+        self.docs.checkpoint()
+
+        # 低精度副本也在写 manifest 之前生成，其他进程看到新段时它已经就位
+        segment = np.load(self._segment_path(seg_id, "npy"), mmap_mode="r")
+        quantized = self._load_quantized(seg_id, self._tail[:rows])
+
+        old_wal = self._wal_path()
+        self._segment_info.append({"id": seg_id, "rows": rows})
+        self._next_id = seg_id + 1
+        # manifest 落盘后该段才算封存成功，之后旧 WAL 可以安全删除
+        self._write_manifest()
+        if os.path.exists(old_wal):
+            os.remove(old_wal)
+
+        self._segments.append(segment)
+        self._quantized.append(quantized)
+        self._tail = np.empty((_MIN_TAIL_CAPACITY, self.dim), dtype=np.float32)
+        self._tail_len = 0
+        self._sealed_rows += rows
+
+    def _write_manifest(self, dim=None, next_id=None, segments=None):
+        manifest = {
+            "dim": dim if dim is not None else self.dim,
+            "next_id": next_id if next_id is not None else self._next_id,
+            "segments": segments if segments is not None else self._segment_info,
+        }
+        _atomic_write(self._path(MANIFEST_FILE), lambda f: f.write(json.dumps(manifest).encode()))
+
+
+def parse_wal(data: bytes) -> Tuple[List[Tuple[np.ndarray, List[Dict[str, Any]], List[int]]], int]:
+    """
+    解析 WAL 字节串，返回 (完整记录列表, 已解析的字节数)；遇到不完整或校验失败的记录即停止。
+    每条记录是 (向量, 元数据列表, 删除的行号列表)，旧版记录没有最后一项。
+    """
+    offset = 0
+    batches = []
+    while offset + _WAL_HEADER.size <= len(data):
+        length, crc = _WAL_HEADER.unpack_from(data, offset)
+        payload = data[offset + _WAL_HEADER.size: offset + _WAL_HEADER.size + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            break
+        record = pickle.loads(payload)
+        batches.append(record if len(record) == 3 else (*record, []))
+        offset += _WAL_HEADER.size + length
+    return batches, offset
+
+
+def _atomic_write(path: str, write_fn):
+    """写入临时文件后 rename，保证读者看到的总是完整文件。"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
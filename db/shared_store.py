@@ -0,0 +1,325 @@
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 flock，多进程模式不可用
+    fcntl = None
+
+from db.metadata_store import MetadataStore
+from db.quantization import QuantizedMatrix
+from db.segment_store import SegmentStore, METADATA_DB_FILE, MANIFEST_FILE, parse_wal
+
+# 多进程模式（uvicorn --workers N）：
+#   - 各 worker 启动时通过 flock 选出唯一的写进程，它按单进程模式打开 SegmentStore，
+#     负责全部写入；锁随进程退出释放，读进程发现锁空出时会接替成为写进程
+#   - 其余 worker 是读进程：用 SegmentReader 以 mmap 映射同一批段文件（共享页缓存），
+#     定期增量读取写进程的 WAL 和 manifest，无需重启即可看到新数据
+#   - 读进程收到的写入在本进程完成嵌入后，通过 spool 目录转交写进程提交
+WRITER_LOCK_FILE = "writer.lock"
+WRITER_STATE_FILE = "writer.json"
+SPOOL_DIR = "spool"
+# 读进程等待写进程提交一次写入的最长时间（秒）
+SPOOL_TIMEOUT = 120.0
+# 写进程检查 spool 目录的间隔（秒）
+SPOOL_POLL_INTERVAL = 0.005
+
+
+def _write_file(path: str, data: bytes):
+    """写入临时文件后 rename，对方进程只会看到完整文件。spool 文件是临时的，不需要 fsync。"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WriterElection:
+    """
+    写进程选举：对 writer.lock 加 flock 排他锁，拿到锁的进程负责全部写入。
+    writer.json 记录当前写进程的 pid 以及它是否已经加载完成，读进程据此等待。
+    """
+
+    def __init__(self, root: str):
+        if fcntl is None:
+            raise RuntimeError("Multi-worker mode requires fcntl.flock, which is not available on this platform")
+        self._lock_path = os.path.join(root, WRITER_LOCK_FILE)
+        self._state_path = os.path.join(root, WRITER_STATE_FILE)
+        self._fd: Optional[int] = None
+
+    @property
+    def is_writer(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        """非阻塞地尝试成为写进程；已经是写进程时直接返回 True。"""
+        if self._fd is not None:
+            return True
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        # 锁在进程生命周期内一直持有，进程退出（包括崩溃）时由内核释放
+        self._fd = fd
+        self._write_state(ready=False)
+        return True
+
+    def mark_ready(self):
+        self._write_state(ready=True)
+
+    def _write_state(self, ready: bool):
+        state = {"pid": os.getpid(), "ready": ready, "since": time.time()}
+        _write_file(self._state_path, json.dumps(state).encode())
+
+    def writer_ready(self) -> bool:
+        """是否有另一个存活的进程已经作为写进程加载完成。"""
+        try:
+            with open(self._state_path, "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        pid = state.get("pid")
+        # 上次运行留下的 writer.json 的 pid 已经不存在，不算数
+        return bool(state.get("ready")) and pid != os.getpid() and isinstance(pid, int) and _pid_alive(pid)
+
+    def wait(self, poll_interval: float = 0.05) -> bool:
+        """等待直到本进程成为写进程（返回 True）或另一个写进程加载完成（返回 False）。"""
+        waiting_logged = False
+        while True:
+            if self.try_acquire():
+                return True
+            if self.writer_ready():
+                return False
+            if not waiting_logged:
+                print("Waiting for the writer process to finish loading the vector database...")
+                waiting_logged = True
+            time.sleep(poll_interval)
+
+
+class SegmentReader(SegmentStore):
+    """
+    读进程使用的只读存储视图。
+
+    已封存段与写进程一样以 mmap 打开，多个进程共享同一份页缓存；
+    尾段通过增量读取写进程的 WAL 获得。refresh() 拉取写进程新提交的数据：
+    manifest 中出现新段时映射新段并从新的 WAL 开头读起，否则从上次的偏移继续。
+    只有元数据也已提交到 SQLite 的行才会发布给查询。墓碑从 SQLite 增量读取
+    （WAL 里的删除记录在封存后就不在了）。
+    """
+
+    def __init__(self, root: str, segment_size: int = 16384, precision: str = "float32"):
+        self._wal_offset = 0
+        self._visible_tail = 0
+        self._refresh_lock = threading.Lock()
+        super().__init__(root, segment_size=segment_size, fsync=False, precision=precision)
+
+    def _open_docs(self) -> MetadataStore:
+        return MetadataStore(self._path(METADATA_DB_FILE), read_only=True)
+
+    def _load(self):
+        self._pull()
+
+    def _visible_tail_rows(self) -> int:
+        return self._visible_tail
+
+    def _load_quantized(self, seg_id: int, segment: np.ndarray) -> Optional[QuantizedMatrix]:
+        # 低精度副本由写进程生成；缺失时（两边配置不一致）只在内存中生成，不写文件
+        if self.precision == "float32":
+            return None
+        quantized = QuantizedMatrix.load(self._path(f"seg_{seg_id:06d}"), self.precision)
+        return quantized if quantized is not None else QuantizedMatrix.from_float32(np.asarray(segment), self.precision)
+
+    def append(self, vectors: np.ndarray, metas: List[Dict[str, Any]]):
+        raise RuntimeError("SegmentReader is read-only; writes are committed by the writer process")
+
+    def refresh(self) -> bool:
+        """拉取写进程的新数据并发布新快照，返回可见行或删除是否有变化。"""
+        with self._refresh_lock:
+            before = (len(self), self._deleted_rows.size)
+            self._pull()
+            self._publish()
+            return (len(self), self._deleted_rows.size) != before
+
+    def _pull(self):
+        try:
+            with open(self._path(MANIFEST_FILE), "r") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            # 空库：写进程第一次写入时才创建 manifest
+            manifest = {"dim": None, "next_id": 0, "segments": []}
+        if self.dim is None:
+            self.dim = manifest.get("dim")
+
+        segments = manifest.get("segments", [])
+        if len(segments) > len(self._segment_info):
+            for info in segments[len(self._segment_info):]:
+                seg_id = info["id"]
+                segment = np.load(self._segment_path(seg_id, "npy"), mmap_mode="r")
+                self._segments.append(segment)
+                self._quantized.append(self._load_quantized(seg_id, segment))
+                self._sealed_rows += info["rows"]
+            self._segment_info = list(segments)
+            # 新段包含了旧 WAL 中的全部行，尾段改从新的 WAL 开头读取
+            self._tail = np.empty((0, self.dim or 0), dtype=np.float32)
+            self._tail_len = 0
+            self._wal_offset = 0
+        self._next_id = manifest.get("next_id", 0)
+
+        self._read_wal()
+        committed = self.docs.catch_up(self._sealed_rows + self._tail_len)
+        self._visible_tail = max(0, min(self._tail_len, committed - self._sealed_rows))
+        self._mark_deleted(self.docs.read_tombstones())
+
+    def _read_wal(self):
+        try:
+            with open(self._wal_path(), "rb") as f:
+                f.seek(self._wal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # 写进程可能正写到一半，只消费完整的记录，剩下的留到下一次
+        batches, consumed = parse_wal(data)
+        self._wal_offset += consumed
+        for vectors, _, _ in batches:
+            if vectors.shape[0] == 0:
+                continue
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+            n = vectors.shape[0]
+            self._reserve(self._tail_len + n)
+            self._tail[self._tail_len:self._tail_len + n] = vectors
+            self._tail_len += n
+
+
+class SpoolClient:
+    """读进程一侧：把一批已嵌入的行写成 spool 文件，等待写进程提交。"""
+
+    def __init__(self, root: str, timeout: float = SPOOL_TIMEOUT):
+        self.dir = os.path.join(root, SPOOL_DIR)
+        self.timeout = timeout
+        os.makedirs(self.dir, exist_ok=True)
+
+    def submit(self, vectors: np.ndarray, metadatas: List[Dict[str, Any]],
+               delete_ids: List[str] = ()) -> Dict[str, int]:
+        """
+        阻塞直到写进程提交完成，返回提交后写进程的提交位置（见 SpoolServer）；
+        提交失败时抛出异常。
+        """
+        name = f"{os.getpid()}-{uuid.uuid4().hex}"
+        request_path = os.path.join(self.dir, name + ".req")
+        done_path = os.path.join(self.dir, name + ".done")
+        payload = (vectors, metadatas, list(delete_ids))
+        _write_file(request_path, pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+
+        deadline = time.monotonic() + self.timeout
+        delay = 0.001
+        while not os.path.exists(done_path):
+            if time.monotonic() > deadline:
+                try:
+                    os.remove(request_path)
+                except FileNotFoundError:
+                    raise TimeoutError("Writer process took over the write but did not finish in time")
+                raise TimeoutError("No writer process picked up the write")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.02)
+
+        with open(done_path, "r") as f:
+            result = json.load(f)
+        os.remove(done_path)
+        if "error" in result:
+            raise RuntimeError(f"Writer process failed to commit: {result['error']}")
+        return result["position"]
+
+
+class SpoolServer:
+    """
+    写进程一侧：后台线程轮询 spool 目录，把读进程转交的写入一次性全部提交给
+    GroupCommitWriter（可以与本进程的写入合并成同一组提交），完成后写回结果文件。
+
+    结果文件带回提交完成后的提交位置 {"generation", "rows", "tombstones"}：
+    代号、总行数和最后一个墓碑序号。读进程的视图在同一代中追上这个位置，
+    或已经切换到更新的一代时，就一定包含了这次写入（包括只有删除的写入）。
+    """
+
+    def __init__(self, root: str, submit: Callable[[np.ndarray, List[Dict[str, Any]], List[str]], Future],
+                 position: Callable[[], Dict[str, int]], poll_interval: float = SPOOL_POLL_INTERVAL):
+        self.dir = os.path.join(root, SPOOL_DIR)
+        self._submit = submit
+        self._position = position
+        self.poll_interval = poll_interval
+        self.handled = 0
+        os.makedirs(self.dir, exist_ok=True)
+        self._remove_stale()
+        self._thread = threading.Thread(target=self._run, name="vector-db-spool", daemon=True)
+        self._thread.start()
+
+    def _remove_stale(self):
+        """删除早已超时、不会再有人读取的结果文件和临时文件。"""
+        cutoff = time.time() - SPOOL_TIMEOUT
+        for name in os.listdir(self.dir):
+            if name.endswith((".done", ".tmp")):
+                path = os.path.join(self.dir, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _run(self):
+        while True:
+            try:
+                handled = self._drain()
+            except Exception as e:
+                print(f"Error processing write spool: {e}")
+                handled = 0
+            if not handled:
+                time.sleep(self.poll_interval)
+
+    def _drain(self) -> int:
+        pending = []
+        for name in sorted(n for n in os.listdir(self.dir) if n.endswith(".req")):
+            path = os.path.join(self.dir, name)
+            key = name[:-len(".req")]
+            try:
+                with open(path, "rb") as f:
+                    vectors, metadatas, delete_ids = pickle.load(f)
+                # 删除成功才算认领；删除失败说明请求方已超时撤回
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                self._reply(key, {"error": f"unreadable spool request: {e}"})
+                os.remove(path)
+                continue
+            pending.append((key, self._submit(vectors, metadatas, delete_ids)))
+
+        for key, future in pending:
+            try:
+                future.result()
+                self._reply(key, {"position": self._position()})
+            except Exception as e:
+                self._reply(key, {"error": str(e)})
+        self.handled += len(pending)
+        return len(pending)
+
+    def _reply(self, key: str, result: Dict[str, Any]):
+        _write_file(os.path.join(self.dir, key + ".done"), json.dumps(result).encode())
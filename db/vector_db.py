@@ -1,30 +1,341 @@
-import pickle
+import asyncio
+import os
+import threading
+import time
+import uuid
 import numpy as np
-import openai
 from core.config import settings
-import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+
+from db.segment_store import SegmentStore
+from db.embedding_cache import EmbeddingCache, cache_key
+from db.chunking import chunk_text, CHUNK_FIELD, CHUNK_COUNT_FIELD
+from db.dedup_index import DedupIndex, content_hash, minhash_signature, CONTENT_HASH_FIELD
+from db.ann_index import IVFIndex, top_k_indices, merge_top_k, empty_top_k
+from db.group_commit import GroupCommitWriter, Deletes
+from db.compaction import (Compactor, copy_rows, current_generation, generation_root,
+                           publish_generation, remove_stale_generations)
+from db.embedding_batcher import EmbeddingBatcher
+from db.shared_store import WriterElection, SegmentReader, SpoolClient, SpoolServer
+from db.metadata_index import is_empty_filter, TIME_FIELD, DOC_ID_FIELD
+from core.clients import get_embedding_client, get_async_embedding_client, warm_up
+from core.metrics import registry, api_call, record_timing, EMBEDDING_BATCH_SIZE
 
-# 持久化文件路径保持不变
-DB_DIR = "./vector_db_data"
-VECTORS_FILE = os.path.join(DB_DIR, "vectors.npy")
-METADATA_FILE = os.path.join(DB_DIR, "metadata.pkl")
+# 持久化目录（分段格式，见 db/segment_store.py）
+DB_DIR = settings.vector_db.data_dir
+
+# 批量查询：每次矩阵乘法最多处理的查询数与行数，用于限制临时内存
+QUERY_BATCH_CHUNK = 256
+QUERY_BATCH_BLOCK_ROWS = 16384
 
 class SimpleVectorDB:
+    """
+    构造函数只做常数时间的准备工作；段文件、元数据索引、WAL 重放和 ANN 索引
+    由 start_loading() 在后台线程中加载（main.py 的 lifespan 中启动），
+    服务无需等待数据加载即可开始接受请求。需要数据的操作会等待加载完成，
+    检索流水线则在加载完成前直接跳过检索（见 services/rag_service.py）。
+
+    多进程模式（vector_db.multi_worker）下每个 uvicorn worker 各有一个实例：
+    选举出的写进程照常读写；其余进程以只读方式映射同一批段文件、定期拉取新数据，
+    写入在本进程嵌入后转交写进程提交（见 db/shared_store.py）。
+
+    每个文档有一个 doc_id；以已有的 doc_id 写入即替换（upsert），旧行记为墓碑。
+    删除和替换留下的失效行由写进程的后台压缩清除（见 db/compaction.py）。
+
+    写入前长文档按 token 数切块（每块一行，共享 doc_id），与已有文档重复或近似重复的
+    文档在嵌入之前就被跳过（见 db/chunking.py、db/dedup_index.py）。
+    """
+
     def __init__(self):
+        self.embedding_model_name = settings.embedding.model_name
+
+        self.embedding_cache = None
+        if settings.vector_db.embedding_cache_enabled:
+            os.makedirs(DB_DIR, exist_ok=True)
+            self.embedding_cache = EmbeddingCache(
+                os.path.join(DB_DIR, "embedding_cache.sqlite3"),
+                max_memory_bytes=settings.vector_db.embedding_cache_memory_mb * 1024 * 1024,
+                max_disk_entries=settings.vector_db.embedding_cache_disk_entries,
+            )
+
+        # 写入前去重的指纹库；一个批次的查重和登记在 _dedup_lock 下完成，
+        # 并发的批次之间不会漏掉彼此正在写入的文档
+        self.dedup_index = None
+        if settings.ingest.dedup:
+            os.makedirs(DB_DIR, exist_ok=True)
+            self.dedup_index = DedupIndex(os.path.join(DB_DIR, "dedup.sqlite3"))
+        self._dedup_lock = threading.Lock()
+        self.ingest_counts = {"added": 0, "duplicate": 0, "unchanged": 0, "chunks": 0}
+
+        # 合并并发的嵌入请求；第一次需要调用嵌入API时才创建（启动时不创建线程）
+        self._batcher: Optional[EmbeddingBatcher] = None
+        self._batcher_lock = threading.Lock()
+
+        self.rescore_factor = settings.vector_db.rescore_factor
+        self.prefilter_selectivity = settings.vector_db.filter_prefilter_selectivity
+        # 元数据过滤各策略的使用次数；fallback 表示 postfilter 命中不足后改用 prefilter
+        self.filter_stats = {"prefilter": 0, "postfilter": 0, "fallback": 0}
+
+        # 以下在 _load() 完成后才可用。存储和 ANN 索引总是成对替换（压缩换代），
+        # 查询一开始取一次这个元组，之后一直使用同一对
+        self._active: Tuple[Optional[SegmentStore], Optional[IVFIndex]] = (None, None)
+        self.generation = 0
+        self._writer: Optional[GroupCommitWriter] = None
+        self._compactor: Optional[Compactor] = None
+        # 写入线程提交与压缩切换新一代互斥；同一时间只进行一次压缩
+        self._commit_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        # 唤醒后台的 ANN 索引训练线程（只在写进程中）
+        self._train_event = threading.Event()
+        # 多进程模式：写进程选举、读进程的写入转交、写进程的转交处理
+        self.multi_worker = settings.vector_db.multi_worker
+        self.refresh_interval = settings.vector_db.refresh_interval_ms / 1000.0
+        self._election: Optional[WriterElection] = None
+        self._spool_client: Optional[SpoolClient] = None
+        self._spool_server: Optional[SpoolServer] = None
+        self._refresh_lock = threading.Lock()
+        # 集合版本号：每次有新数据可见时加一，依赖检索结果的缓存据此失效
+        self.version = 0
+        self.load_seconds: Optional[float] = None
+        self._load_error: Optional[BaseException] = None
+        self._loaded = threading.Event()
+        self._load_lock = threading.Lock()
+        self._load_thread: Optional[threading.Thread] = None
+        self._register_metrics()
+
+    @property
+    def embedding_client(self):
+        return get_embedding_client()
+
+    @property
+    def store(self) -> Optional[SegmentStore]:
+        return self._active[0]
+
+    @property
+    def index(self) -> Optional[IVFIndex]:
+        return self._active[1]
+
+    # ---- 后台加载 ----
+    @property
+    def ready(self) -> bool:
+        return self._loaded.is_set() and self._load_error is None
+
+    def start_loading(self):
+        """在后台线程中打开数据库；重复调用无副作用。"""
+        with self._load_lock:
+            if self._load_thread is None:
+                self._load_thread = threading.Thread(target=self._load, name="vector-db-loader", daemon=True)
+                self._load_thread.start()
+
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> bool:
+        self.start_loading()
+        return self._loaded.wait(timeout)
+
+    def _ensure_loaded(self):
+        """阻塞直到加载完成；加载失败时抛出异常。"""
+        self.wait_until_loaded()
+        if self._load_error is not None:
+            raise RuntimeError(f"Vector database failed to load: {self._load_error}") from self._load_error
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            if not self.multi_worker:
+                self._open_writer()
+            else:
+                os.makedirs(DB_DIR, exist_ok=True)
+                self._election = WriterElection(DB_DIR)
+                if self._election.wait():
+                    self._open_writer()
+                else:
+                    self._open_reader()
+            self.load_seconds = time.perf_counter() - started
+            print(f"Loaded {len(self.store)} documents from {DB_DIR} in {self.load_seconds:.2f}s ({self.role}).")
+        except Exception as e:
+            print(f"Error loading vector database from {DB_DIR}: {e}")
+            self._load_error = e
+        finally:
+            self._loaded.set()
+        # 数据就绪后顺便预热 API 客户端的导入，第一次调用时不再付这部分开销
+        warm_up()
+
+    def _new_index(self, root: str) -> Optional[IVFIndex]:
+        if settings.vector_db.ann_index != "ivf":
+            return None
+        return IVFIndex(
+            root,
+            nlist=settings.vector_db.ann_nlist,
+            nprobe=settings.vector_db.ann_nprobe,
+            min_rows=settings.vector_db.ann_min_rows,
+        )
+
+    def _new_store(self, root: str) -> SegmentStore:
+        return SegmentStore(
+            root,
+            segment_size=settings.vector_db.segment_size,
+            fsync=settings.vector_db.wal_fsync,
+            precision=settings.vector_db.storage_precision,
+        )
+
+    def _open_writer(self):
+        # 全新的数据目录：嵌入缓存和去重都关闭时构造函数不会创建它
         os.makedirs(DB_DIR, exist_ok=True)
-        
-        # ---- 核心改动：初始化API客户端，而不是本地模型 ----
-        self.embedding_client = openai.OpenAI(
-            base_url=settings.embedding.base_url,
-            api_key=settings.embedding.api_key
+        self.generation = current_generation(DB_DIR)
+        remove_stale_generations(DB_DIR)
+        root = generation_root(DB_DIR, self.generation)
+        store = self._new_store(root)
+        index = self._new_index(root)
+        if index is not None:
+            index.sync(store)
+        self._active = (store, index)
+
+        # 所有写入都交给单一写入线程做组提交；嵌入调用在调用方线程中完成
+        self._writer = GroupCommitWriter(
+            self._commit,
+            max_rows=settings.vector_db.group_commit_max_rows,
+            window=settings.vector_db.group_commit_window_ms / 1000.0,
         )
-        self.embedding_model_name = settings.embedding.model_name
-        # ----------------------------------------------------
+        if self._election is not None:
+            self._spool_server = SpoolServer(DB_DIR, self._writer.submit, self._commit_position)
+            self._election.mark_ready()
+        self._compactor = Compactor(self._should_compact, self._compact)
+        # 上次运行时失效行已经超过阈值的库，启动后就压缩
+        self._compactor.request()
+        if index is not None:
+            threading.Thread(target=self._train_loop, name="ivf-trainer", daemon=True).start()
+            # 上次运行时行数已经够了却没来得及训练的库，启动后就训练
+            self._train_event.set()
+        if self.dedup_index is not None:
+            threading.Thread(target=self._backfill_dedup, name="dedup-backfill", daemon=True).start()
+
+    def _open_reader(self):
+        self.generation = current_generation(DB_DIR)
+        self._active = self._open_generation_readonly(self.generation)
+        self._spool_client = SpoolClient(DB_DIR)
+        threading.Thread(target=self._follow, name="vector-db-follower", daemon=True).start()
+
+    def _follow(self):
+        """读进程：定期拉取写进程的新数据；写进程退出后接替成为写进程。"""
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                if self._election.try_acquire():
+                    print("Writer process is gone, taking over writes.")
+                    with self._refresh_lock:
+                        self._open_writer()
+                    return
+                self._refresh()
+            except Exception as e:
+                print(f"Error refreshing vector database from {DB_DIR}: {e}")
+
+    def _open_generation_readonly(self, generation: int) -> Tuple[SegmentReader, Optional[IVFIndex]]:
+        root = generation_root(DB_DIR, generation)
+        store = SegmentReader(
+            root,
+            segment_size=settings.vector_db.segment_size,
+            precision=settings.vector_db.storage_precision,
+        )
+        return store, self._new_index(root)
+
+    def _refresh(self, until: Optional[Dict[str, int]] = None) -> bool:
+        """
+        读进程拉取写进程的新数据。until 是写进程返回的提交位置，
+        返回刷新后本进程的视图是否已经包含该位置之前的全部提交。
+        """
+        # 后台线程与等待自己写入可见的请求线程可能同时刷新
+        with self._refresh_lock:
+            if not isinstance(self.store, SegmentReader):
+                # 本进程已经接替成为写进程，所有已提交的写入都可见
+                return True
+            generation = current_generation(DB_DIR)
+            if generation != self.generation:
+                # 写进程完成了一次压缩：整体切换到新一代，正在进行的查询继续使用旧的快照
+                self._active = self._open_generation_readonly(generation)
+                self.generation = generation
+                self.version += 1
+                print(f"Switched to compacted vector database generation {generation} ({len(self.store)} rows).")
+            else:
+                if self.store.refresh():
+                    self.version += 1
+                if self.index is not None:
+                    self.index.refresh()
+            if until is None:
+                return True
+            if self.generation != until["generation"]:
+                # 更新的一代是在这次提交之后压缩出来的，已经包含它
+                return self.generation > until["generation"]
+            return len(self.store) >= until["rows"] and self.store.docs.tombstone_seq >= until["tombstones"]
+
+    @property
+    def role(self) -> str:
+        """"single"（单进程）、"writer" 或 "reader"。"""
+        if self._election is None:
+            return "single"
+        return "writer" if self._writer is not None else "reader"
 
-        self.vectors = np.array([])
-        self.metadata = []
-        self._load()
+    def _write(self, vectors: np.ndarray, metadatas: List[Dict[str, Any]], delete_ids: List[str] = ()):
+        """
+        提交一批行（以及要删除的文档 ID）并等待落盘；读进程转交给写进程，
+        返回前等到本进程的查询已能看到它们（超过 5 秒仍看不到时记录警告后返回）。
+        """
+        self._ensure_loaded()
+        writer = self._writer
+        if writer is not None:
+            writer.submit(vectors, metadatas, delete_ids).result()
+            return
+        position = self._spool_client.submit(vectors, metadatas, delete_ids)
+        deadline = time.monotonic() + 5.0
+        while not self._refresh(until=position):
+            if time.monotonic() > deadline:
+                # 写入已经提交，只是本进程还没看到；不抛异常，免得调用方重试一次已成功的写入
+                print(f"Warning: write committed by the writer process at {position} "
+                      f"is not visible to this reader after 5s.")
+                return
+            time.sleep(0.001)
+
+    def _commit_position(self) -> Dict[str, int]:
+        """写进程的提交位置，随 spool 的结果返回给读进程（见 SpoolServer）。"""
+        with self._commit_lock:
+            store = self.store
+            return {"generation": self.generation, "rows": len(store),
+                    "tombstones": store.docs.last_tombstone_seq()}
+
+    def __len__(self) -> int:
+        """已加载的行数；加载完成前为 0。"""
+        return len(self.store) if self.ready else 0
+
+    def _register_metrics(self):
+        """已有的计数在抓取时读取，不在热路径上重复计数。"""
+        registry.register_callback(
+            "lms_vector_db_rows", "Rows visible to readers.", "gauge",
+            lambda: {(): len(self)})
+        registry.register_callback(
+            "lms_vector_db_ready", "1 once the vector database has finished loading.", "gauge",
+            lambda: {(): 1.0 if self.ready else 0.0})
+        registry.register_callback(
+            "lms_vector_db_writer", "1 if this process commits writes (always 1 in single-process mode).", "gauge",
+            lambda: {(): 1.0 if self._writer is not None else 0.0})
+        registry.register_callback(
+            "lms_vector_db_deleted_rows", "Deleted or replaced rows not yet removed by compaction.", "gauge",
+            lambda: {(): self.store.snapshot().deleted_rows.size if self.ready else 0})
+        registry.register_callback(
+            "lms_vector_db_compactions_total", "Completed compactions.", "counter",
+            lambda: {(): self._compactor.runs if self._compactor is not None else 0})
+        registry.register_callback(
+            "lms_filter_plans_total", "Metadata-filtered searches by planner strategy.", "counter",
+            lambda: {(name,): count for name, count in self.filter_stats.items()}, ("strategy",))
+        registry.register_callback(
+            "lms_ingest_documents_total", "Documents submitted for ingestion by outcome.", "counter",
+            lambda: {(name,): self.ingest_counts[name] for name in ("added", "duplicate", "unchanged")}, ("outcome",))
+        registry.register_callback(
+            "lms_ingest_chunks_total", "Chunks (rows) written for ingested documents.", "counter",
+            lambda: {(): self.ingest_counts["chunks"]})
+        if self.embedding_cache is not None:
+            cache = self.embedding_cache
+            registry.register_callback(
+                "lms_embedding_cache_lookups_total", "Embedding cache lookups by result.", "counter",
+                lambda: {("memory_hit",): cache.memory_hits, ("disk_hit",): cache.disk_hits,
+                         ("miss",): cache.misses}, ("result",))
 
     def _embed(self, texts: List[str]) -> np.ndarray:
         """
@@ -32,69 +343,436 @@ class SimpleVectorDB:
         将文本列表通过API调用转换为向量矩阵，并进行归一化。
         """
         try:
-            # 调用OpenAI API
+            return self._request_embeddings(texts)
+        except Exception as e:
+            print(f"Error calling embedding API: {e}")
+            # 返回一个空数组或根据需要处理错误
+            return np.array([])
+        # ------------------------------------------------
+
+    def _request_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        先查嵌入缓存，只把未命中（且去重后）的文本发给API；失败时直接抛出异常。
+        """
+        keys, cached, missing = self._cache_lookup(texts)
+        vectors = self._embed_uncached(list(missing.values())) if missing else None
+        return self._cache_fill(keys, cached, missing, vectors)
+
+    async def _request_embeddings_async(self, texts: List[str]) -> np.ndarray:
+        """
+        _request_embeddings 的异步版本，使用共享连接池的 AsyncOpenAI 客户端。
+        事件循环中只查内存缓存；SQLite 磁盘层的读写会阻塞，放到线程池中执行。
+        """
+        keys, cached, missing = self._cache_lookup(texts, disk=False)
+        if missing and self.embedding_cache is not None:
+            await asyncio.to_thread(self.embedding_cache.get_disk, keys, cached)
+            missing = _missing_texts(keys, texts, cached)
+        if not missing:
+            return self._cache_fill(keys, cached, missing, None)
+        vectors = await self._embed_uncached_async(list(missing.values()))
+        return await asyncio.to_thread(self._cache_fill, keys, cached, missing, vectors)
+
+    def _get_batcher(self) -> Optional[EmbeddingBatcher]:
+        if self._batcher is None and settings.embedding.batching:
+            with self._batcher_lock:
+                if self._batcher is None:
+                    self._batcher = EmbeddingBatcher(
+                        self._call_embedding_api,
+                        window=settings.embedding.batch_window_ms / 1000.0,
+                        max_batch_size=settings.embedding.max_batch_size,
+                        max_concurrency=settings.embedding.max_concurrency,
+                        max_retries=settings.embedding.max_retries,
+                    )
+        return self._batcher
+
+    def _embed_uncached(self, texts: List[str]) -> np.ndarray:
+        """未命中缓存的文本交给合并器，与其他调用方的请求合并成一次API调用。"""
+        batcher = self._get_batcher()
+        if batcher is None:
+            # 不合并时同样按 max_batch_size 分片，单次调用不超过服务商的输入上限
+            size = settings.embedding.max_batch_size
+            return np.concatenate([self._call_embedding_api(texts[start:start + size])
+                                   for start in range(0, len(texts), size)])
+        started = time.perf_counter()
+        try:
+            return batcher.submit(texts).result()
+        finally:
+            # 合并器在自己的线程中调用API，那里拿不到本请求的耗时明细，等待时间在这里计入
+            record_timing("embedding_api", time.perf_counter() - started)
+
+    async def _embed_uncached_async(self, texts: List[str]) -> np.ndarray:
+        """与 _embed_uncached 相同，合并器关闭时改用异步客户端。"""
+        batcher = self._get_batcher()
+        if batcher is None:
+            size = settings.embedding.max_batch_size
+            return np.concatenate([await self._call_embedding_api_async(texts[start:start + size])
+                                   for start in range(0, len(texts), size)])
+        started = time.perf_counter()
+        try:
+            return await asyncio.wrap_future(batcher.submit(texts))
+        finally:
+            record_timing("embedding_api", time.perf_counter() - started)
+
+    def ingest_stats(self) -> Dict[str, Any]:
+        added = self.ingest_counts["added"]
+        return {
+            "chunk_max_tokens": settings.ingest.chunk_max_tokens,
+            "chunk_overlap_tokens": settings.ingest.chunk_overlap_tokens,
+            "dedup": self.dedup_index is not None,
+            "near_duplicate_threshold": settings.ingest.near_duplicate_threshold,
+            **self.ingest_counts,
+            "chunks_per_document": self.ingest_counts["chunks"] / added if added else 0.0,
+            "fingerprints": len(self.dedup_index) if self.dedup_index is not None else 0,
+        }
+
+    def embedding_batcher_stats(self) -> Dict[str, Any]:
+        if self._batcher is None:
+            return {"enabled": settings.embedding.batching, "api_calls": 0}
+        return {"enabled": True, **self._batcher.stats()}
+
+    def _cache_lookup(self, texts: List[str], disk: bool = True):
+        """
+        返回 (缓存键, 命中的向量或 None, 去重后未命中的 {键: 文本})。
+        disk=False 时只查内存层，调用方再自行补查磁盘层（见 _request_embeddings_async）。
+        """
+        if self.embedding_cache is None:
+            keys = [str(i) for i in range(len(texts))]
+            return keys, [None] * len(texts), dict(zip(keys, texts))
+
+        keys = [cache_key(self.embedding_model_name, text) for text in texts]
+        cached = self.embedding_cache.get_many(keys) if disk else self.embedding_cache.get_memory(keys)
+        return keys, cached, _missing_texts(keys, texts, cached)
+
+    def _cache_fill(self, keys, cached, missing, vectors) -> np.ndarray:
+        fetched: Dict[str, np.ndarray] = {}
+        if missing:
+            if self.embedding_cache is not None:
+                self.embedding_cache.put_many(list(missing.keys()), vectors)
+            fetched = dict(zip(missing.keys(), vectors))
+        return np.vstack([
+            vector if vector is not None else fetched[key]
+            for key, vector in zip(keys, cached)
+        ])
+
+    def _call_embedding_api(self, texts: List[str]) -> np.ndarray:
+        """调用嵌入API并归一化。"""
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+        # 调用OpenAI API
+        with api_call("embedding", "embeddings"):
             response = self.embedding_client.embeddings.create(
                 model=self.embedding_model_name,
                 input=texts
             )
-            # 从响应中提取嵌入向量
-            embeddings = [item.embedding for item in response.data]
-            embeddings_np = np.array(embeddings, dtype=np.float32)
+        return self._normalize_response(response, len(texts))
 
-            # 归一化向量以用于余弦相似度计算
-            norms = np.linalg.norm(embeddings_np, axis=1, keepdims=True)
-            return embeddings_np / norms
+    async def _call_embedding_api_async(self, texts: List[str]) -> np.ndarray:
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+        with api_call("embedding", "embeddings"):
+            response = await get_async_embedding_client().embeddings.create(
+                model=self.embedding_model_name,
+                input=texts
+            )
+        return self._normalize_response(response, len(texts))
+
+    @staticmethod
+    def _normalize_response(response, expected: int) -> np.ndarray:
+        # 从响应中提取嵌入向量
+        embeddings = [item.embedding for item in response.data]
+        embeddings_np = np.array(embeddings, dtype=np.float32)
+        if embeddings_np.shape[0] != expected:
+            raise ValueError(f"Embedding API returned {embeddings_np.shape[0]} vectors for {expected} inputs")
+
+        # 归一化向量以用于余弦相似度计算
+        norms = np.linalg.norm(embeddings_np, axis=1, keepdims=True)
+        return embeddings_np / norms
 
+    def add_document(self, document: str, metadata: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        添加一个新文档到数据库（只追加到尾段，不重写已有数据），返回 add_documents 的单条结果；
+        嵌入失败时返回 None。metadata 中的 doc_id 已存在时替换旧文档。
+        """
+        try:
+            result = self.add_documents([document], [metadata])[0]
         except Exception as e:
-            print(f"Error calling embedding API: {e}")
-            # 返回一个空数组或根据需要处理错误
-            return np.array([])
-        # ------------------------------------------------
+            print(f"Failed to embed document, skipping add: {e}")
+            return None
 
-    def _load(self):
-        """从磁盘加载向量和元数据 (此函数无需改动)"""
-        if os.path.exists(VECTORS_FILE) and os.path.exists(METADATA_FILE):
-            print("Loading existing vector database from disk...")
-            self.vectors = np.load(VECTORS_FILE)
-            with open(METADATA_FILE, "rb") as f:
-                self.metadata = pickle.load(f)
-            print(f"Loaded {len(self.metadata)} documents.")
+        if result["duplicate_of"] is not None:
+            print(f"Skipped duplicate document (duplicate of {result['duplicate_of']}).")
         else:
-            print("No existing database found. Starting fresh.")
-            self.vectors = np.array([])
-            self.metadata = []
+            print(f"Added new document ({result['chunks']} chunks). Total rows: {len(self.store)}")
+        return result
 
-    def _save(self):
-        """将当前的向量和元数据保存到磁盘 (此函数无需改动)"""
-        if not self.metadata:
-            return
-        np.save(VECTORS_FILE, self.vectors)
-        with open(METADATA_FILE, "wb") as f:
-            pickle.dump(self.metadata, f)
+    def add_documents(self, documents: List[str], metadatas: List[Dict[str, Any]],
+                      skip_duplicates: bool = True) -> List[Dict[str, Any]]:
+        """
+        批量添加文档：整批只调用一次嵌入API、只写入一次存储。
+        没有 doc_id 的文档自动生成一个（写回 metadatas），已有的 doc_id 替换旧文档。
+        长文档切成多块，每块一行；替换和删除都以整篇文档为单位。
 
-    def add_document(self, document: str, metadata: Dict[str, Any]):
-        """添加一个新文档到数据库 (此函数逻辑无需改动)"""
-        new_vector = self._embed([document])
-        
-        # 如果API调用失败，_embed会返回空数组
-        if new_vector.size == 0:
-            print(f"Failed to embed document, skipping add.")
-            return
+        与已有文档（包括同批中靠前的文档）完全相同或近似重复的文档既不嵌入也不写入，
+        结果中的 duplicate_of 指向已有的文档。调用方给出 doc_id 的文档按替换处理，
+        skip_duplicates 为 False 时整批都按替换处理：都只跳过同一 doc_id 内容没有变化的重写，
+        此时 duplicate_of 就是它自己的 doc_id。返回与 documents 一一对应的
+        {"doc_id": ..., "chunks": 写入的块数, "duplicate_of": 已有文档的 doc_id 或 None}。
+        嵌入失败时抛出异常，由调用方决定如何上报。
+        """
+        if not documents:
+            return []
+        self._ensure_loaded()
+        replaces = [not skip_duplicates or DOC_ID_FIELD in metadata for metadata in metadatas]
+        for metadata in metadatas:
+            metadata.setdefault(TIME_FIELD, time.time())
+            metadata.setdefault(DOC_ID_FIELD, uuid.uuid4().hex)
+        results = [{"doc_id": str(metadata[DOC_ID_FIELD]), "chunks": 0, "duplicate_of": None}
+                   for metadata in metadatas]
 
-        if self.vectors.size == 0:
-            self.vectors = new_vector
-        else:
-            self.vectors = np.vstack([self.vectors, new_vector])
-        
-        metadata['document'] = document
-        self.metadata.append(metadata)
-        
-        self._save()
-        print(f"Added new document. Total documents: {len(self.metadata)}")
+        fingerprints = []
+        tokens = []
+        if self.dedup_index is not None:
+            fingerprints = [(content_hash(document), minhash_signature(document)) for document in documents]
+            threshold = settings.ingest.near_duplicate_threshold
+            with self._dedup_lock:
+                stored = self.dedup_index.find_many(fingerprints, threshold)
+                for result, replace, (digest, signature), (exact, near) in zip(
+                        results, replaces, fingerprints, stored):
+                    pending_exact, pending_near = self.dedup_index.find_pending(digest, signature, threshold)
+                    result["duplicate_of"] = self._pick_duplicate(
+                        result["doc_id"], exact + pending_exact, near + pending_near, not replace)
+                    if result["duplicate_of"] is None:
+                        tokens.append(self.dedup_index.reserve(result["doc_id"], digest, signature))
+
+        try:
+            texts, rows = [], []
+            for i, (result, document, metadata) in enumerate(zip(results, documents, metadatas)):
+                if result["duplicate_of"] is not None:
+                    continue
+                # 同一篇文档里完全相同的块只保留一个
+                chunks = list(dict.fromkeys(chunk_text(
+                    document, settings.ingest.chunk_max_tokens, settings.ingest.chunk_overlap_tokens)))
+                result["chunks"] = len(chunks)
+                for number, chunk in enumerate(chunks):
+                    row = dict(metadata, document=chunk)
+                    if len(chunks) > 1:
+                        row[CHUNK_FIELD] = number
+                        row[CHUNK_COUNT_FIELD] = len(chunks)
+                        if fingerprints:
+                            row[CONTENT_HASH_FIELD] = fingerprints[i][0]
+                    texts.append(chunk)
+                    rows.append(row)
+            if texts:
+                vectors = self._request_embeddings(texts)
+                self._write(vectors, rows)
+            # 指纹落盘与后台重建指纹互斥，见 _backfill_dedup
+            with self._dedup_lock:
+                if self.dedup_index is not None:
+                    self.dedup_index.add_many([(result["doc_id"], digest, signature)
+                                               for result, (digest, signature) in zip(results, fingerprints)
+                                               if result["duplicate_of"] is None])
+                for result in results:
+                    if result["duplicate_of"] is None:
+                        self.ingest_counts["added"] += 1
+                        self.ingest_counts["chunks"] += result["chunks"]
+                    else:
+                        outcome = "unchanged" if result["duplicate_of"] == result["doc_id"] else "duplicate"
+                        self.ingest_counts[outcome] += 1
+        finally:
+            if tokens:
+                with self._dedup_lock:
+                    self.dedup_index.release(tokens)
+        return results
+
+    def _backfill_dedup(self, batch_size: int = 256):
+        """
+        写进程启动后在后台为指纹库中缺少的有效文档补建指纹（开启去重之前写入的文档、
+        指纹库文件丢失等），使重新导入这些文档时同样能被识别为重复。
+        切成多块的文档以各块拼接后的文本计算 MinHash 签名，内容哈希取写入时记下的值。
+        """
+        try:
+            missing = sorted(set(self.store.docs.live_doc_ids()) - self.dedup_index.doc_ids())
+            if not missing:
+                return
+            print(f"Building dedup fingerprints for {len(missing)} existing documents...")
+            for start in range(0, len(missing), batch_size):
+                doc_ids = missing[start:start + batch_size]
+                rows = self.store.docs.live_rows(doc_ids)
+                chunks: Dict[str, List[Dict[str, Any]]] = {}
+                for meta in self.store.docs.get_many(rows):
+                    if meta is not None:
+                        chunks.setdefault(str(meta.get(DOC_ID_FIELD)), []).append(meta)
+                entries = []
+                for doc_id, metas in chunks.items():
+                    metas.sort(key=lambda meta: meta.get(CHUNK_FIELD) or 0)
+                    text = "\n".join(meta.get("document", "") for meta in metas)
+                    digest = metas[0].get(CONTENT_HASH_FIELD) or content_hash(text)
+                    entries.append((doc_id, digest, minhash_signature(text)))
+                with self._dedup_lock:
+                    # 期间重新导入过的文档已经有了最新的指纹，不再覆盖
+                    known = self.dedup_index.indexed(doc_ids) | self.dedup_index.pending_doc_ids()
+                    self.dedup_index.add_many([entry for entry in entries if entry[0] not in known])
+            print(f"Dedup fingerprints built for {len(missing)} existing documents.")
+        except Exception as e:
+            print(f"Error building dedup fingerprints: {e}")
+
+    def _pick_duplicate(self, doc_id: str, exact: List[str], near: List[Tuple[str, float]],
+                        skip_duplicates: bool) -> Optional[str]:
+        """
+        从候选中选出仍然有效的重复文档（完全相同的优先，其次相似度最高的），返回其 doc_id；
+        返回 doc_id 自身表示同一文档的内容没有变化。调用方持有 _dedup_lock。
+        """
+        if not exact and not near:
+            return None
+        pending = self.dedup_index.pending_doc_ids()
 
-    def query(self, query_text: str, k: int = 5) -> List[Dict[str, Any]]:
-        """查询最相似的k个文档 (此函数逻辑无需改动)"""
-        if len(self.metadata) == 0:
+        def exists(other: str) -> bool:
+            # 指纹库可能落后于存储（例如写入后进程退出），以存储中的有效行为准
+            return other in pending or bool(self.store.docs.live_rows([other]))
+
+        if doc_id in exact and exists(doc_id):
+            return doc_id
+        if not skip_duplicates:
+            return None
+        near = sorted(near, key=lambda item: -item[1])
+        for other in exact + [other for other, _ in near]:
+            if other != doc_id and exists(other):
+                return other
+        return None
+
+    def delete_documents(self, doc_ids: List[str]) -> int:
+        """
+        按文档 ID 删除：只追加墓碑，提交后的查询立即看不到这些文档。
+        返回调用时找到的有效行数；一个都没有时不产生写入。
+        """
+        self._ensure_loaded()
+        doc_ids = [str(doc_id) for doc_id in doc_ids]
+        found = self.store.docs.live_rows(doc_ids)
+        if found:
+            self._write(np.empty((0, 0), dtype=np.float32), [], doc_ids)
+        # 指纹在墓碑提交后才删除，写入失败时文档和指纹都保持原样。提交之前同时导入的相同内容
+        # 仍会被判为这些文档的重复；提交之后查重对照存储，已删除的候选不再算数。
+        # 等待提交期间不持有 _dedup_lock，读进程转交写入可能要等好几秒
+        if self.dedup_index is not None:
+            with self._dedup_lock:
+                # 提交后又以同一 doc_id 重新写入的文档保留它的新指纹
+                docs = self.store.docs
+                relive = {str(meta.get(DOC_ID_FIELD)) for meta in docs.get_many(docs.live_rows(doc_ids)) if meta}
+                self.dedup_index.remove([doc_id for doc_id in doc_ids if doc_id not in relive])
+        return len(found)
+
+    def _commit(self, vectors: np.ndarray, metadatas: List[Dict[str, Any]], deletes: Deletes):
+        """由写入线程调用：替换/删除同 doc_id 的旧行、写入存储并增量更新 ANN 索引。"""
+        with self._commit_lock:
+            store, index = self._active
+            vectors, metadatas, doc_ids = _resolve_writes(vectors, metadatas, deletes)
+            deleted_rows = store.docs.live_rows(doc_ids) if doc_ids else []
+            store.append(vectors, metadatas, deleted_rows)
+            self.version += 1
+            if index is not None:
+                if index.trained:
+                    index.add(vectors)
+                elif index.needs_training(len(store)):
+                    # k-means 可能要几秒，交给后台线程，不阻塞这次和之后的提交
+                    self._train_event.set()
+        if deleted_rows and self._compactor is not None:
+            self._compactor.request()
+
+    # ---- ANN 索引训练（只在写进程中） ----
+    def _train_loop(self):
+        while True:
+            self._train_event.wait()
+            self._train_event.clear()
+            try:
+                self._train_index()
+            except Exception as e:
+                print(f"Error training IVF index: {e}")
+
+    def _train_index(self):
+        """
+        首次训练 IVF 索引：
+          1. 在当前快照上训练中心并分配已有行，不持有提交锁，写入照常进行
+          2. 持有提交锁装入结果，补上训练期间新提交的行
+        全程持有压缩锁，训练期间存储和索引不会被换成新一代。
+        """
+        with self._compact_lock:
+            store, index = self._active
+            if index is None or not index.needs_training(len(store)):
+                return
+            centroids, assignments = index.train(store.snapshot())
+            with self._commit_lock:
+                index.install(centroids, assignments, store)
+                self.version += 1
+
+    # ---- 压缩（只在写进程中） ----
+    def _should_compact(self) -> bool:
+        threshold = settings.vector_db.compaction_dead_fraction
+        snapshot = self.store.snapshot()
+        dead = snapshot.deleted_rows.size
+        return (threshold > 0 and dead > 0 and dead >= settings.vector_db.compaction_min_dead_rows
+                and dead >= threshold * len(snapshot))
+
+    def compact(self) -> Dict[str, Any]:
+        """立即压缩一次（不看阈值）；只有写进程可以压缩。"""
+        self._ensure_loaded()
+        if self._compactor is None:
+            raise RuntimeError("Compaction runs in the writer process")
+        return self._compactor.compact()
+
+    def _compact(self) -> Dict[str, Any]:
+        """
+        把有效行重写成新一代存储，然后原子地切换过去：
+          1. 基于当前快照复制有效行（连同元数据、ANN 分配结果）到新一代目录，不持有任何锁
+          2. 持有提交锁，补上复制期间新提交的行和删除，发布新的代号并切换
+        查询全程不被阻塞；写入只在第 2 步等待。
+        """
+        with self._compact_lock:
+            store, index = self._active
+            snapshot = store.snapshot()
+            dead = snapshot.deleted_mask()
+            keep = np.flatnonzero(~dead)
+            generation = self.generation + 1
+            root = generation_root(DB_DIR, generation)
+            remove_stale_generations(DB_DIR)
+            print(f"Compacting vector database: keeping {keep.size} of {len(snapshot)} rows (generation {generation})...")
+
+            new_store = self._new_store(root)
+            copy_rows(snapshot, new_store, keep)
+            new_index = None
+            if index is not None:
+                index.save_compacted(root, keep)
+                new_index = self._new_index(root)
+                new_index.sync(new_store)
+
+            with self._commit_lock:
+                current = store.snapshot()
+                added = np.arange(len(snapshot), len(current), dtype=np.int64)
+                copy_rows(current, new_store, added[~current.is_deleted(added)])
+                # 复制期间被删除或替换的旧行，换算成新行号后记为墓碑
+                old_rows = current.deleted_rows[current.deleted_rows < len(snapshot)]
+                newly_deleted = old_rows[~dead[old_rows]]
+                if newly_deleted.size:
+                    new_rows = np.cumsum(~dead) - 1
+                    new_store.append(np.empty((0, 0), dtype=np.float32), [], new_rows[newly_deleted])
+                if new_index is not None:
+                    new_index.sync(new_store)
+                new_store.docs.checkpoint()
+                publish_generation(DB_DIR, generation)
+                self._active = (new_store, new_index)
+                self.generation = generation
+                self.version += 1
+
+        print(f"Compaction finished: {len(current)} -> {len(new_store)} rows.")
+        return {"generation": generation, "rows_before": len(current), "rows_after": len(new_store)}
+
+    def query(self, query_text: str, k: int = 5, nprobe: Optional[int] = None,
+              exact: bool = False, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        查询最相似的k个文档。
+        ANN 索引已训练时只扫描 nprobe 个倒排表（越大召回越高）；
+        exact=True 或库较小时退回精确扫描。
+        filters 是元数据过滤表达式（见 db/metadata_index.py 的 FILTER_KEYS）。
+        """
+        self._ensure_loaded()
+        if len(self.store) == 0:
             return []
 
         query_vector = self._embed([query_text])
@@ -103,16 +781,302 @@ class SimpleVectorDB:
             print(f"Failed to embed query, returning empty results.")
             return []
 
-        similarities = np.dot(self.vectors, query_vector.T).flatten()
-        top_k_indices = np.argsort(similarities)[::-1][:k]
+        return self.search(query_vector[0], k, nprobe=nprobe, exact=exact, filters=filters)
 
-        results = []
-        for idx in top_k_indices:
-            results.append({
-                "similarity": float(similarities[idx]),
-                "metadata": self.metadata[idx]
-            })
+    async def aquery(self, query_text: str, k: int = 5, nprobe: Optional[int] = None,
+                     exact: bool = False, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """query 的异步版本：嵌入走异步客户端，相似度扫描放到线程池中不阻塞事件循环。"""
+        # 加载尚未完成时在线程中等待，不阻塞事件循环
+        if self._loaded.is_set():
+            self._ensure_loaded()
+        else:
+            await asyncio.to_thread(self._ensure_loaded)
+        if len(self.store) == 0:
+            return []
+
+        query_vector = await self.aembed_query(query_text)
+        if query_vector is None:
+            return []
+
+        return await asyncio.to_thread(self.search, query_vector, k, nprobe, exact, filters)
+
+    async def aembed_query(self, query_text: str) -> Optional[np.ndarray]:
+        """异步嵌入单条查询；失败时返回 None。"""
+        try:
+            return (await self._request_embeddings_async([query_text]))[0]
+        except Exception as e:
+            print(f"Error calling embedding API: {e}")
+            return None
+
+    def search(self, query_vector: np.ndarray, k: int = 5, nprobe: Optional[int] = None,
+               exact: bool = False, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """用已归一化的查询向量检索。"""
+        self._ensure_loaded()
+        # 整个查询只使用同一个快照，不会看到并发写入的中间状态
+        store, index = self._active
+        snapshot = store.snapshot()
+        if len(snapshot) == 0:
+            return []
+        rows, scores = self._search_rows(snapshot, index, query_vector, k, nprobe, exact, filters)
+        # 只为返回的几行取回正文和元数据
+        return self._build_results(snapshot, rows, scores)
+
+    @staticmethod
+    def _build_results(snapshot, rows: np.ndarray, scores: np.ndarray) -> List[Dict[str, Any]]:
+        metadatas = snapshot.get_metadata(rows)
+        return [
+            {"similarity": float(score), "metadata": metadata}
+            for score, metadata in zip(scores, metadatas)
+        ]
+
+    def _plan_filter(self, snapshot, filters: Optional[Dict[str, Any]]):
+        """
+        求值元数据过滤，返回 (位图, 命中行号, 策略)；没有过滤条件时返回 None。
+        命中行占比不超过 filter_prefilter_selectivity 时用 "prefilter"：只对命中行打分；
+        否则用 "postfilter"：照常走 ANN / 全量扫描，只是把未命中的行排除在 top-k 之外。
+        """
+        if is_empty_filter(filters):
+            return None
+        mask = snapshot.match_rows(filters)
+        matched = np.flatnonzero(mask)
+        selectivity = matched.size / len(snapshot)
+        strategy = "prefilter" if selectivity <= self.prefilter_selectivity else "postfilter"
+        return mask, matched, strategy
+
+    def _search_rows(self, snapshot, index: Optional[IVFIndex], query_vector: np.ndarray, k: int,
+                     nprobe: Optional[int], exact: bool, filters: Optional[Dict[str, Any]] = None):
+        """返回 (行号, 相似度)，按相似度降序。index 必须与 snapshot 属于同一代。"""
+        # 低精度存储时先多取一些候选，再用全精度向量精确重排
+        rescore = snapshot.quantized and self.rescore_factor > 0
+        fetch_k = k * self.rescore_factor if rescore else k
+        use_ann = index is not None and index.trained and not exact
+        plan = self._plan_filter(snapshot, filters)
+
+        if plan is None:
+            if use_ann:
+                rows, scores = index.search(snapshot, query_vector, fetch_k, nprobe=nprobe)
+            else:
+                # 逐段计算相似度，mmap 的段只会按需读入页缓存
+                similarities = snapshot.scores(query_vector)
+                rows = top_k_indices(similarities, fetch_k)
+                scores = similarities[rows]
+        else:
+            rows, scores = self._filtered_candidates(snapshot, index, query_vector, fetch_k, nprobe, use_ann, *plan)
+
+        # 有效行不足 k 个时，已删除的行（分数为 -inf）会出现在候选末尾
+        live = np.isfinite(scores)
+        if not live.all():
+            rows, scores = rows[live], scores[live]
+        if rescore:
+            exact_scores = snapshot.take(rows) @ query_vector
+            best = top_k_indices(exact_scores, k)
+            rows, scores = rows[best], exact_scores[best]
+        return rows, scores
+
+    def _filtered_candidates(self, snapshot, index: Optional[IVFIndex], query_vector: np.ndarray, fetch_k: int,
+                             nprobe: Optional[int], use_ann: bool, mask: np.ndarray, matched: np.ndarray,
+                             strategy: str):
+        wanted = min(fetch_k, matched.size)
+        if strategy == "postfilter" and use_ann:
+            # 倒排表里只对命中过滤的行打分；探查范围内命中不足时退回 prefilter
+            rows, scores = index.search(snapshot, query_vector, fetch_k, nprobe=nprobe, mask=mask)
+            if rows.size >= wanted:
+                self.filter_stats["postfilter"] += 1
+                return rows, scores
+            strategy = "fallback"
+        elif strategy == "postfilter":
+            # 命中行占多数时，连续扫描全部行再屏蔽未命中行比随机读取命中行更快
+            self.filter_stats["postfilter"] += 1
+            similarities = snapshot.scores(query_vector)
+            similarities[~mask] = -np.inf
+            rows = top_k_indices(similarities, wanted)
+            return rows, similarities[rows]
+
+        self.filter_stats[strategy] += 1
+        similarities = snapshot.score_rows(matched, query_vector)
+        best = top_k_indices(similarities, fetch_k)
+        return matched[best], similarities[best]
+
+    def query_batch(self, query_texts: List[str], k: int = 5, nprobe: Optional[int] = None,
+                    exact: bool = False, filters: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        批量查询：按嵌入的 max_batch_size 分批嵌入，再用矩阵-矩阵乘法一次为
+        一组查询打分。返回与输入一一对应的结果列表；嵌入失败的查询结果为空。
+        filters 对所有查询生效。
+        """
+        results: List[List[Dict[str, Any]]] = [[] for _ in query_texts]
+        self._ensure_loaded()
+        store, index = self._active
+        snapshot = store.snapshot()
+        if len(snapshot) == 0 or not query_texts:
+            return results
+        plan = self._plan_filter(snapshot, filters)
+
+        batch_size = settings.embedding.max_batch_size
+        for start in range(0, len(query_texts), batch_size):
+            texts = query_texts[start:start + batch_size]
+            try:
+                vectors = self._request_embeddings(texts)
+            except Exception as e:
+                print(f"Error calling embedding API for {len(texts)} queries: {e}")
+                continue
+            for chunk_start in range(0, len(texts), QUERY_BATCH_CHUNK):
+                chunk = vectors[chunk_start:chunk_start + QUERY_BATCH_CHUNK]
+                rows, scores = self._search_rows_batch(snapshot, index, chunk, k, nprobe, exact, plan)
+                for i in range(chunk.shape[0]):
+                    valid = rows[i] >= 0
+                    results[start + chunk_start + i] = self._build_results(snapshot, rows[i][valid], scores[i][valid])
         return results
 
+    def _search_rows_batch(self, snapshot, index: Optional[IVFIndex], queries: np.ndarray, k: int,
+                           nprobe: Optional[int], exact: bool, plan=None):
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        rescore = snapshot.quantized and self.rescore_factor > 0
+        fetch_k = min(k * self.rescore_factor if rescore else k, len(snapshot))
+        use_ann = index is not None and index.trained and not exact
+        mask, matched, strategy = plan if plan is not None else (None, None, None)
+
+        if strategy == "prefilter":
+            self.filter_stats["prefilter"] += 1
+            rows, scores = self._prefilter_batch(snapshot, queries, matched, fetch_k)
+        elif use_ann:
+            rows, scores = index.search_batch(snapshot, queries, fetch_k, nprobe=nprobe, mask=mask)
+            if mask is not None:
+                # 探查范围内命中不足的查询退回 prefilter
+                short = (rows >= 0).sum(axis=1) < min(fetch_k, matched.size)
+                self.filter_stats["postfilter"] += int((~short).sum())
+                if short.any():
+                    self.filter_stats["fallback"] += int(short.sum())
+                    rows[short], scores[short] = self._prefilter_batch(snapshot, queries[short], matched, fetch_k)
+        else:
+            if mask is not None:
+                self.filter_stats["postfilter"] += 1
+            rows, scores = empty_top_k(queries.shape[0], fetch_k)
+            for row_offset, block in snapshot.iter_score_blocks(queries, QUERY_BATCH_BLOCK_ROWS):
+                if mask is not None:
+                    block[:, ~mask[row_offset:row_offset + block.shape[1]]] = -np.inf
+                block_rows = np.arange(row_offset, row_offset + block.shape[1], dtype=np.int64)
+                rows, scores = merge_top_k(rows, scores, block_rows, block, fetch_k)
+
+        # 已删除的行（分数为 -inf）不参与重排
+        rows[~np.isfinite(scores)] = -1
+        if rescore:
+            # 逐个查询用全精度向量精确重排
+            scores = np.where(rows >= 0, 0.0, -np.inf).astype(np.float32)
+            for i in range(queries.shape[0]):
+                valid = rows[i] >= 0
+                scores[i, valid] = snapshot.take(rows[i, valid]) @ queries[i]
+
+        order = np.argsort(-scores, axis=1)[:, :k]
+        rows = np.take_along_axis(rows, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        rows[~np.isfinite(scores)] = -1
+        return rows, scores
+
+    @staticmethod
+    def _prefilter_batch(snapshot, queries: np.ndarray, matched: np.ndarray, fetch_k: int):
+        """只对命中过滤的行分块打分。"""
+        rows, scores = empty_top_k(queries.shape[0], fetch_k)
+        for start in range(0, matched.size, QUERY_BATCH_BLOCK_ROWS):
+            block_rows = matched[start:start + QUERY_BATCH_BLOCK_ROWS]
+            rows, scores = merge_top_k(
+                rows, scores, block_rows, snapshot.score_rows_batch(block_rows, queries), fetch_k)
+        return rows, scores
+
+    def storage_stats(self, recall_sample: int = 0, k: int = 10) -> Dict[str, Any]:
+        """
+        报告扫描数据占用的内存；recall_sample > 0 时，用库中随机抽取的向量
+        作为查询，比较当前存储精度与 float32 精确检索的 recall@k。
+        """
+        self._ensure_loaded()
+        store, index = self._active
+        snapshot = store.snapshot()
+        full_bytes = sum(m.shape[0] * m.shape[1] * 4 for m in snapshot.matrices)
+        stats: Dict[str, Any] = {
+            "precision": store.precision,
+            "rows": len(snapshot),
+            "live_rows": snapshot.live_rows,
+            "deleted_rows": int(snapshot.deleted_rows.size),
+            "scan_bytes": snapshot.scan_nbytes(),
+            "float32_bytes": full_bytes,
+            "filter_plans": dict(self.filter_stats),
+            "role": self.role,
+            "generation": self.generation,
+        }
+        if self._compactor is not None:
+            stats["compaction"] = self._compactor.stats()
+        if recall_sample <= 0 or snapshot.live_rows == 0:
+            return stats
+
+        rng = np.random.default_rng(0)
+        live = np.flatnonzero(~snapshot.deleted_mask())
+        sample = rng.choice(live, size=min(recall_sample, live.size), replace=False)
+        queries = snapshot.take(np.sort(sample))
+        # 加一点噪声，避免查询向量与库中某一行完全相同
+        queries += rng.normal(scale=0.05 / np.sqrt(queries.shape[1]), size=queries.shape).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        # 分别报告全量扫描（只体现量化误差）和 ANN 检索（量化 + 近似搜索）的召回率
+        modes = {"scan": True}
+        if index is not None and index.trained:
+            modes["ann"] = False
+        for name, exact in modes.items():
+            hits = 0
+            for query_vector in queries:
+                exact_scores = np.concatenate([m @ query_vector for m in snapshot.matrices])
+                exact_scores[snapshot.deleted_rows] = -np.inf
+                truth = top_k_indices(exact_scores, min(k, live.size))
+                found, _ = self._search_rows(snapshot, index, query_vector, k, None, exact)
+                hits += len(set(truth.tolist()) & set(found.tolist()))
+            stats[f"{name}_recall_at_{k}"] = hits / (len(queries) * min(k, live.size))
+        return stats
+
+def _resolve_writes(vectors: np.ndarray, metadatas: List[Dict[str, Any]], deletes: Deletes):
+    """
+    按提交顺序处理一组写入中的替换与删除，返回 (要写入的向量, 元数据, 需要删除旧行的文档 ID)。
+    同一组里同一个 doc_id 写入多次时只保留最后一次（一篇文档的各个块连续提交，算作一次写入）；
+    写入后又在同组内被删除的行直接丢弃。
+    """
+    latest: Dict[str, List[int]] = {}
+    dropped = set()
+    doc_ids = set()
+
+    def delete(ids):
+        for doc_id in ids:
+            dropped.update(latest.pop(doc_id, ()))
+            doc_ids.add(doc_id)
+
+    pending = 0
+    for i, meta in enumerate(metadatas):
+        while pending < len(deletes) and deletes[pending][0] <= i:
+            delete(deletes[pending][1])
+            pending += 1
+        doc_id = meta.get(DOC_ID_FIELD)
+        if doc_id is None:
+            continue
+        doc_id = str(doc_id)
+        if meta.get(CHUNK_FIELD):
+            # 同一篇文档的后续块
+            latest.setdefault(doc_id, []).append(i)
+        else:
+            dropped.update(latest.get(doc_id, ()))
+            latest[doc_id] = [i]
+        doc_ids.add(doc_id)
+    for _, ids in deletes[pending:]:
+        delete(ids)
+
+    if dropped:
+        kept = [i for i in range(len(metadatas)) if i not in dropped]
+        vectors, metadatas = vectors[kept], [metadatas[i] for i in kept]
+    return vectors, metadatas, sorted(doc_ids)
+
+def _missing_texts(keys: List[str], texts: List[str], cached: List[Optional[np.ndarray]]) -> Dict[str, str]:
+    """缓存未命中的 {键: 文本}，同一个键只保留一次。"""
+    missing: Dict[str, str] = {}
+    for key, text, vector in zip(keys, texts, cached):
+        if vector is None and key not in missing:
+            missing[key] = text
+    return missing
+
 # 创建全局客户端实例
 vector_db_client = SimpleVectorDB()
\ No newline at end of file
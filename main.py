@@ -3,14 +3,28 @@ from fastapi.responses import JSONResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware # 导入CORS中间件
 import os
+import time
+from contextlib import asynccontextmanager
 
 from api.endpoints import router as api_router
+from core.clients import close_async_clients
+from core.config import settings
+from core.metrics import (registry, start_request_timing, stop_request_timing, server_timing_header)
+from db.vector_db import vector_db_client
 from services.state_manager import state_manager
 
 # 定义前端文件所在的目录
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
 
-app = FastAPI(title="Local Memory Manager")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 数据库在后台线程中加载，端口立即开始监听；加载进度见 /api/ready
+    vector_db_client.start_loading()
+    yield
+    # 关闭共享的异步 HTTP 连接池
+    await close_async_clients()
+
+app = FastAPI(title="Local Memory Manager", lifespan=lifespan)
 
 # --- 中间件配置 ---
 
@@ -29,8 +43,8 @@ app.add_middleware(
 async def check_service_enabled(request: Request, call_next):
     # 对API路由和静态文件/根路径放行
     if request.url.path.startswith("/api") or request.url.path == "/" or "." in request.url.path:
-         # 对 /enable 接口本身放行
-        if request.url.path == "/api/enable" or state_manager.is_enabled():
+        # /enable、/metrics 和 /ready 在服务禁用时也可访问
+        if request.url.path in ("/api/enable", "/api/metrics", "/api/ready") or state_manager.is_enabled():
             response = await call_next(request)
             return response
         
@@ -45,6 +59,52 @@ async def check_service_enabled(request: Request, call_next):
     return await call_next(request)
 
 
+# 3. 请求耗时与进行中数量；按需附加 Server-Timing 响应头
+HTTP_SECONDS = registry.histogram(
+    "lms_http_request_duration_seconds", "HTTP request duration by route.", ("method", "route", "status"))
+HTTP_IN_FLIGHT = registry.gauge(
+    "lms_http_requests_in_flight", "HTTP requests currently being handled.")
+
+def _route_label(request: Request) -> str:
+    """
+    以路由模板（例如 /api/documents/{doc_id}）作标签，未匹配到路由的请求归为一类，
+    避免路径参数或任意路径导致标签无限增长。
+    """
+    route = request.scope.get("route")
+    template = getattr(route, "path", None)
+    if template is None:
+        return "unmatched"
+    # 有的 FastAPI 版本中 include_router 的前缀（/api）不在 route.path 里，从请求路径中补回
+    path = request.scope["path"]
+    regex = getattr(route, "path_regex", None)
+    if regex is not None:
+        for i, char in enumerate(path):
+            if char == "/" and regex.match(path[i:]):
+                return path[:i] + template
+    return template
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    want_timing = settings.pipeline.timing_header or request.headers.get("x-request-timing") == "1"
+    token = start_request_timing() if want_timing else None
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        with HTTP_IN_FLIGHT.track_inprogress():
+            response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        route = _route_label(request)
+        HTTP_SECONDS.observe(elapsed, method=request.method, route=route, status=status_code)
+        timings = stop_request_timing(token) if token is not None else None
+    if timings is not None:
+        # 流式响应的头部在正文之前发出，只包含此时已经完成的阶段
+        timings["total"] = elapsed
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
+
 # --- API 路由 ---
 # 将我们的API路由挂载到 /api 前缀下，与前端路由区分
 app.include_router(api_router, prefix="/api")
@@ -1,34 +1,18 @@
 import requests
 import json
-import openai
-import pathlib
+import os
 import sys
-from typing import Dict, Any
-
-from core.config import settings
-
-# 使用全局 settings（支持环境变量覆盖）
-ORCHESTRATOR_LLM_CONFIG = {
-    'base_url': settings.chat_llm.base_url,
-    'api_key': settings.chat_llm.api_key,
-    'model_name': settings.chat_llm.model_name,
-}
+from typing import Dict, Any, Iterator, Tuple
 
 # 配置微服务地址
-MICROSERVICE_URL = "http://127.0.0.1:8000"
-
-# 初始化客户端
-orchestrator_llm_client = openai.OpenAI(
-    base_url=ORCHESTRATOR_LLM_CONFIG['base_url'],
-    api_key=ORCHESTRATOR_LLM_CONFIG['api_key'],
-)
+MICROSERVICE_URL = os.environ.get("MICROSERVICE_URL", "http://127.0.0.1:8000")
 
 
 def get_rag_context(raw_prompt: str) -> str | None:
-    """第一阶段：调用微服务进行RAG检索。"""
-    endpoint = f"{MICROSERVICE_URL}/process_task"
+    """只调用微服务进行RAG检索（不做精炼）。"""
+    endpoint = f"{MICROSERVICE_URL}/api/process_task"
     payload = {"task_description": raw_prompt, "history": []}
-    
+
     try:
         response = requests.post(endpoint, json=payload, timeout=10)
         response.raise_for_status()
@@ -39,34 +23,64 @@ def get_rag_context(raw_prompt: str) -> str | None:
         raise ConnectionError(f"Error calling the local memory service: {e}")
 
 
-def refine_prompt_with_llm(raw_prompt: str, rag_context: str) -> str:
-    """第二阶段：使用Orchestrator LLM提炼上下文。"""
-    system_prompt = (
-        "You are an expert prompt engineering assistant. Your task is to analyze an original user prompt and a set of retrieved documents (context), "
-        "and then create a new, enhanced prompt. \n\n"
-        "Follow these instructions carefully:\n"
-        "1.  Read the 'Original User Prompt' to understand the user's core question or goal.\n"
-        "2.  Analyze the 'Retrieved Context'. Identify ONLY the pieces of information that are directly relevant and useful for answering the original prompt.\n"
-        "3.  IGNORE any context that is irrelevant, redundant, or confusing.\n"
-        "4.  Synthesize the useful information from the context with the original prompt.\n"
-        "5.  Your final output MUST be ONLY the new, enhanced prompt, ready to be sent to another powerful AI for the final answer. Do not answer the prompt yourself. Do not add any conversational fluff or explanations like 'Here is the enhanced prompt:'. Just output the prompt itself."
-    )
+def stream_enhanced_prompt(raw_prompt: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    调用服务端的 /api/enhance，检索与精炼都在服务端完成。
+    逐个产出 (事件名, 数据)：先是 "context"，然后是若干 "token"，最后是 "done"。
+    """
+    endpoint = f"{MICROSERVICE_URL}/api/enhance"
+
+    try:
+        response = requests.post(endpoint, json={"prompt": raw_prompt}, stream=True, timeout=(5, 120))
+        response.raise_for_status()
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "error":
+                    # 同样，向上抛出异常
+                    raise RuntimeError(data.get("detail", "Prompt enhancement failed."))
+                yield event, data
+                event = "message"
+    except requests.exceptions.RequestException as e:
+        raise ConnectionError(f"Error calling the local memory service: {e}")
+
+
+def enhance_prompt(raw_prompt: str) -> str:
+    """非流式的便捷封装：返回最终的增强提示词。"""
+    final_prompt = raw_prompt
+    for event, data in stream_enhanced_prompt(raw_prompt):
+        if event == "done":
+            final_prompt = data["prompt"]
+    return final_prompt
 
-    user_content = (
-        f"**Original User Prompt:**\n{raw_prompt}\n\n"
-        f"**Retrieved Context:**\n---\n{rag_context}\n---"
-    )
 
+def main():
+    raw_prompt = " ".join(sys.argv[1:]).strip() or sys.stdin.read().strip()
+    if not raw_prompt:
+        print("Usage: python prompt_enhancer.py <prompt>  (or pipe the prompt via stdin)", file=sys.stderr)
+        sys.exit(1)
+
+    streamed = False
     try:
-        response = orchestrator_llm_client.chat.completions.create(
-            model=ORCHESTRATOR_LLM_CONFIG['model_name'],
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_content}
-            ],
-            temperature=0.1,
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        # 同样，向上抛出异常
-        raise RuntimeError(f"An unexpected error occurred during prompt refinement: {e}")
+        for event, data in stream_enhanced_prompt(raw_prompt):
+            if event == "context":
+                found = "found" if data.get("rag_context") else "no relevant context"
+                print(f"[retrieval] {found}", file=sys.stderr)
+            elif event == "token":
+                streamed = True
+                sys.stdout.write(data["text"])
+                sys.stdout.flush()
+            elif event == "done":
+                if not streamed:
+                    sys.stdout.write(data["prompt"])
+                print()
+    except (ConnectionError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
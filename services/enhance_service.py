@@ -0,0 +1,54 @@
+# local_memory_service/services/enhance_service.py
+
+import asyncio
+import json
+from typing import AsyncIterator, Optional
+
+from core.config import settings
+from core.metrics import timed_stage, STAGE_FAILURES
+from .rag_service import rag_task
+from .llm_service import refine_prompt_stream_async
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def enhance_prompt_events(raw_prompt: str) -> AsyncIterator[str]:
+    """
+    在服务端一次完成检索、相关性门控和提示词精炼，以 SSE 事件流返回：
+      context  {"rag_context": str | null}   检索阶段结束
+      token    {"text": str}                 精炼结果的增量片段
+      done     {"prompt": str}               最终提示词（无上下文时为原始提示词）
+      error    {"detail": str}               精炼失败
+    """
+    rag_context: Optional[str] = None
+    try:
+        with timed_stage("rag"):
+            async with asyncio.timeout(settings.pipeline.rag_timeout):
+                rag_context = await rag_task(raw_prompt)
+    except TimeoutError:
+        print(f"Stage 'rag' timed out after {settings.pipeline.rag_timeout}s.")
+        STAGE_FAILURES.inc(stage="rag", reason="timeout")
+    except Exception as e:
+        # 与 /api/process_task 一样：检索失败时不带上下文继续，不中断事件流
+        print(f"Stage 'rag' failed: {e}")
+        STAGE_FAILURES.inc(stage="rag", reason="error")
+    yield _sse("context", {"rag_context": rag_context})
+
+    if not rag_context:
+        yield _sse("done", {"prompt": raw_prompt})
+        return
+
+    parts = []
+    try:
+        with timed_stage("refine"):
+            async for token in refine_prompt_stream_async(raw_prompt, rag_context):
+                parts.append(token)
+                yield _sse("token", {"text": token})
+    except Exception as e:
+        print(f"Error refining prompt: {e}")
+        STAGE_FAILURES.inc(stage="refine", reason="error")
+        yield _sse("error", {"detail": f"An unexpected error occurred during prompt refinement: {e}"})
+        return
+    yield _sse("done", {"prompt": "".join(parts).strip()})
@@ -0,0 +1,76 @@
+# local_memory_service/services/ingest_service.py
+
+import asyncio
+from typing import Dict, Any, List, Optional
+
+from core.config import settings
+from db.vector_db import vector_db_client
+
+
+class BulkIngestor:
+    """
+    批量导入协调器。
+
+    调用方逐条 submit 文档；凑满 batch_size 条后作为一个批次交给后台，
+    每批一次嵌入调用、一次存储写入。与已有文档重复的条目不写入，结果标记为 duplicate。同时进行的批次数受 concurrency 限制，
+    批次数已满时 submit 会等待，从而对上游（例如 NDJSON 流式上传）形成背压。
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, concurrency: Optional[int] = None):
+        self.batch_size = batch_size or settings.vector_db.ingest_batch_size
+        self._semaphore = asyncio.Semaphore(concurrency or settings.vector_db.ingest_concurrency)
+        self._pending: List[tuple] = []
+        self._tasks: List[asyncio.Task] = []
+        self._results: Dict[int, Dict[str, Any]] = {}
+
+    async def submit(self, index: int, document: str, metadata: Dict[str, Any]):
+        if not document or not document.strip():
+            self.fail(index, "Document is empty.")
+            return
+        self._pending.append((index, document, metadata))
+        if len(self._pending) >= self.batch_size:
+            await self._dispatch()
+
+    def fail(self, index: int, error: str):
+        """记录一条在进入批次之前就失败的条目（例如解析错误）。"""
+        self._results[index] = {"index": index, "status": "error", "error": error}
+
+    async def finish(self) -> List[Dict[str, Any]]:
+        """提交剩余条目，等待所有批次完成，按输入顺序返回逐条结果。"""
+        if self._pending:
+            await self._dispatch()
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        return [self._results[i] for i in sorted(self._results)]
+
+    async def _dispatch(self):
+        batch, self._pending = self._pending, []
+        await self._semaphore.acquire()
+        self._tasks.append(asyncio.create_task(self._run_batch(batch)))
+
+    async def _run_batch(self, batch: List[tuple]):
+        indices = [item[0] for item in batch]
+        try:
+            results = await asyncio.to_thread(
+                vector_db_client.add_documents,
+                [item[1] for item in batch],
+                [item[2] for item in batch],
+            )
+            for index, result in zip(indices, results):
+                if result["duplicate_of"] is not None:
+                    self._results[index] = {"index": index, "status": "duplicate", "doc_id": result["duplicate_of"]}
+                else:
+                    self._results[index] = {"index": index, "status": "success", "doc_id": result["doc_id"],
+                                            "chunks": result["chunks"]}
+        except Exception as e:
+            print(f"Error ingesting batch of {len(batch)} documents: {e}")
+            for index in indices:
+                self._results[index] = {"index": index, "status": "error", "error": str(e)}
+        finally:
+            self._semaphore.release()
+
+
+def summarize_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    added = sum(1 for r in results if r["status"] == "success")
+    duplicates = sum(1 for r in results if r["status"] == "duplicate")
+    return {"added": added, "duplicates": duplicates, "failed": len(results) - added - duplicates, "results": results}
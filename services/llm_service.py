@@ -1,22 +1,35 @@
-import openai
+from typing import Optional
+
 from core.config import settings
+from core.clients import get_chat_client, get_async_chat_client
+from core.metrics import api_call
 
-# 使用新的 chat_llm 配置来初始化客户端
-client = openai.OpenAI(
-    base_url=settings.chat_llm.base_url,
-    api_key=settings.chat_llm.api_key,
-)
+def _relevance_prompt(task: str) -> str:
+    return f"Is the following task related to programming, software development, or technology? Answer with only 'yes' or 'no'.\n\nTask: '{task}'"
+
+def _summary_prompt(history: list[str]) -> str:
+    history_text = "\n".join(history)
+    return f"Please provide a concise summary of the following conversation:\n\n{history_text}"
+
+def _update_summary_prompt(previous_summary: str, new_turns: list[str]) -> str:
+    new_text = "\n".join(new_turns)
+    return (
+        "Here is a concise summary of a conversation so far, followed by the messages that came after it. "
+        "Please provide an updated concise summary of the whole conversation.\n\n"
+        f"Summary so far:\n{previous_summary}\n\nNew messages:\n{new_text}"
+    )
 
 def is_task_relevant(task: str) -> bool:
-    prompt = f"Is the following task related to programming, software development, or technology? Answer with only 'yes' or 'no'.\n\nTask: '{task}'"
+    prompt = _relevance_prompt(task)
     try:
-        response = client.chat.completions.create(
-            # 使用 chat_llm 的模型名称
-            model=settings.chat_llm.model_name,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=5,
-            temperature=0.0
-        )
+        with api_call("chat", "relevance"):
+            response = get_chat_client().chat.completions.create(
+                # 使用 chat_llm 的模型名称
+                model=settings.chat_llm.model_name,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=5,
+                temperature=0.0
+            )
         answer = response.choices[0].message.content.strip().lower()
         print(f"LLM relevance check for '{task}': {answer}")
         return "yes" in answer
@@ -25,19 +38,104 @@ def is_task_relevant(task: str) -> bool:
         return False
 
 def summarize_history(history: list[str]) -> str:
-    history_text = "\n".join(history)
-    prompt = f"Please provide a concise summary of the following conversation:\n\n{history_text}"
+    prompt = _summary_prompt(history)
     try:
-        response = client.chat.completions.create(
-            # 使用 chat_llm 的模型名称
+        with api_call("chat", "summary"):
+            response = get_chat_client().chat.completions.create(
+                # 使用 chat_llm 的模型名称
+                model=settings.chat_llm.model_name,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=150,
+                temperature=0.2
+            )
+        summary = response.choices[0].message.content.strip()
+        print(f"LLM generated summary.")
+        return summary
+    except Exception as e:
+        print(f"Error summarizing history: {e}")
+        return "Summary generation failed."
+
+# ---- 异步版本：共享连接池，供 /api/process_task 使用 ----
+async def ask_task_relevance_async(task: str) -> bool:
+    """向LLM询问相关性；失败时抛出异常，便于调用方区分"否"与"出错"。"""
+    with api_call("chat", "relevance"):
+        response = await get_async_chat_client().chat.completions.create(
+            model=settings.chat_llm.model_name,
+            messages=[{"role": "user", "content": _relevance_prompt(task)}],
+            max_tokens=5,
+            temperature=0.0
+        )
+    answer = response.choices[0].message.content.strip().lower()
+    print(f"LLM relevance check for '{task}': {answer}")
+    return "yes" in answer
+
+async def is_task_relevant_async(task: str) -> bool:
+    try:
+        return await ask_task_relevance_async(task)
+    except Exception as e:
+        print(f"Error checking relevance: {e}")
+        return False
+
+async def request_summary_async(history: list[str], previous_summary: Optional[str] = None) -> str:
+    """
+    生成摘要；给出 previous_summary 时 history 只包含其后新增的轮次，LLM 只需更新摘要。
+    失败时抛出异常，便于调用方区分摘要与错误（错误结果不能被缓存）。
+    """
+    if previous_summary is None:
+        operation, prompt = "summary", _summary_prompt(history)
+    else:
+        operation, prompt = "summary_update", _update_summary_prompt(previous_summary, history)
+    with api_call("chat", operation):
+        response = await get_async_chat_client().chat.completions.create(
             model=settings.chat_llm.model_name,
             messages=[{"role": "user", "content": prompt}],
             max_tokens=150,
             temperature=0.2
         )
-        summary = response.choices[0].message.content.strip()
-        print(f"LLM generated summary.")
-        return summary
+    summary = response.choices[0].message.content.strip()
+    print(f"LLM generated summary.")
+    return summary
+
+async def summarize_history_async(history: list[str]) -> str:
+    try:
+        return await request_summary_async(history)
     except Exception as e:
         print(f"Error summarizing history: {e}")
-        return "Summary generation failed."
\ No newline at end of file
+        return "Summary generation failed."
+
+
+# ---- 提示词精炼（服务端流式） ----
+REFINE_SYSTEM_PROMPT = (
+    "You are an expert prompt engineering assistant. Your task is to analyze an original user prompt and a set of retrieved documents (context), "
+    "and then create a new, enhanced prompt. \n\n"
+    "Follow these instructions carefully:\n"
+    "1.  Read the 'Original User Prompt' to understand the user's core question or goal.\n"
+    "2.  Analyze the 'Retrieved Context'. Identify ONLY the pieces of information that are directly relevant and useful for answering the original prompt.\n"
+    "3.  IGNORE any context that is irrelevant, redundant, or confusing.\n"
+    "4.  Synthesize the useful information from the context with the original prompt.\n"
+    "5.  Your final output MUST be ONLY the new, enhanced prompt, ready to be sent to another powerful AI for the final answer. Do not answer the prompt yourself. Do not add any conversational fluff or explanations like 'Here is the enhanced prompt:'. Just output the prompt itself."
+)
+
+def _refine_messages(raw_prompt: str, rag_context: str) -> list[dict]:
+    user_content = (
+        f"**Original User Prompt:**\n{raw_prompt}\n\n"
+        f"**Retrieved Context:**\n---\n{rag_context}\n---"
+    )
+    return [
+        {"role": "system", "content": REFINE_SYSTEM_PROMPT},
+        {"role": "user", "content": user_content}
+    ]
+
+async def refine_prompt_stream_async(raw_prompt: str, rag_context: str):
+    """逐个 token 产出精炼后的提示词；出错时抛出异常。"""
+    # 计时覆盖整个流式输出，直到最后一个 token
+    with api_call("chat", "refine"):
+        stream = await get_async_chat_client().chat.completions.create(
+            model=settings.chat_llm.model_name,
+            messages=_refine_messages(raw_prompt, rag_context),
+            temperature=0.1,
+            stream=True,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -1,28 +1,62 @@
 # local_memory_service/services/rag_service.py
 
-from typing import Dict, Any, List
+import asyncio
+from typing import List, Optional
 
 # 导入新的DB客户端和LLM服务
 from db.vector_db import vector_db_client
-from .llm_service import is_task_relevant, summarize_history
+from core.metrics import timed_stage
+from .rolling_summary import rolling_summarizer
+from .relevance_gate import relevance_gate
+from .response_cache import response_cache
 
 
-def rag_task(task_description: str, result_container: Dict[str, Any]):
+async def rag_task(task_description: str) -> Optional[str]:
     """
-    RAG检索线程任务。
+    RAG检索阶段：嵌入查询 -> 本地检索 -> 相关性门控，返回拼接后的上下文。
+    门控复用检索用的查询向量和最高相似度，只有本地无法确定时才调用LLM。
+    与已缓存查询足够相似的查询直接返回缓存的结果（见 services/response_cache.py）。
     """
-    if is_task_relevant(task_description):
-        # 使用我们自己的DB进行查询
-        search_results = vector_db_client.query(task_description, k=2)
-        
-        if search_results:
-            # 从结果中提取文档文本
-            retrieved_docs = [res['metadata']['document'] for res in search_results]
-            result_container['rag_context'] = "\n---\n".join(retrieved_docs)
-
-def summary_task(history: List[str], result_container: Dict[str, Any]):
+    # 数据库仍在后台加载时 len() 为 0，直接跳过检索而不是等待
+    if len(vector_db_client) == 0:
+        return None
+
+    with timed_stage("rag.embed"):
+        query_vector = await vector_db_client.aembed_query(task_description)
+    if query_vector is None:
+        return None
+
+    # 版本号在检索之前读取：检索期间有新数据写入时，本次结果写入缓存后随即作废
+    version = vector_db_client.version
+    hit, cached_context = response_cache.lookup(query_vector, version)
+    if hit:
+        return cached_context
+
+    # 使用我们自己的DB进行查询
+    with timed_stage("rag.search"):
+        search_results = await asyncio.to_thread(vector_db_client.search, query_vector, 2)
+    if not search_results:
+        response_cache.store(query_vector, version, None)
+        return None
+
+    top_similarity = search_results[0]['similarity']
+    with timed_stage("rag.relevance"):
+        relevant = await relevance_gate.check(task_description, query_vector, top_similarity)
+    if relevant is None:
+        # 相关性判断出错：按不相关处理，但不缓存
+        return None
+    rag_context = None
+    if relevant:
+        # 从结果中提取文档文本
+        retrieved_docs = [res['metadata']['document'] for res in search_results]
+        rag_context = "\n---\n".join(retrieved_docs)
+    response_cache.store(query_vector, version, rag_context)
+    return rag_context
+
+async def summary_task(history: List[str]) -> Optional[str]:
     """
-    对话历史摘要线程任务。
+    对话历史摘要阶段：增量摘要，已摘要过的前缀不再重复发送给LLM。
     """
     if history:
-        result_container['summary'] = summarize_history(history)
\ No newline at end of file
+        return await rolling_summarizer.summarize(history)
+    return None
@@ -0,0 +1,122 @@
+# local_memory_service/services/relevance_gate.py
+
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+from core.config import settings
+from core.metrics import registry
+from .llm_service import ask_task_relevance_async
+
+
+class RelevanceGate:
+    """
+    本地相关性判断，替代每个请求一次的 "yes/no" LLM 调用。
+
+    复用检索时已经算好的查询向量，按顺序尝试：
+      1. 知识库中最相似文档的相似度 >= corpus_similarity -> 相关
+      2. 以往 LLM 判定结果的近邻加权投票，置信度 >= min_confidence -> 采用投票结果
+      3. 以上都不确定时才调用 LLM，并把结果记入判定缓存
+    """
+
+    def __init__(self, mode: str, corpus_similarity: float, neighbor_similarity: float,
+                 min_confidence: float, max_verdicts: int):
+        self.mode = mode
+        self.corpus_similarity = corpus_similarity
+        self.neighbor_similarity = neighbor_similarity
+        self.min_confidence = min_confidence
+        self.max_verdicts = max_verdicts
+
+        # 判定缓存是一个固定容量的环形缓冲区，写满后覆盖最旧的记录
+        self._vectors: Optional[np.ndarray] = None
+        self._labels = np.zeros(max_verdicts, dtype=np.float32)
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+        self.counts: Dict[str, int] = {
+            "corpus_match": 0,
+            "cached_yes": 0,
+            "cached_no": 0,
+            "llm_calls": 0,
+            "llm_errors": 0,
+        }
+
+    async def is_relevant(self, task: str, query_vector: np.ndarray,
+                          top_similarity: Optional[float]) -> bool:
+        return bool(await self.check(task, query_vector, top_similarity))
+
+    async def check(self, task: str, query_vector: np.ndarray,
+                    top_similarity: Optional[float]) -> Optional[bool]:
+        """同 is_relevant，但 LLM 调用失败时返回 None，调用方可以据此不缓存这次结果。"""
+        if self.mode != "llm":
+            local = self.decide_locally(query_vector, top_similarity)
+            if local is not None:
+                return local
+
+        self.counts["llm_calls"] += 1
+        try:
+            verdict = await ask_task_relevance_async(task)
+        except Exception as e:
+            print(f"Error checking relevance: {e}")
+            self.counts["llm_errors"] += 1
+            return None
+        self.record(query_vector, verdict)
+        return verdict
+
+    def decide_locally(self, query_vector: np.ndarray, top_similarity: Optional[float]) -> Optional[bool]:
+        """能在本地确定时返回 True/False，否则返回 None。"""
+        if top_similarity is not None and top_similarity >= self.corpus_similarity:
+            self.counts["corpus_match"] += 1
+            return True
+
+        with self._lock:
+            if self._count == 0:
+                return None
+            similarities = self._vectors[:self._count] @ query_vector
+            labels = self._labels[:self._count]
+        neighbors = similarities >= self.neighbor_similarity
+        if not neighbors.any():
+            return None
+
+        weights = similarities[neighbors]
+        p_yes = float(np.dot(weights, labels[neighbors]) / weights.sum())
+        if p_yes >= self.min_confidence:
+            self.counts["cached_yes"] += 1
+            return True
+        if p_yes <= 1.0 - self.min_confidence:
+            self.counts["cached_no"] += 1
+            return False
+        return None
+
+    def record(self, query_vector: np.ndarray, verdict: bool):
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_verdicts, query_vector.shape[0]), dtype=np.float32)
+            self._vectors[self._next] = query_vector
+            self._labels[self._next] = 1.0 if verdict else 0.0
+            self._next = (self._next + 1) % self.max_verdicts
+            self._count = min(self._count + 1, self.max_verdicts)
+
+    def stats(self) -> Dict[str, float]:
+        decisions = sum(v for k, v in self.counts.items() if k != "llm_errors")
+        local = decisions - self.counts["llm_calls"]
+        return {
+            "mode": self.mode,
+            **self.counts,
+            "cached_verdicts": self._count,
+            "local_ratio": local / decisions if decisions else 0.0,
+        }
+
+
+relevance_gate = RelevanceGate(
+    mode=settings.relevance_gate.mode,
+    corpus_similarity=settings.relevance_gate.corpus_similarity,
+    neighbor_similarity=settings.relevance_gate.neighbor_similarity,
+    min_confidence=settings.relevance_gate.min_confidence,
+    max_verdicts=settings.relevance_gate.max_verdicts,
+)
+registry.register_callback(
+    "lms_relevance_decisions_total", "Relevance gate outcomes (local shortcuts, LLM calls, LLM errors).", "counter",
+    lambda: {(name,): count for name, count in relevance_gate.counts.items()}, ("outcome",))
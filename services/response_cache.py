@@ -0,0 +1,117 @@
+# local_memory_service/services/response_cache.py
+
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+from core.metrics import registry
+
+
+class SemanticResponseCache:
+    """
+    检索阶段（rag_task）结果的语义缓存。
+
+    新查询的向量与某个已缓存查询足够相似（余弦相似度 >= min_similarity）时，
+    直接返回当时的 rag_context（包括 "不相关 / 无结果" 的 None），
+    省掉检索扫描和相关性判断；完全相同的文本连嵌入也由嵌入缓存直接给出。
+
+    每个条目记录写入时的集合版本号（SimpleVectorDB.version）。版本变化说明
+    知识库有了新数据，所有旧条目一次性作废。容量固定，写满后替换最久未使用的条目；
+    条目写入 ttl 秒后失效。
+    """
+
+    def __init__(self, enabled: bool, min_similarity: float, max_entries: int, ttl: float):
+        self.enabled = enabled
+        self.min_similarity = min_similarity
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # 与相关性门控的判定缓存一样按槽位预分配，向量矩阵在第一次写入时按维度创建
+        self._vectors: Optional[np.ndarray] = None
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._contexts: List[Optional[str]] = [None] * max_entries
+        self._count = 0
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+        self.counts: Dict[str, int] = {
+            "hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+        }
+
+    def _advance(self, version: int) -> bool:
+        """
+        遇到更新的版本时清空缓存并切换过去。并发请求可能带着更旧的版本号到达，
+        此时返回 False，既不读也不写。
+        """
+        if self._version is None or version > self._version:
+            if self._count:
+                self.counts["invalidations"] += 1
+            self._count = 0
+            self._version = version
+        return version == self._version
+
+    def lookup(self, query_vector: np.ndarray, version: int) -> Tuple[bool, Optional[str]]:
+        """返回 (是否命中, rag_context)；rag_context 为 None 也可能是一次命中。"""
+        if not self.enabled:
+            return False, None
+        now = time.monotonic()
+        with self._lock:
+            if self._advance(version) and self._count and self._vectors.shape[1] == query_vector.shape[0]:
+                similarities = self._vectors[:self._count] @ query_vector
+                similarities[self._expires[:self._count] <= now] = -np.inf
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.min_similarity:
+                    self._last_used[best] = now
+                    self.counts["hits"] += 1
+                    return True, self._contexts[best]
+        self.counts["misses"] += 1
+        return False, None
+
+    def store(self, query_vector: np.ndarray, version: int, rag_context: Optional[str]):
+        """version 应取检索开始前的版本号：检索期间有新数据写入时，这个条目随即作废。"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if not self._advance(version):
+                return
+            if self._vectors is None or self._vectors.shape[1] != query_vector.shape[0]:
+                self._vectors = np.zeros((self.max_entries, query_vector.shape[0]), dtype=np.float32)
+                self._count = 0
+            if self._count < self.max_entries:
+                slot = self._count
+                self._count += 1
+            else:
+                # 优先复用已过期的槽位，否则替换最久未使用的
+                expired = np.flatnonzero(self._expires <= now)
+                slot = int(expired[0]) if expired.size else int(np.argmin(self._last_used))
+            self._vectors[slot] = query_vector
+            self._contexts[slot] = rag_context
+            self._expires[slot] = now + self.ttl
+            self._last_used[slot] = now
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.counts["hits"] + self.counts["misses"]
+        return {
+            "enabled": self.enabled,
+            **self.counts,
+            "entries": self._count,
+            "hit_ratio": self.counts["hits"] / lookups if lookups else 0.0,
+        }
+
+
+response_cache = SemanticResponseCache(
+    enabled=settings.response_cache.enabled,
+    min_similarity=settings.response_cache.min_similarity,
+    max_entries=settings.response_cache.max_entries,
+    ttl=settings.response_cache.ttl_seconds,
+)
+registry.register_callback(
+    "lms_response_cache_lookups_total", "Semantic response cache lookups by result.", "counter",
+    lambda: {("hit",): response_cache.counts["hits"], ("miss",): response_cache.counts["misses"]}, ("result",))
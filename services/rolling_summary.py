@@ -0,0 +1,123 @@
+# local_memory_service/services/rolling_summary.py
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from core.config import settings
+from core.metrics import registry
+from .llm_service import request_summary_async
+
+SUMMARY_FAILED = "Summary generation failed."
+
+
+def prefix_keys(history: List[str]) -> List[bytes]:
+    """
+    历史每个前缀的链式哈希：keys[i] 对应 history[:i + 1]。
+    每个前缀的键只依赖它包含的轮次，一次遍历即可算出全部前缀。
+    """
+    keys = []
+    chain = b""
+    for turn in history:
+        turn_digest = hashlib.sha256(turn.encode("utf-8")).digest()
+        chain = hashlib.sha256(chain + turn_digest).digest()
+        keys.append(chain)
+    return keys
+
+
+class RollingSummarizer:
+    """
+    增量的对话摘要，替代每个请求都把完整历史交给LLM。
+
+    摘要按 "历史前缀的哈希" 缓存。新请求先找已缓存的最长前缀：
+      - 整个历史命中：直接返回缓存的摘要，不调用LLM
+      - 某个前缀命中：只把其后新增的轮次和该前缀的摘要交给LLM更新
+      - 都没有命中：摘要完整历史
+    结果以完整历史的键写回缓存。缓存为 LRU，条目写入 ttl 秒后失效；
+    LLM 失败的结果不缓存。
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # 键 -> (摘要, 过期时间)
+        self._cache: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {
+            "cached": 0,
+            "incremental": 0,
+            "full": 0,
+            "errors": 0,
+        }
+        # 增量更新时送给LLM的轮次数，与完整历史的轮次数对比可以看出节省了多少
+        self.turns_sent = 0
+        self.turns_total = 0
+
+    async def summarize(self, history: List[str]) -> str:
+        keys = prefix_keys(history)
+        cached_len, previous = self._longest_prefix(keys)
+        self.turns_total += len(history)
+
+        if cached_len == len(history):
+            self.counts["cached"] += 1
+            return previous
+
+        new_turns = history[cached_len:]
+        self.turns_sent += len(new_turns)
+        try:
+            summary = await request_summary_async(new_turns, previous)
+        except Exception as e:
+            print(f"Error summarizing history: {e}")
+            self.counts["errors"] += 1
+            return SUMMARY_FAILED
+        self.counts["incremental" if previous is not None else "full"] += 1
+        self._put(keys[-1], summary)
+        return summary
+
+    def _longest_prefix(self, keys: List[bytes]) -> Tuple[int, Optional[str]]:
+        """返回 (命中的前缀长度, 摘要)；没有命中时为 (0, None)。"""
+        if self.max_entries == 0:
+            return 0, None
+        now = time.monotonic()
+        with self._lock:
+            for length in range(len(keys), 0, -1):
+                entry = self._cache.get(keys[length - 1])
+                if entry is None:
+                    continue
+                summary, expires_at = entry
+                if expires_at <= now:
+                    del self._cache[keys[length - 1]]
+                    continue
+                self._cache.move_to_end(keys[length - 1])
+                return length, summary
+        return 0, None
+
+    def _put(self, key: bytes, summary: str):
+        if self.max_entries == 0:
+            return
+        with self._lock:
+            self._cache[key] = (summary, time.monotonic() + self.ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        requests = sum(v for k, v in self.counts.items() if k != "errors")
+        return {
+            **self.counts,
+            "entries": len(self._cache),
+            "hit_ratio": (self.counts["cached"] + self.counts["incremental"]) / requests if requests else 0.0,
+            "turns_sent": self.turns_sent,
+            "turns_total": self.turns_total,
+        }
+
+
+rolling_summarizer = RollingSummarizer(
+    max_entries=settings.summary.cache_size,
+    ttl=settings.summary.cache_ttl_seconds,
+)
+registry.register_callback(
+    "lms_summary_requests_total", "Conversation summaries by how they were produced.", "counter",
+    lambda: {(name,): count for name, count in rolling_summarizer.counts.items()}, ("outcome",))
@@ -1,16 +1,55 @@
+import json
+import os
 import threading
 
+from core.config import settings
+
+# 多进程模式下启用开关保存在数据目录中，所有 worker 读写同一个文件
+STATE_FILE = os.path.join(settings.vector_db.data_dir, "service_state.json")
+
+
 class StateManager:
-    def __init__(self):
+    def __init__(self, shared: bool = False):
         self._enabled = False
         self._lock = threading.Lock()
+        self._shared = shared
+        # 文件按 mtime 缓存，每次 is_enabled 只需一次 stat
+        self._file_mtime = None
 
     def set_enabled(self, status: bool):
         with self._lock:
             self._enabled = status
+            if self._shared:
+                self._write_file(status)
 
     def is_enabled(self) -> bool:
         with self._lock:
+            if self._shared:
+                self._read_file()
             return self._enabled
 
-state_manager = StateManager()
\ No newline at end of file
+    def _write_file(self, status: bool):
+        # 记录 uvicorn 主进程的 pid：服务整体重启后旧文件不再生效，与单进程时默认关闭一致
+        os.makedirs(os.path.dirname(STATE_FILE) or ".", exist_ok=True)
+        tmp_path = STATE_FILE + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"enabled": status, "owner": os.getppid()}, f)
+        os.replace(tmp_path, STATE_FILE)
+
+    def _read_file(self):
+        try:
+            mtime = os.stat(STATE_FILE).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._file_mtime:
+            return
+        try:
+            with open(STATE_FILE, "r") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._file_mtime = mtime
+        self._enabled = bool(state.get("enabled")) and state.get("owner") == os.getppid()
+
+
+state_manager = StateManager(shared=settings.vector_db.multi_worker)
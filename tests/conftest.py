@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 子进程开头执行：嵌入API换成确定性的词袋哈希向量，相同文本得到相同向量，测试不访问网络
+PRELUDE = textwrap.dedent("""
+    import hashlib
+
+    import numpy as np
+
+    from db.vector_db import SimpleVectorDB
+
+    def fake_embeddings(self, texts):
+        vectors = np.full((len(texts), 64), 1e-3, dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[i, int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1.0
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    SimpleVectorDB._call_embedding_api = fake_embeddings
+""")
+
+
+@pytest.fixture
+def run_vector_db(tmp_path):
+    """
+    在全新的解释器里运行脚本，数据目录为 tmp_path/data（同一个测试里多次调用即模拟重启）。
+    脚本正常结束时最后应打印 ok；模拟崩溃的脚本用 returncode 指定预期的退出码。返回子进程的标准输出。
+    """
+    data_dir = tmp_path / "data"
+
+    def run(script: str, returncode: int = 0, **env_overrides) -> str:
+        env = dict(os.environ,
+                   CHAT_BASE_URL="http://127.0.0.1:1/v1", CHAT_API_KEY="test", CHAT_MODEL_NAME="test",
+                   EMBEDDING_BASE_URL="http://127.0.0.1:1/v1", EMBEDDING_API_KEY="test",
+                   EMBEDDING_MODEL_NAME="test", VECTOR_DB_DIR=str(data_dir))
+        env.update(env_overrides)
+        completed = subprocess.run([sys.executable, "-c", PRELUDE + textwrap.dedent(script)], cwd=ROOT, env=env,
+                                   capture_output=True, text=True, timeout=120)
+        assert completed.returncode == returncode, completed.stdout + completed.stderr
+        if returncode == 0:
+            assert completed.stdout.strip().splitlines()[-1] == "ok", completed.stdout
+        return completed.stdout
+
+    run.data_dir = data_dir
+    return run
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 在全新的解释器里运行：openai / httpx 都还没有导入过，多个线程同时第一次取客户端
+COLD_START_SCRIPT = textwrap.dedent("""
+    import sys
+    import threading
+
+    assert "openai" not in sys.modules and "httpx" not in sys.modules
+
+    from core import clients
+
+    getters = [clients.warm_up, clients.get_chat_client, clients.get_embedding_client,
+               clients.get_async_chat_client, clients.get_async_embedding_client]
+    barrier = threading.Barrier(len(getters) * 4)
+    results, errors = [], []
+
+    def call(getter):
+        barrier.wait()
+        try:
+            results.append((getter.__name__, getter()))
+        except Exception as e:
+            errors.append(f"{getter.__name__}: {e!r}")
+
+    threads = [threading.Thread(target=call, args=(getter,)) for getter in getters * 4]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors, errors
+    for name in {name for name, _ in results if name != "warm_up"}:
+        assert len({id(client) for n, client in results if n == name}) == 1, name
+    print("ok")
+""")
+
+
+def test_getters_on_cold_import_from_many_threads():
+    env = dict(os.environ,
+               CHAT_BASE_URL="http://127.0.0.1:1/v1", CHAT_API_KEY="test", CHAT_MODEL_NAME="test",
+               EMBEDDING_BASE_URL="http://127.0.0.1:1/v1", EMBEDDING_API_KEY="test",
+               EMBEDDING_MODEL_NAME="test")
+    for _ in range(3):
+        completed = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], cwd=ROOT, env=env,
+                                   capture_output=True, text=True, timeout=120)
+        assert completed.returncode == 0, completed.stderr
+        assert completed.stdout.strip() == "ok"
@@ -0,0 +1,102 @@
+import os
+import textwrap
+
+# 只手动压缩，避免后台按阈值压缩干扰测试
+MANUAL_COMPACTION = {"VECTOR_DB_COMPACTION_DEAD_FRACTION": "0", "VECTOR_DB_SEGMENT_SIZE": "16"}
+
+SEED = textwrap.dedent("""
+    from db.vector_db import vector_db_client as db
+
+    docs = [f"document {i} about topic {i} with some distinct words w{i}" for i in range(40)]
+    db.add_documents(docs, [{"doc_id": f"d{i}"} for i in range(40)])
+    assert db.delete_documents([f"d{i}" for i in range(0, 40, 2)]) == 20
+""")
+
+
+def test_fresh_data_dir_loads_with_cache_and_dedup_disabled(run_vector_db):
+    for multi_worker in ("0", "1"):
+        run_vector_db("""
+            from db.vector_db import vector_db_client as db
+
+            db.wait_until_loaded()
+            assert db.ready, db._load_error
+            assert db.add_documents(["hello world"], [{"doc_id": "a"}])[0]["chunks"] == 1
+            assert db.store.docs.live_rows(["a"]) == [0]
+            print("ok")
+        """, EMBEDDING_CACHE_ENABLED="0", INGEST_DEDUP="0", VECTOR_DB_MULTI_WORKER=multi_worker,
+            VECTOR_DB_DIR=str(run_vector_db.data_dir / f"multi_worker_{multi_worker}"))
+
+
+def test_interrupted_compaction_leaves_previous_generation_usable(run_vector_db):
+    # 第一批行复制到新一代之后进程崩溃，新一代没有发布
+    run_vector_db(SEED + textwrap.dedent("""
+        import os
+        import db.vector_db as vector_db
+
+        copy_rows = vector_db.copy_rows
+
+        def crash_after_first_copy(*args):
+            copy_rows(*args)
+            os._exit(3)
+
+        vector_db.copy_rows = crash_after_first_copy
+        db.compact()
+    """), returncode=3, **MANUAL_COMPACTION)
+    assert os.path.isdir(run_vector_db.data_dir / "gen_000001")
+
+    run_vector_db("""
+        import os
+        from db.vector_db import vector_db_client as db
+
+        db.wait_until_loaded()
+        assert db.generation == 0
+        assert not os.path.exists(os.path.join(os.environ["VECTOR_DB_DIR"], "gen_000001"))
+        assert len(db.store) == 40 and db.store.snapshot().deleted_rows.size == 20
+        assert db.store.docs.live_rows([f"d{i}" for i in range(40)]) == list(range(1, 40, 2))
+        results = db.query("document 7 about topic 7 with some distinct words w7", k=1, exact=True)
+        assert results[0]["metadata"]["doc_id"] == "d7", results
+
+        # 再压缩一次可以正常完成
+        assert db.compact()["rows_after"] == 20
+        assert db.generation == 1
+        print("ok")
+    """, **MANUAL_COMPACTION)
+
+
+def test_writes_during_compaction_are_carried_into_new_generation(run_vector_db):
+    run_vector_db(SEED + textwrap.dedent("""
+        import db.vector_db as vector_db
+
+        copy_rows = vector_db.copy_rows
+        calls = []
+
+        def write_while_copying(snapshot, dst, rows):
+            calls.append(rows.size)
+            copy_rows(snapshot, dst, rows)
+            if len(calls) == 1:
+                # 快照已经复制完、还没有切换到新一代：这期间提交的写入和删除
+                db.add_documents(["written during compaction"], [{"doc_id": "late"}])
+                db.delete_documents(["d1", "d3"])
+
+        vector_db.copy_rows = write_while_copying
+        result = db.compact()
+        assert result["generation"] == 1 and db.generation == 1
+
+        live = db.store.docs.live_rows(["late", "d1", "d3", "d5"])
+        assert [meta["doc_id"] for meta in db.store.docs.get_many(live)] == ["d5", "late"]
+        assert len(db.store) - db.store.snapshot().deleted_rows.size == 19
+        print("ok")
+    """), **MANUAL_COMPACTION)
+
+    # 重启后打开的是新一代，内容不变
+    run_vector_db("""
+        from db.vector_db import vector_db_client as db
+
+        db.wait_until_loaded()
+        assert db.generation == 1
+        live = db.store.docs.live_rows(["late", "d1", "d3", "d5"])
+        assert [meta["doc_id"] for meta in db.store.docs.get_many(live)] == ["d5", "late"]
+        results = db.query("written during compaction", k=1, exact=True)
+        assert results[0]["metadata"]["doc_id"] == "late", results
+        print("ok")
+    """, **MANUAL_COMPACTION)
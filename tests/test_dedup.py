@@ -0,0 +1,84 @@
+from db.dedup_index import DedupIndex, content_hash, minhash_signature, similarity
+
+LONG = " ".join(f"sentence {i} explains how part {i} connects to module {i * 7}." for i in range(60))
+
+
+def test_content_hash_ignores_whitespace_differences():
+    assert content_hash("hello   world\n") == content_hash(" hello world")
+    assert content_hash("hello world") != content_hash("hello there world")
+
+
+def test_minhash_similarity_separates_near_duplicates_from_different_text():
+    near = LONG.replace("sentence 30 ", "sentense 30 ")
+    other = " ".join(f"unrelated line {i} about cooking {i * 3} recipes" for i in range(60))
+    assert similarity(minhash_signature(LONG), minhash_signature(near)) >= 0.9
+    assert similarity(minhash_signature(LONG), minhash_signature(other)) < 0.2
+
+
+def test_dedup_index_finds_exact_and_near_candidates(tmp_path):
+    index = DedupIndex(str(tmp_path / "dedup.sqlite3"))
+    index.add_many([("long", content_hash(LONG), minhash_signature(LONG))])
+    near = LONG.replace("module 70.", "module 71.")
+    (exact, near_exact), (other_exact, near_matches) = index.find_many(
+        [(content_hash(LONG), minhash_signature(LONG)), (content_hash(near), minhash_signature(near))], 0.9)
+    assert exact == ["long"] and near_exact == []
+    assert other_exact == [] and [doc_id for doc_id, _ in near_matches] == ["long"]
+
+    index.remove(["long"])
+    assert index.find_many([(content_hash(LONG), minhash_signature(LONG))], 0.9) == [([], [])]
+
+
+def test_exact_and_near_duplicates_are_skipped_before_embedding(run_vector_db):
+    run_vector_db("""
+        from db.vector_db import vector_db_client as db
+
+        long = " ".join(f"sentence {i} explains how part {i} connects to module {i * 7}." for i in range(60))
+        first = db.add_documents([long], [{}])[0]
+        assert first["duplicate_of"] is None
+
+        exact = db.add_documents(["  " + long.replace(" ", "  ") + "\\n"], [{}])[0]
+        near = db.add_documents([long.replace("sentence 30 ", "sentense 30 ")], [{}])[0]
+        assert exact == {"doc_id": exact["doc_id"], "chunks": 0, "duplicate_of": first["doc_id"]}, exact
+        assert near["duplicate_of"] == first["doc_id"] and near["chunks"] == 0, near
+        assert db.store.docs.live_rows([exact["doc_id"], near["doc_id"]]) == []
+
+        # 同一批里靠后的重复文档也被跳过
+        batch = db.add_documents(["a fresh note on gardening", "a fresh note on gardening"], [{}, {}])
+        assert batch[0]["duplicate_of"] is None and batch[1]["duplicate_of"] == batch[0]["doc_id"], batch
+
+        # 原文档删除后，同样的内容可以重新写入
+        db.delete_documents([first["doc_id"]])
+        again = db.add_documents([long], [{}])[0]
+        assert again["duplicate_of"] is None and again["chunks"] > 0, again
+
+        stats = db.ingest_stats()
+        assert stats["duplicate"] == 3 and stats["added"] == 3, stats
+        print("ok")
+    """)
+
+
+def test_supplied_doc_id_replaces_even_when_content_matches_another_document(run_vector_db):
+    run_vector_db("""
+        from db.vector_db import vector_db_client as db
+
+        fox = "the quick brown fox jumps over the lazy dog near the river bank"
+        tax = "an entirely different note about tax forms and filing deadlines"
+        db.add_documents([fox], [{"doc_id": "a"}])
+        db.add_documents([tax], [{"doc_id": "b"}])
+
+        # b 的新内容与 a 相同：带 doc_id 的写入是替换，不被判为 a 的重复
+        result = db.add_documents([fox], [{"doc_id": "b"}])[0]
+        assert result == {"doc_id": "b", "chunks": 1, "duplicate_of": None}, result
+        rows = db.store.docs.live_rows(["b"])
+        assert [meta["document"] for meta in db.store.docs.get_many(rows)] == [fox]
+
+        # 同一 doc_id、内容没有变化：不重写
+        result = db.add_documents([fox], [{"doc_id": "b"}])[0]
+        assert result == {"doc_id": "b", "chunks": 0, "duplicate_of": "b"}, result
+        assert db.store.docs.live_rows(["b"]) == rows
+
+        # 不带 doc_id 的相同内容仍然是重复
+        result = db.add_documents([fox], [{}])[0]
+        assert result["duplicate_of"] in ("a", "b") and result["chunks"] == 0, result
+        print("ok")
+    """)
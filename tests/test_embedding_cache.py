@@ -0,0 +1,30 @@
+import numpy as np
+
+from db.embedding_cache import EmbeddingCache
+
+
+def test_disk_tier_evicts_oldest_entries_beyond_the_cap(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_memory_bytes=0, max_disk_entries=100)
+    for start in range(0, 300, 10):
+        cache.put_many([f"k{i}" for i in range(start, start + 10)], np.full((10, 4), start, dtype=np.float32))
+
+    rows = cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    assert rows <= 100
+    assert cache.stats()["disk_evictions"] == 300 - rows
+    oldest, newest = cache.get_many(["k0", "k299"])
+    assert oldest is None
+    assert newest[0] == 290
+
+
+def test_memory_lookup_leaves_disk_entries_for_get_disk(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    EmbeddingCache(path, max_memory_bytes=1 << 20).put_many(["a", "b"], np.eye(2, dtype=np.float32))
+
+    cache = EmbeddingCache(path, max_memory_bytes=1 << 20)
+    results = cache.get_memory(["a", "b", "c"])
+    assert results == [None, None, None]
+    cache.get_disk(["a", "b", "c"], results)
+    assert results[0][0] == 1 and results[1][1] == 1 and results[2] is None
+    # 磁盘命中已回填内存
+    assert all(vector is not None for vector in cache.get_memory(["a", "b"]))
+    assert cache.stats()["disk_hits"] == 2 and cache.stats()["misses"] == 1
@@ -0,0 +1,78 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from db.segment_store import SegmentStore
+
+
+def _vectors(n: int, start: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(start).standard_normal((n, 8)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _metas(n: int, start: int = 0):
+    return [{"doc_id": f"d{i}", "document": f"text {i}"} for i in range(start, start + n)]
+
+
+def _open(root) -> SegmentStore:
+    return SegmentStore(str(root), segment_size=16, fsync=False)
+
+
+def test_committed_rows_survive_reopen(tmp_path):
+    store = _open(tmp_path)
+    vectors = _vectors(40)
+    # 40 行：两个已封存的段 + 尾段 WAL 里的 8 行
+    for start in range(0, 40, 5):
+        store.append(vectors[start:start + 5], _metas(5, start))
+
+    reopened = _open(tmp_path)
+    assert len(reopened) == 40
+    np.testing.assert_array_equal(reopened.take(np.arange(40)), vectors)
+    snapshot = reopened.snapshot()
+    assert [meta["doc_id"] for meta in snapshot.get_metadata(np.arange(40))] == [f"d{i}" for i in range(40)]
+
+
+def test_torn_trailing_wal_record_is_skipped_on_replay(tmp_path):
+    store = _open(tmp_path)
+    store.append(_vectors(3), _metas(3))
+    store.append(_vectors(2, 3), _metas(2, 3))
+    wal_path = store._wal_path()
+    intact_size = os.path.getsize(wal_path)
+    # 进程在写最后一条记录时崩溃：只写了记录头和一半的内容
+    with open(wal_path, "ab") as f:
+        f.write(struct.pack("<II", 1000, 0) + b"\x00" * 100)
+
+    reopened = _open(tmp_path)
+    assert len(reopened) == 5
+    assert os.path.getsize(wal_path) == intact_size
+    # 截断之后继续追加，重启后仍然完整
+    reopened.append(_vectors(1, 5), _metas(1, 5))
+    assert len(_open(tmp_path)) == 6
+
+
+def test_wal_record_with_bad_checksum_is_skipped_on_replay(tmp_path):
+    store = _open(tmp_path)
+    store.append(_vectors(3), _metas(3))
+    payload = b"not the payload the checksum was computed for"
+    with open(store._wal_path(), "ab") as f:
+        f.write(struct.pack("<II", len(payload), zlib.crc32(b"something else")) + payload)
+
+    reopened = _open(tmp_path)
+    assert len(reopened) == 3
+    np.testing.assert_array_equal(reopened.take(np.arange(3)), _vectors(3))
+
+
+def test_deletes_stay_deleted_after_reopen(tmp_path):
+    store = _open(tmp_path)
+    store.append(_vectors(20), _metas(20))
+    # 一行在已封存的段里，一行在尾段里；只删除的追加没有新向量
+    store.append(np.empty((0, 0), dtype=np.float32), [], [2, 18])
+    store.append(_vectors(1, 20), _metas(1, 20), [5])
+
+    reopened = _open(tmp_path)
+    assert len(reopened) == 21
+    assert reopened.snapshot().deleted_rows.tolist() == [2, 5, 18]
+    assert reopened.docs.live_rows(["d2", "d5", "d18"]) == []
+    assert reopened.docs.live_rows(["d3", "d20"]) == [3, 20]
@@ -1,6 +1,6 @@
 import streamlit as st
 # 从我们的核心逻辑文件中导入函数
-from prompt_enhancer import get_rag_context, refine_prompt_with_llm
+from prompt_enhancer import stream_enhanced_prompt, MICROSERVICE_URL
 
 # --- 页面配置 ---
 st.set_page_config(page_title="RAG Prompt Enhancer", page_icon="🤖", layout="wide")
@@ -23,20 +23,28 @@ if st.button("Enhance Prompt ✨"):
         # 使用 st.status 来显示一个漂亮的、可展开的进度框
         with st.status("Running enhancement process...", expanded=True) as status:
             try:
-                # --- 阶段一 ---
+                # 检索、门控和精炼都在服务端完成，精炼结果逐 token 推送回来
                 st.write("🔍 [Step 1] Retrieving context from local memory service...")
-                rag_context = get_rag_context(raw_prompt)
-                
-                if rag_context:
-                    st.success("✅ Context retrieved successfully.")
-                    
-                    # --- 阶段二 ---
-                    st.write("🧠 [Step 2] Refining the prompt with Orchestrator LLM...")
-                    final_prompt = refine_prompt_with_llm(raw_prompt, rag_context)
+                live_output = None
+                streamed_text = ""
+                for event, data in stream_enhanced_prompt(raw_prompt):
+                    if event == "context":
+                        if data.get("rag_context"):
+                            st.success("✅ Context retrieved successfully.")
+                            st.write("🧠 [Step 2] Refining the prompt with Orchestrator LLM...")
+                            live_output = st.empty()
+                        else:
+                            st.info("ℹ️ No relevant context found. Returning the original prompt.")
+                    elif event == "token" and live_output is not None:
+                        streamed_text += data["text"]
+                        live_output.markdown(streamed_text)
+                    elif event == "done":
+                        final_prompt = data["prompt"]
+
+                if live_output is not None:
                     st.success("✅ Prompt refined successfully.")
                     status.update(label="Enhancement complete!", state="complete", expanded=False)
                 else:
-                    st.info("ℹ️ No relevant context found. Returning the original prompt.")
                     status.update(label="Process finished.", state="complete", expanded=False)
 
             except ConnectionError as e:
@@ -62,16 +70,20 @@ with st.sidebar:
     if st.button("Add Document"):
         if new_doc_text.strip():
             try:
-                # 直接调用后端的 /add_document 接口
+                # 直接调用后端的 /api/add_document 接口
                 import requests
-                from prompt_enhancer import MICROSERVICE_URL
                 
                 response = requests.post(
-                    f"{MICROSERVICE_URL}/add_document",
+                    f"{MICROSERVICE_URL}/api/add_document",
                     json={"document": new_doc_text, "source": "frontend_input"}
                 )
                 response.raise_for_status()
-                st.success("Document added successfully!")
+                result = response.json()
+                if result.get("status") == "duplicate":
+                    # 重复粘贴的内容不会再次写入知识库
+                    st.info(f"This document is already in the knowledge base (doc_id: {result['doc_id']}).")
+                else:
+                    st.success(f"Document added successfully! ({result.get('chunks', 1)} chunks)")
             except Exception as e:
                 st.error(f"Failed to add document: {e}")
         else: